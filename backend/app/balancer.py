@@ -0,0 +1,207 @@
+import os
+import time
+import statistics
+import logging
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from sqlmodel import Session, select
+from app.models import Task, Printer, PrinterFile
+from app.enums import TaskStatus
+from app.config import settings
+from app.transfer import transfer
+from app import time_windows
+
+logger = logging.getLogger(__name__)
+
+# 代价常量：优先级按字典序压过其他所有因素；不可行 > 空闲 > 任何可行分配
+PRIORITY_WEIGHT = 1e7 # 约 115 天，远大于任何上传+打印时长
+IDLE_COST = 1e12
+INFEASIBLE = 1e13
+
+def hungarian(cost: List[List[float]]) -> List[int]:
+    """
+    最小代价指派 (Kuhn-Munkres，O(n^2·m))，要求行数 n <= 列数 m。
+    返回每一行分配到的列下标。
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1) # p[j] = 分配到第 j 列的行 (1-based)，0 表示空
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float("inf")] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = float("inf")
+            j1 = 0
+            row = cost[i0 - 1]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    result = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            result[p[j] - 1] = j - 1
+    return result
+
+class LoadBalancer:
+    """
+    多台打印机同时空闲时，把 "任务 -> 打印机" 当作一个指派问题整体求解。
+    单对代价 (秒) = 排队顺序 × BALANCER_QUEUE_WEIGHT + 上传耗时 (卡上已有则为 0)
+                  + 预计打印时长 × (该机速度系数 - 本轮最快打印机的速度系数)
+                  - 卡上已有文件时减去 SD_CACHE_LOOKAHEAD 个排队位置
+    再叠加优先级 (字典序最高)。同优先级内，卡上已有的文件最多可以越过 SD_CACHE_LOOKAHEAD 个排在前面的任务。打印时长只按打印机之间的相对快慢计入：长任务优先给快的打印机，
+    但不会因为任务短就插到前面；机型不符、需要 AMS 但打印机没有、指定了其他打印机的组合不可行。
+    时间规则 (app.time_windows) 也按不可行处理：打印机在可用时段外无法结束的任务、
+    非谷电时段的长任务都不会被选中，于是剩余窗口会被能按时打完的较短任务填满，而不是让打印机闲着。
+    纯 Python 的匈牙利算法是 O(n²·m)，每轮调度都要跑：空闲打印机超过 BALANCER_GROUP_SIZE 时分组依次求解，
+    每组只看剩余队列最前面的 candidate_limit 个任务 (32 台一组约几十毫秒，组与组之间不保证全局最优)。
+    """
+    def __init__(self):
+        self._speed_cache: Dict[int, float] = {}
+        self._speed_cache_time = 0.0
+        self._size_cache: Dict[str, int] = {}
+
+    def candidate_limit(self, free_count: int) -> int:
+        return min(settings.BALANCER_MAX_CANDIDATES, max(settings.SD_CACHE_LOOKAHEAD, free_count * 3))
+
+    def speed_factors(self, session: Session) -> Dict[int, float]:
+        """每台打印机 实际时长/预计时长 的中位数 (最近 BALANCER_HISTORY 个已完成任务)，缓存 60 秒"""
+        if time.time() - self._speed_cache_time < 60:
+            return self._speed_cache
+        rows = session.exec(
+            select(Task.assigned_printer_id, Task.started_at, Task.completed_at, Task.estimated_time)
+            .where(Task.status == TaskStatus.COMPLETED)
+            .where(Task.started_at != None)
+            .where(Task.completed_at != None)
+            .where(Task.estimated_time > 0)
+            .order_by(Task.completed_at.desc())
+            .limit(settings.BALANCER_HISTORY * 50)
+        ).all()
+        ratios = defaultdict(list)
+        for printer_id, started_at, completed_at, estimated in rows:
+            if len(ratios[printer_id]) < settings.BALANCER_HISTORY:
+                ratios[printer_id].append((completed_at - started_at).total_seconds() / estimated)
+        self._speed_cache = {pid: statistics.median(r) for pid, r in ratios.items() if r}
+        self._speed_cache_time = time.time()
+        return self._speed_cache
+
+    def _file_size(self, path: str) -> int:
+        size = self._size_cache.get(path)
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            self._size_cache[path] = size
+        return size
+
+    @staticmethod
+    def is_compatible(printer: Printer, task: Task) -> bool:
+        if task.assigned_printer_id is not None and task.assigned_printer_id != printer.id:
+            return False
+        if printer.model and task.printer_model and printer.model != task.printer_model:
+            return False
+        needs_ams = task.use_ams or (task.filament_count or 1) > 1
+        if needs_ams and printer.has_ams is False:
+            return False
+        return True
+
+    def pair_cost(self, printer: Printer, task: Task, rank: int, cached: set, speed: Dict[int, float],
+                  fastest: float, now: datetime) -> float:
+        if not self.is_compatible(printer, task):
+            return INFEASIBLE
+        hit = transfer.remote_hash(task) in cached
+        upload = 0.0 if hit else self._file_size(transfer.local_path(task)) / settings.UPLOAD_BANDWIDTH
+        factor = speed.get(printer.id, 1.0)
+        duration = (task.estimated_time or 0) * factor
+        if not time_windows.can_start(printer.availability, now, upload + duration):
+            return INFEASIBLE
+        slower = (task.estimated_time or 0) * (factor - fastest)
+        ranks = rank - (settings.SD_CACHE_LOOKAHEAD if hit else 0)
+        return -task.priority * PRIORITY_WEIGHT + ranks * settings.BALANCER_QUEUE_WEIGHT + upload + slower
+
+    def assign(self, session: Session, printers: List[Printer], tasks: List[Task],
+               avoid_failed: bool = True) -> List[Tuple[Printer, Task]]:
+        """
+        返回本轮的 (打印机, 任务) 分配；打印机可能因无可行任务而保持空闲。
+        avoid_failed: 重新排队的任务不回到上次失败的打印机 (农场只有一台打印机时调度器会关闭它)
+        """
+        if not printers or not tasks:
+            return []
+
+        cached_by_printer = defaultdict(set)
+        for printer_id, content_hash in session.exec(
+            select(PrinterFile.printer_id, PrinterFile.content_hash)
+            .where(PrinterFile.printer_id.in_([p.id for p in printers]))
+        ).all():
+            cached_by_printer[printer_id].add(content_hash)
+        speed = self.speed_factors(session)
+        fastest = min(speed.get(p.id, 1.0) for p in printers)
+        now = datetime.now()
+
+        result = []
+        remaining = list(tasks)
+        size = max(1, settings.BALANCER_GROUP_SIZE)
+        for start in range(0, len(printers), size):
+            group = printers[start:start + size]
+            candidates = remaining[:self.candidate_limit(len(group))]
+            if not candidates:
+                break
+            # 列 = 候选任务 + 每台打印机一个 "空闲" 列，保证行数 <= 列数且总有可行解
+            n = len(group)
+            cost = []
+            for i, printer in enumerate(group):
+                row = [
+                    INFEASIBLE if avoid_failed and t.last_failed_printer_id == printer.id
+                    else self.pair_cost(printer, t, rank, cached_by_printer[printer.id], speed, fastest, now)
+                    for rank, t in enumerate(candidates)
+                ]
+                row += [IDLE_COST if k == i else INFEASIBLE for k in range(n)]
+                cost.append(row)
+
+            taken = set()
+            for i, col in enumerate(hungarian(cost)):
+                if col < len(candidates) and cost[i][col] < IDLE_COST:
+                    result.append((group[i], candidates[col]))
+                    taken.add(col)
+            remaining = [t for k, t in enumerate(remaining) if k not in taken]
+        return result
+
+    def is_cached(self, session: Session, printer: Printer, task: Task) -> bool:
+        content_hash = transfer.remote_hash(task)
+        return content_hash is not None and session.exec(
+            select(PrinterFile.id)
+            .where(PrinterFile.printer_id == printer.id)
+            .where(PrinterFile.content_hash == content_hash)
+        ).first() is not None
+
+# 全局单例
+balancer = LoadBalancer()
@@ -0,0 +1,83 @@
+import time
+import threading
+import logging
+from typing import Dict, Optional
+from app.config import settings
+from app.snapshot import snapshot_cache
+
+logger = logging.getLogger(__name__)
+
+class _Breaker:
+    __slots__ = ("failures", "opened_at", "last_error")
+
+    def __init__(self):
+        self.failures = 0 # 连续失败次数
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[int] = None
+
+class CircuitBreaker:
+    """
+    按打印机统计连续失败 (打印报错/上传失败/指令发送失败)：
+    - 连续失败达到 CIRCUIT_BREAKER_THRESHOLD 次即熔断，调度器不再向其派单
+    - 任意一次成功清零计数
+    - CIRCUIT_BREAKER_RESET_AFTER > 0 时，熔断超过该时长后放行一个试探任务 (半开)：
+      成功则恢复，失败立即再次熔断；为 0 时只能通过接口手动恢复
+    """
+    def __init__(self):
+        self._breakers: Dict[int, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    def record_success(self, printer_id: int):
+        with self._lock:
+            breaker = self._breakers.pop(printer_id, None)
+        if breaker and breaker.opened_at is not None:
+            snapshot_cache.invalidate()
+            logger.info(f"[printer {printer_id}] ✅ 试探任务成功，熔断恢复")
+
+    def record_failure(self, printer_id: int, error_code: Optional[int] = None) -> bool:
+        """记录一次失败，返回这次是否触发了熔断"""
+        with self._lock:
+            breaker = self._breakers.setdefault(printer_id, _Breaker())
+            breaker.failures += 1
+            breaker.last_error = error_code
+            if breaker.failures >= settings.CIRCUIT_BREAKER_THRESHOLD > 0:
+                # 半开状态下的试探失败也重新计时
+                tripped = breaker.opened_at is None
+                breaker.opened_at = time.time()
+                if tripped:
+                    snapshot_cache.invalidate() # /printers 中的状态变为 circuit_open
+                return tripped
+            return False
+
+    def allow(self, printer_id: int) -> bool:
+        """是否允许向该打印机派单"""
+        with self._lock:
+            breaker = self._breakers.get(printer_id)
+            if not breaker or breaker.opened_at is None:
+                return True
+            reset_after = settings.CIRCUIT_BREAKER_RESET_AFTER
+            return reset_after > 0 and time.time() - breaker.opened_at >= reset_after
+
+    def is_open(self, printer_id: int) -> bool:
+        with self._lock:
+            breaker = self._breakers.get(printer_id)
+            return breaker is not None and breaker.opened_at is not None
+
+    def reset(self, printer_id: int):
+        with self._lock:
+            self._breakers.pop(printer_id, None)
+
+    def snapshot(self) -> Dict[int, dict]:
+        with self._lock:
+            return {
+                pid: {
+                    "failures": b.failures,
+                    "open": b.opened_at is not None,
+                    "opened_at": b.opened_at,
+                    "last_error": b.last_error,
+                }
+                for pid, b in self._breakers.items()
+            }
+
+# 全局单例
+circuit_breaker = CircuitBreaker()
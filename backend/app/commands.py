@@ -0,0 +1,135 @@
+import time
+import logging
+from typing import Dict, List, Tuple
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Printer, CommandRequest
+from app.mqtt_client import manager
+from app.sharding import shards
+from app.scheduler import scheduler
+from app.snapshot import snapshot_cache
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+def _led(mode: str) -> Tuple[str, dict]:
+    return "system", {
+        "command": "ledctrl", "led_node": "chamber_light", "led_mode": mode,
+        "led_on_time": 500, "led_off_time": 500, "loop_times": 0, "interval_time": 0,
+    }
+
+# 指令名 -> (报文段, 指令体)；回执按 sequence_id 对应
+COMMANDS: Dict[str, Tuple[str, dict]] = {
+    "pause": ("print", {"command": "pause", "param": ""}),
+    "resume": ("print", {"command": "resume", "param": ""}),
+    "stop": ("print", {"command": "stop", "param": ""}),
+    "light_on": _led("on"),
+    "light_off": _led("off"),
+    "pushall": ("pushing", {"command": "pushall"}),
+}
+
+# 按状态选择打印机 (基于 get_all_states 的运行时状态)
+STATUS_FILTERS = {
+    "printing": lambda st: st["connected"] and st["g_st"] == 6,
+    "idle": lambda st: st["connected"] and st["g_st"] == 1,
+    "finished": lambda st: st["connected"] and st["g_st"] == 100,
+    "error": lambda st: st["connected"] and st["error"] != 0,
+    "online": lambda st: st["connected"],
+    "offline": lambda st: not st["connected"],
+}
+
+_RESULTS = {True: "ok", False: "rejected", None: "timeout"}
+
+def printer_tags(printer: Printer) -> List[str]:
+    return [t.strip() for t in (printer.tags or "").split(",") if t.strip()]
+
+class CommandFanout:
+    """
+    把一条指令同时发给一组打印机 (急停、批量开关灯、批量刷新状态)：
+    - 先对所有目标逐个 publish (paho 的 publish 只是入队，不等网络)，再在同一个截止时间前收集回执，
+      总耗时约等于最慢一台的回执时间，而不是各台之和，规模变大时延迟基本不变
+    - 每台打印机的结果：ok / rejected (打印机拒绝) / timeout / offline (未连接) / remote (分片模式下归其他节点)
+    - stop 是操作员取消：默认先暂停派单，被停下的任务标记为 cancelled，不重新排队、不计入熔断
+    """
+    @staticmethod
+    def select(request: CommandRequest) -> List[Printer]:
+        with Session(engine) as session:
+            query = select(Printer)
+            if request.printer_ids:
+                query = query.where(Printer.id.in_(request.printer_ids))
+            printers = session.exec(query).all()
+        if request.tags:
+            wanted = set(request.tags)
+            printers = [p for p in printers if wanted & set(printer_tags(p))]
+        if request.status:
+            states = manager.get_all_states()
+            offline = {"connected": False, "g_st": -1, "error": 0}
+            filters = [STATUS_FILTERS[s] for s in request.status]
+            printers = [p for p in printers if any(f(states.get(p.serial_no, offline)) for f in filters)]
+        return printers
+
+    def run(self, request: CommandRequest) -> dict:
+        if request.command not in COMMANDS:
+            raise ValueError(f"未知指令: {request.command}")
+        unknown = [s for s in request.status or [] if s not in STATUS_FILTERS]
+        if unknown:
+            raise ValueError(f"未知状态: {', '.join(unknown)}")
+        timeout = settings.COMMAND_TIMEOUT if request.timeout is None else request.timeout
+        section, body = COMMANDS[request.command]
+
+        stop = request.command == "stop"
+        pause_queue = stop if request.pause_queue is None else request.pause_queue
+
+        start = time.perf_counter()
+        if pause_queue and not scheduler.paused:
+            scheduler.paused = True
+            snapshot_cache.invalidate()
+            logger.warning("⏸️ 批量指令前暂停派单")
+        printers = self.select(request)
+        owned = {p.id for p in printers if shards.owns(p)}
+        if stop:
+            # 先登记再发送：停止后打印机上报的 FAILED 不能被当成打印失败重新排队
+            cancelling = scheduler.request_cancel(owned)
+        results: Dict[int, dict] = {}
+        sent: List[Tuple[Printer, str]] = []
+        # 第一步：全部发出
+        for p in printers:
+            if p.id not in owned:
+                results[p.id] = {"result": "remote"}
+                continue
+            sequence_id = manager.publish_command(p.serial_no, section, body)
+            if sequence_id is None:
+                results[p.id] = {"result": "offline"}
+                if stop:
+                    # 指令没发出去，这台打印机之后的失败仍按正常失败处理
+                    scheduler.cancelling.difference_update(cancelling.get(p.id, []))
+            else:
+                sent.append((p, sequence_id))
+
+        # 第二步：共用一个截止时间收集回执 (后面的打印机等待时间只会更短)
+        deadline = time.perf_counter() + timeout
+        for p, sequence_id in sent:
+            ack = manager.wait_for_ack(p.serial_no, sequence_id, max(0.0, deadline - time.perf_counter()))
+            results[p.id] = {"result": _RESULTS[ack], "sequence_id": sequence_id}
+
+        cancelled = []
+        if stop:
+            cancelled = scheduler.confirm_cancel(p.id for p, _ in sent if results[p.id]["result"] == "ok")
+
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        counts: Dict[str, int] = {}
+        for entry in results.values():
+            counts[entry["result"]] = counts.get(entry["result"], 0) + 1
+        logger.info(f"📣 批量指令 {request.command}: {len(printers)} 台, {counts}, 耗时 {elapsed_ms} ms")
+        return {
+            "command": request.command,
+            "targets": len(printers),
+            "counts": counts,
+            "elapsed_ms": elapsed_ms,
+            "queue_paused": scheduler.paused,
+            "cancelled_tasks": cancelled,
+            "results": [dict(printer_id=p.id, serial_no=p.serial_no, name=p.name, **results[p.id]) for p in printers],
+        }
+
+# 全局单例
+commands = CommandFanout()
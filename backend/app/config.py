@@ -15,10 +15,91 @@ class Settings(BaseSettings):
     DATA_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
     STATIC_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
     DB_PATH: str = os.path.join(DATA_DIR, "bbm.db")
+    THUMBNAIL_DIR: str = os.path.join(DATA_DIR, "thumbnails") # 按文件哈希生成的缩略图
+    ARCHIVE_DIR: str = os.path.join(DATA_DIR, "archive") # 已归档任务 (gzip JSONL)
+    TRANSFER_DIR: str = os.path.join(DATA_DIR, "transfer") # 发给打印机的精简 3MF 缓存
     
     # 换盘冷却时间 (秒)
     SWAP_COOLDOWN: int = 60
 
+    # 打印机端口 (真机固定为 8883/990，模拟器可改用非特权端口)
+    PRINTER_MQTT_PORT: int = 8883
+    PRINTER_FTP_PORT: int = 990
+    RECONNECT_MAX_DELAY: int = 120 # MQTT 重连退避上限 (秒)
+    RECONNECT_JITTER: float = 0.5 # 重连退避抖动比例 (0~1)
+
+    # 连接健康检查
+    HEALTH_CHECK_INTERVAL: float = 10.0 # 检查间隔 (秒)
+    HEARTBEAT_INTERVAL: float = 30.0 # 超过该时间无上报则发送 pushall 探测
+    STALE_THRESHOLD: float = 90.0 # 超过该时间无上报视为数据过期，停止派单
+    STALE_RECONNECT_AFTER: float = 180.0 # 超过该时间仍无上报则强制重连
+
+    # 打印机 SD 卡缓存
+    SD_CACHE_MAX_BYTES: int = 8 * 1024 ** 3 # 本系统在每张卡上最多占用的空间，超出按 LRU 淘汰
+    SD_CACHE_LOOKAHEAD: int = 20 # 同优先级内，卡上已有文件的任务最多可以越过多少个排在前面的任务 (也是每轮候选任务数的下限)
+    SLIM_3MF: bool = False # 上传前去掉打印机用不到的内容 (盘面图片、模型、其他盘 gcode)，只发送精简 3MF (未在真机固件上验证)
+
+    # 负载均衡 (批量指派)
+    UPLOAD_BANDWIDTH: float = 2 * 1024 * 1024 # 估算上传耗时用的 FTPS 带宽 (字节/秒)
+    BALANCER_QUEUE_WEIGHT: float = 600.0 # 同优先级内排队顺序每靠后一位的代价 (秒)，要明显大于常见的上传耗时差，基本按队列顺序派单
+    BALANCER_HISTORY: int = 20 # 统计历史打印速度时每台打印机取最近多少个任务
+    BALANCER_MAX_CANDIDATES: int = 300 # 每轮参与指派的候选任务上限
+    BALANCER_GROUP_SIZE: int = 32 # 一次指派最多求解的打印机数，更多空闲打印机分组依次求解 (匈牙利算法 O(n²·m))
+
+    # 时间窗口 (本地时间，按天循环)
+    OFFPEAK_WINDOWS: str = "" # 谷电时段，例如 "23:00-07:00"；为空则不限制长任务开始时间
+    LONG_JOB_SECONDS: int = 4 * 3600 # 预计时长不少于该值的任务只在谷电时段开始 (0 关闭)
+
+    # 失败重试与熔断
+    MAX_TASK_ATTEMPTS: int = 3 # 单个任务最多尝试次数，超过后标记 failed
+    CIRCUIT_BREAKER_THRESHOLD: int = 3 # 同一台打印机连续失败多少次后停止派单 (0 关闭)
+    CIRCUIT_BREAKER_RESET_AFTER: float = 0 # 熔断多久后放行一个试探任务 (秒)，0 表示只能手动恢复
+
+    # 任务下发确认
+    PRINT_ACK_TIMEOUT: float = 5.0 # 等待 project_file 回执的时间 (秒)
+    JOB_CONFIRM_TIMEOUT: float = 60.0 # 下发后打印机空闲且一直没有上报该任务，超过该时间视为未开始
+    COMMAND_TIMEOUT: float = 5.0 # 批量指令 (/commands) 默认等待回执的时间 (秒)
+
+    # 轮询接口快照
+    SNAPSHOT_MAX_AGE: float = 1.0 # /printers、/status 快照最长复用时间 (秒)，无变化时也按此刷新时间相关字段
+
+    # 多节点分片 (多个后端共用一个数据库和上传目录，各自负责一部分打印机)
+    NODE_ID: str = "" # 本节点标识，为空表示单节点模式 (管理全部打印机)
+    NODE_SITES: str = "" # 本节点可以负责的分片 (打印机 site)，逗号分隔，为空表示全部
+    SHARD_LEASE_TTL: float = 30.0 # 分片租约有效期 (秒)，节点失联超过该时间后由其他节点接管
+    SHARD_RENEW_INTERVAL: float = 10.0 # 续约间隔 (秒)，应明显小于 SHARD_LEASE_TTL
+    SHARD_CLOCK_MARGIN: float = 2.0 # 容忍的节点间时钟偏差 (秒)：接管要多等这么久，本节点认为的租约有效期也提前这么久结束 (须小于 SHARD_LEASE_TTL - SHARD_RENEW_INTERVAL)
+
+    # 调度器
+    SCHEDULER_INTERVAL: float = 2.0 # 轮询间隔 (秒)
+    UPLOAD_WORKERS: int = 5 # 并发上传线程数
+
+    # 状态时间线 (利用率分析)
+    TIMELINE_FLUSH_INTERVAL: float = 5.0 # 批量写入间隔 (秒)
+    TIMELINE_BATCH_SIZE: int = 500 # 单批最大写入条数
+    TIMELINE_PROGRESS_STEP: int = 10 # 进度事件降采样步长 (%)
+    TIMELINE_DOWNSAMPLE_DAYS: int = 7 # 超过该天数的进度事件被清理，只保留状态转换
+    TIMELINE_RETENTION_DAYS: int = 30 # 时间线保留天数
+
+    # 保留策略 (已结束任务归档与磁盘回收)
+    RETENTION_INTERVAL: float = 3600.0 # 执行间隔 (秒)，0 关闭后台执行 (仍可通过接口手动触发)
+    RETENTION_KEEP_DAYS: int = 30 # 已结束任务保留天数，0 表示不按天数清理
+    RETENTION_KEEP_TASKS: int = 5000 # 最多保留多少条已结束任务，0 表示不限
+    RETENTION_ORPHAN_GRACE: float = 3600.0 # 上传目录中无任务引用的文件超过该时长 (秒) 才删除，0 不清理
+    RETENTION_VACUUM_PAGES: int = 2000 # 每次 incremental_vacuum 最多归还的页数
+    RETENTION_CONVERT_VACUUM: bool = False # 启动时把旧数据库转换为 auto_vacuum=INCREMENTAL (一次完整 VACUUM，期间锁库、启动变慢)
+
+    # 诊断 (管理员接口 /admin/*)
+    ADMIN_TOKEN: str = "" # 管理员接口需要在 X-Admin-Token 头中带上它，为空表示关闭这些接口
+    PROFILER_MAX_SECONDS: float = 300.0 # 采样分析最长运行时间 (秒)，到时自动停止
+    TRACE_BUFFER: int = 10000 # 耗时追踪保留的最近 span 条数
+
+    # 日志
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text" # text | json (JSON lines)
+    LOG_PROGRESS_STEP: int = 10 # 进度日志合并步长 (%)，每跨过一档才输出一次
+    PRINTER_LOG_LEVELS: str = "" # 单台打印机日志级别，例如 "SN1=DEBUG,SN2=WARNING"
+
     class Config:
         env_file = ".env"
 
@@ -28,3 +109,6 @@ settings = Settings()
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 os.makedirs(settings.DATA_DIR, exist_ok=True)
 os.makedirs(settings.STATIC_DIR, exist_ok=True)
+os.makedirs(settings.THUMBNAIL_DIR, exist_ok=True)
+os.makedirs(settings.ARCHIVE_DIR, exist_ok=True)
+os.makedirs(settings.TRANSFER_DIR, exist_ok=True)
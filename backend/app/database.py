@@ -1,10 +1,68 @@
+import logging
+from sqlalchemy import event, inspect
 from sqlmodel import SQLModel, create_engine, Session
 from app.config import settings
 
-engine = create_engine(f"sqlite:///{settings.DB_PATH}")
+logger = logging.getLogger(__name__)
+
+# 多节点共用一个库时写锁会互相等待，忙等时间放宽到 30 秒 (默认 5 秒)
+engine = create_engine(f"sqlite:///{settings.DB_PATH}", connect_args={"timeout": 30})
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # 只对新建的数据库生效 (建第一张表时写入文件头)；已有数据库由 enable_incremental_vacuum 转换
+    dbapi_connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _migrate_columns()
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _migrate_columns():
+    """
+    create_all 只建新表，不会给已有表加列/索引。
+    这里为旧数据库补齐新增的列 (可空，带标量默认值的写入 DEFAULT) 和索引，
+    避免升级后因为缺列直接报错。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=engine.dialect)}'
+                default = column.default
+                if default is not None and default.is_scalar and default.arg is not None:
+                    ddl += f" DEFAULT {_sql_literal(default.arg)}"
+                conn.exec_driver_sql(ddl)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def enable_incremental_vacuum():
+    """
+    启动时、调度器开始前调用。旧数据库的 auto_vacuum 为 NONE，删除数据后文件不会变小。
+    转换成 INCREMENTAL 需要做一次完整 VACUUM (期间锁库)，只在配置了 RETENTION_CONVERT_VACUUM 时执行，
+    之后由 app.retention 分批 incremental_vacuum；否则只提示，清理照常进行但数据库文件不缩小。
+    """
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        if not settings.RETENTION_CONVERT_VACUUM:
+            logger.warning("🗜️ 数据库 auto_vacuum 不是 INCREMENTAL，清理后空间不会归还；"
+                           "设置 RETENTION_CONVERT_VACUUM=true 可在启动时一次性转换 (完整 VACUUM)")
+            return
+        logger.info("🗜️ 数据库转换为 auto_vacuum=INCREMENTAL (一次性 VACUUM)...")
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
 
 def get_session():
     with Session(engine) as session:
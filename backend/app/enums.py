@@ -6,6 +6,7 @@ class TaskStatus(str, Enum):
     PRINTING = "printing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled" # 操作员停止 (急停) 或打印中删除了打印机，不重新排队
 
 class PrinterStatus(str, Enum):
     UNKNOWN = "unknown"
@@ -13,3 +14,15 @@ class PrinterStatus(str, Enum):
     ONLINE = "online"
     IDLE = "idle"
     BUSY = "busy"
+
+class EventKind(str, Enum):
+    """状态时间线事件类型"""
+    CONNECT = "connect"
+    DISCONNECT = "disconnect"
+    STATE = "state"            # g_st 变化
+    PROGRESS = "progress"      # 进度里程碑 (按 TIMELINE_PROGRESS_STEP 降采样)
+    ERROR = "error"            # print_error 变化
+    FINISH = "finish"          # 判定打印完成
+    COOLDOWN_END = "cooldown_end"
+    UPLOAD_START = "upload_start"
+    DISPATCH = "dispatch"      # 打印指令已下发
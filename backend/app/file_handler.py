@@ -1,12 +1,13 @@
 import os
 import zipfile
-import shutil
 import hashlib
 import logging
 import ssl
 import socket
 from ftplib import FTP_TLS
+from typing import Callable, Optional
 from app.config import settings
+from app.profiling import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -58,50 +59,81 @@ class FileHandler:
         return hash_md5.hexdigest()
 
     @staticmethod
-    def extract_metadata(file_path: str, task_id: int):
-        """解压 .3mf 提取缩略图和信息"""
-        thumbnail_path = None
-        estimated_time = 0
-        
+    def save_upload(source, target_path: str) -> str:
+        """保存上传的文件，同时计算 MD5 (只读一遍)"""
+        hash_md5 = hashlib.md5()
+        with open(target_path, "wb") as f:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                hash_md5.update(chunk)
+                f.write(chunk)
+        return hash_md5.hexdigest()
+
+    @staticmethod
+    def extract_slice_info(file_path: str) -> dict:
+        """
+        读取 Metadata/slice_info.config (Bambu Studio 切片信息)：
+        printer_model (如 A1 mini 为 N1)、estimated_time (秒)、filament_count (用到的耗材数)
+        """
         try:
             with zipfile.ZipFile(file_path, 'r') as z:
-                # 1. 提取缩略图
-                possible_paths = ["Metadata/plate_1.png", "Metadata/plate_1_small.png"]
-                for p in possible_paths:
-                    if p in z.namelist():
-                        source = z.open(p)
-                        target_name = f"{task_id}.png"
-                        target_path = os.path.join(settings.STATIC_DIR, target_name)
-                        with open(target_path, "wb") as f:
-                            shutil.copyfileobj(source, f)
-                        thumbnail_path = f"/static/{target_name}"
-                        break
-                
-                # 2. 尝试提取时间 (简化版，仅读取 config)
-                # 实际可能需要解析 xml，这里暂时略过复杂解析
+                return FileHandler._parse_slice_info(z)
         except Exception as e:
-            logger.error(f"解析 3mf 失败: {e}")
-            
-        return thumbnail_path, estimated_time
+            logger.error(f"解析 slice_info 失败: {e}")
+            return {}
+
+    @staticmethod
+    def _parse_slice_info(z: zipfile.ZipFile) -> dict:
+        if "Metadata/slice_info.config" not in z.namelist():
+            return {}
+        from xml.etree import ElementTree
+        root = ElementTree.fromstring(z.read("Metadata/slice_info.config"))
+        plate = root.find("plate")
+        if plate is None:
+            return {}
+        meta = {m.get("key"): m.get("value") for m in plate.findall("metadata")}
+        info = {"filament_count": len(plate.findall("filament")) or 1}
+        if meta.get("printer_model_id"):
+            info["printer_model"] = meta["printer_model_id"]
+        try:
+            info["estimated_time"] = int(float(meta.get("prediction") or 0))
+        except ValueError:
+            info["estimated_time"] = 0
+        return info
 
     @staticmethod
-    def upload_to_printer(local_path: str, remote_filename: str, printer_ip: str, access_code: str, retries: int = 3) -> bool:
+    def connect_ftp(printer_ip: str, access_code: str) -> ImplicitFTP_TLS:
+        """建立已登录、数据通道加密的隐式 FTPS 连接"""
+        # 创建 SSL 上下文：忽略证书验证
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        
+        ftp = ImplicitFTP_TLS(context=ctx)
+        try:
+            ftp.connect(printer_ip, settings.PRINTER_FTP_PORT, timeout=30)
+            ftp.login("bblp", access_code)
+            ftp.prot_p() # 确保数据通道也加密
+        except Exception:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+            raise
+        return ftp
+
+    @staticmethod
+    @tracer.traced("ftps.upload_to_printer")
+    def upload_to_printer(local_path: str, remote_filename: str, printer_ip: str, access_code: str, retries: int = 3,
+                          before_upload: Optional[Callable[[ImplicitFTP_TLS, int], None]] = None) -> bool:
         """
         使用隐式 FTPS 上传文件 (带重试机制)
+        before_upload(ftp, local_size) 在同一个 FTP 会话里、真正 STOR 之前调用 (例如 SD 卡缓存腾空间)
         """
         for attempt in range(1, retries + 1):
-            # 创建 SSL 上下文：忽略证书验证
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            
-            ftp = ImplicitFTP_TLS(context=ctx)
-            
+            ftp = None
             try:
                 logger.info(f"正在连接打印机 FTP {printer_ip} (Attempt {attempt}/{retries})...")
-                ftp.connect(printer_ip, 990, timeout=30)
-                ftp.login("bblp", access_code)
-                ftp.prot_p() # 确保数据通道也加密
+                ftp = FileHandler.connect_ftp(printer_ip, access_code)
                 
                 # 检查文件是否已存在且大小一致
                 local_size = os.path.getsize(local_path)
@@ -113,6 +145,9 @@ class FileHandler:
                 except Exception:
                     pass
                     
+                if before_upload:
+                    before_upload(ftp, local_size)
+
                 if remote_size == local_size:
                     logger.info("✅ 文件已存在且大小一致，跳过上传")
                     ftp.quit()
@@ -130,7 +165,8 @@ class FileHandler:
             except Exception as e:
                 logger.error(f"❌ FTP 上传失败 (Attempt {attempt}): {e}")
                 try:
-                    ftp.quit()
+                    if ftp:
+                        ftp.quit()
                 except:
                     pass
                 
@@ -143,13 +179,13 @@ class FileHandler:
 
     @staticmethod
     def delete_local_files(filepath: str, thumbnail_path: str = None):
-        """删除本地文件和缩略图"""
+        """删除本地文件和旧版 (/static/{task_id}.png) 缩略图；按哈希生成的缩略图由 thumbnails.delete 清理"""
         try:
             if filepath and os.path.exists(filepath):
                 os.remove(filepath)
                 logger.info(f"已删除文件: {filepath}")
             
-            if thumbnail_path:
+            if thumbnail_path and thumbnail_path.startswith("/static/"):
                 filename = os.path.basename(thumbnail_path)
                 abs_path = os.path.join(settings.STATIC_DIR, filename)
                 if os.path.exists(abs_path):
@@ -0,0 +1,59 @@
+import time
+import threading
+import logging
+from app.mqtt_client import manager
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class HealthMonitor:
+    """
+    连接健康检查：
+    - 连接正常但超过 HEARTBEAT_INTERVAL 没有上报：发送 pushall 探测
+    - 超过 STALE_THRESHOLD：PrinterState.is_stale() 为真，调度器不再派单
+    - 超过 STALE_RECONNECT_AFTER：认为连接假死，丢弃客户端重新建连
+    连上后一直没有上报的打印机从连接成功的时间算起，同样会被探测和重连。
+    """
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self._last_probe = {}
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self):
+        while self.running:
+            time.sleep(settings.HEALTH_CHECK_INTERVAL)
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"健康检查异常: {e}")
+
+    def check_all(self):
+        now = time.time()
+        # 未连接的由 paho 自带的退避重连负责，这里只扫描已连接的打印机
+        for state in manager.connected_states():
+            serial_no = state.serial_no
+            since = state.last_report_time or state.connected_at
+            if not since:
+                continue
+            age = now - since
+            if age > settings.STALE_RECONNECT_AFTER:
+                logger.warning(f"[{serial_no}] 💤 {age:.0f}s 无上报，强制重连", extra={"serial_no": serial_no})
+                self._last_probe.pop(serial_no, None)
+                manager.restart_printer(serial_no)
+            elif age > settings.HEARTBEAT_INTERVAL:
+                # 探测节流：同一台打印机每个心跳周期最多一次
+                if now - self._last_probe.get(serial_no, 0) >= settings.HEARTBEAT_INTERVAL:
+                    self._last_probe[serial_no] = now
+                    manager.request_pushall(serial_no)
+
+# 全局单例
+health_monitor = HealthMonitor()
@@ -0,0 +1,132 @@
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+from app.config import settings
+
+# LogRecord 自带的属性，JSON 输出时其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，extra 字段 (如 serial_no/g_st/progress) 原样带出"""
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    标准 QueueHandler.prepare 会在调用线程里先 format 一遍。
+    这里直接把原始 record 入队，格式化和 I/O 全部交给监听线程，
+    MQTT 回调线程只付出一次入队的开销。
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class PrinterLevelFilter(logging.Filter):
+    """按打印机序列号控制日志级别 (record 需带 serial_no extra)"""
+    def __init__(self, default_level: int):
+        super().__init__()
+        self.default_level = default_level
+        self.levels: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        serial_no = getattr(record, "serial_no", None)
+        if serial_no is None:
+            return record.levelno >= self.default_level
+        return record.levelno >= self.levels.get(serial_no, self.default_level)
+
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_printer_filter: Optional[PrinterLevelFilter] = None
+
+def _parse_level(level) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
+
+def _apply_root_level():
+    # root 级别取全局级别与各打印机级别中最低的，具体放行由 PrinterLevelFilter 决定
+    levels = [_printer_filter.default_level, *_printer_filter.levels.values()]
+    logging.getLogger().setLevel(min(levels))
+
+def setup_logging():
+    """
+    初始化日志：所有记录先进队列，由单独的监听线程格式化并输出。
+    LOG_FORMAT=json 时输出 JSON lines (包括 uvicorn 的日志)。
+    """
+    global _listener, _printer_filter
+    with _lock:
+        if _listener is not None:
+            return
+
+        stream = logging.StreamHandler()
+        if settings.LOG_FORMAT.lower() == "json":
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+        log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        _printer_filter = PrinterLevelFilter(_parse_level(settings.LOG_LEVEL))
+        for item in filter(None, settings.PRINTER_LOG_LEVELS.split(",")):
+            serial_no, _, level = item.partition("=")
+            _printer_filter.levels[serial_no.strip()] = _parse_level(level.strip())
+        queue_handler.addFilter(_printer_filter)
+
+        root = logging.getLogger()
+        root.handlers = [queue_handler]
+        _apply_root_level()
+
+        if settings.LOG_FORMAT.lower() == "json":
+            for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+                uv_logger = logging.getLogger(name)
+                uv_logger.handlers = []
+                uv_logger.propagate = True
+
+        _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+def set_printer_level(serial_no: str, level: Optional[str]):
+    """设置 (或 level=None 时清除) 单台打印机的日志级别"""
+    with _lock:
+        if level is None:
+            _printer_filter.levels.pop(serial_no, None)
+        else:
+            _printer_filter.levels[serial_no] = _parse_level(level)
+        _apply_root_level()
+
+def get_levels() -> dict:
+    return {
+        "default": logging.getLevelName(_printer_filter.default_level),
+        "printers": {sn: logging.getLevelName(lv) for sn, lv in _printer_filter.levels.items()},
+        "format": settings.LOG_FORMAT,
+    }
+
+class PrinterLoggerAdapter(logging.LoggerAdapter):
+    """自动附带 serial_no，并与调用方传入的 extra 合并"""
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+def printer_logger(logger: logging.Logger, serial_no: str) -> PrinterLoggerAdapter:
+    """带 serial_no 的 logger，供按打印机过滤和 JSON 输出使用"""
+    return PrinterLoggerAdapter(logger, {"serial_no": serial_no})
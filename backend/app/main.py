@@ -1,21 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Request, Response, Header
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session, select, SQLModel
 from typing import List, Optional
 from contextlib import asynccontextmanager
-import shutil
 import os
+import hmac
 import uuid
+import threading
+from datetime import datetime
 
-from app.database import create_db_and_tables, get_session, engine
-from app.models import Task, TaskCreate, TaskRead, Printer, PrinterCreate, PrinterRead
+from app.database import create_db_and_tables, enable_incremental_vacuum, get_session, engine
+from app.models import Task, TaskCreate, TaskRead, Printer, PrinterCreate, PrinterRead, PrinterUpdate, PrinterFile, CommandRequest
 from app.config import settings
+from app.enums import TaskStatus
 from app.mqtt_client import manager
 from app.file_handler import FileHandler
 from app.scheduler import scheduler
+from app.timeline import timeline
+from app.health import health_monitor
+from app.sd_cache import sd_cache
+from app.circuit_breaker import circuit_breaker
+from app.snapshot import snapshot_cache
+from app.thumbnails import thumbnails
+from app.transfer import transfer
+from app.retention import retention, archived_tasks
+from app.sharding import shards
+from app.commands import commands
+from app.profiling import profiler, tracer
+from app import time_windows
+from app.log import setup_logging, set_printer_level, get_levels
 import logging
 
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 自定义日志过滤器：过滤掉频繁的健康检查和任务轮询日志
@@ -30,36 +47,58 @@ class EndpointFilter(logging.Filter):
 # 将过滤器添加到 uvicorn.access 日志记录器
 logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
 
+def _bootstrap_printers():
+    """读取打印机列表 (数据库为空时创建默认打印机) 并注册，各台在后台并行建连"""
+    try:
+        with Session(engine) as session:
+            printers = session.exec(select(Printer)).all()
+            if not printers and settings.DEFAULT_PRINTER_IP:
+                # 自动创建默认打印机
+                logger.info("Initializing default printer...")
+                default_printer = Printer(
+                    name="Default Printer",
+                    ip=settings.DEFAULT_PRINTER_IP,
+                    access_code=settings.DEFAULT_ACCESS_CODE,
+                    serial_no=settings.DEFAULT_SERIAL_NO
+                )
+                session.add(default_printer)
+                session.commit()
+                printers = [default_printer]
+            if shards.enabled:
+                # 分片模式：只连接本节点负责的打印机，由租约线程按续约结果增减 (见 finally)
+                return
+            manager.add_printers(printers)
+        logger.info(f"🖨️ 已注册 {len(printers)} 台打印机")
+    except Exception as e:
+        logger.error(f"初始化打印机失败: {e}")
+    finally:
+        # 无论上面是否出错都启动租约线程：它立即续约一次，数据库暂时被锁时会自己重试
+        if shards.enabled:
+            shards.start()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    time_windows.parse_windows(settings.OFFPEAK_WINDOWS) # 配置写错时启动即报错，而不是每轮调度报错
     create_db_and_tables()
+    enable_incremental_vacuum() # 旧库转换需要完整 VACUUM，必须在调度器和清理任务开始写库之前
     
-    # 初始化打印机
-    with Session(engine) as session:
-        printers = session.exec(select(Printer)).all()
-        if not printers and settings.DEFAULT_PRINTER_IP:
-            # 自动创建默认打印机
-            logger.info("Initializing default printer...")
-            default_printer = Printer(
-                name="Default Printer",
-                ip=settings.DEFAULT_PRINTER_IP,
-                access_code=settings.DEFAULT_ACCESS_CODE,
-                serial_no=settings.DEFAULT_SERIAL_NO
-            )
-            session.add(default_printer)
-            session.commit()
-            printers = [default_printer]
-            
-        for p in printers:
-            manager.add_printer(p)
+    # 打印机在后台线程注册：HTTP 服务不等待 (打印机多、离线时也能立即响应)
+    threading.Thread(target=_bootstrap_printers, name="printer-bootstrap", daemon=True).start()
             
+    timeline.start()
+    health_monitor.start()
     scheduler.start()
+    retention.start()
     
     yield
     
     # Shutdown (可选: 如果需要清理资源)
+    shards.stop()
+    retention.stop()
     scheduler.stop()
+    health_monitor.stop()
+    timeline.stop()
 
 app = FastAPI(title="Bambu Batch Manager", version="0.2.0", lifespan=lifespan)
 
@@ -75,49 +114,202 @@ app.add_middleware(
 # 挂载静态文件 (缩略图)
 app.mount("/static", StaticFiles(directory=settings.STATIC_DIR), name="static")
 
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, FileResponse, PlainTextResponse
 
 @app.get("/")
 async def root():
     return RedirectResponse(url="/static/index.html")
 
+@app.get("/thumbnails/{file_hash}/{variant}.png")
+def get_thumbnail(file_hash: str, variant: str, request: Request):
+    path = thumbnails.path(file_hash, variant)
+    if not path:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    # 先确认文件存在：还没生成 (后台生成中)、3MF 里没有图片或已被清理时返回 404 (不缓存)，
+    # 不能因为客户端带了旧的 ETag 就回 304
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    # 内容由文件哈希决定，永不改变：浏览器长期缓存，重新验证时直接 304
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{file_hash}-{variant}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/png", headers=headers)
+
 # --- Printer APIs ---
+def _validate_availability(spec: Optional[str]) -> Optional[str]:
+    try:
+        return time_windows.validate(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/printers", response_model=PrinterRead)
 def create_printer(printer: PrinterCreate, session: Session = Depends(get_session)):
+    printer.availability = _validate_availability(printer.availability)
     db_printer = Printer.from_orm(printer)
     session.add(db_printer)
     try:
         session.commit()
         session.refresh(db_printer)
-        manager.add_printer(db_printer)
-        return db_printer
     except Exception as e:
         raise HTTPException(status_code=400, detail="Printer already exists (check IP/Serial)")
+    # 后台建连，不可达的 IP 不会阻塞请求；其他节点负责的分片由该节点在下次续约时接手
+    if shards.owns(db_printer):
+        manager.add_printer(db_printer)
+    return db_printer
+
+@app.post("/printers/bulk")
+def bulk_create_printers(printers: List[PrinterCreate], session: Session = Depends(get_session)):
+    # 批量导入：逐条插入 (重复的跳过)，然后统一在后台并行建连
+    created, errors = [], []
+    for item in printers:
+        try:
+            item.availability = time_windows.validate(item.availability)
+        except ValueError as e:
+            errors.append({"serial_no": item.serial_no, "ip": item.ip, "detail": str(e)})
+            continue
+        db_printer = Printer.from_orm(item)
+        try:
+            with session.begin_nested():
+                session.add(db_printer)
+            created.append(db_printer)
+        except Exception:
+            errors.append({"serial_no": item.serial_no, "ip": item.ip, "detail": "Printer already exists (check IP/Serial)"})
+    session.commit()
+    for p in created:
+        session.refresh(p)
+    manager.add_printers([p for p in created if shards.owns(p)])
+    return {
+        "created": [PrinterRead.from_orm(p) for p in created],
+        "errors": errors
+    }
+
+def _snapshot_response(request: Request, key: str, builder) -> Response:
+    # 轮询接口统一走快照：版本未变时直接返回缓存的 JSON 字节，带 If-None-Match 的请求返回 304
+    snap = snapshot_cache.get(key, builder)
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snap.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snap.body, media_type="application/json", headers=headers)
 
 @app.get("/printers", response_model=List[PrinterRead])
-def get_printers(session: Session = Depends(get_session)):
-    printers = session.exec(select(Printer)).all()
+def get_printers(request: Request):
+    return _snapshot_response(request, "printers", _build_printers)
+
+def _build_printers() -> List[PrinterRead]:
+    with Session(engine) as session:
+        printers = session.exec(select(Printer)).all()
     # 注入运行时状态
     states = manager.get_all_states()
     result = []
     for p in printers:
         p_read = PrinterRead.from_orm(p)
         st = states.get(p.serial_no)
-        if st and st.get('connected'):
+        if not shards.owns(p):
+            p_read.status = "remote" # 分片模式下由其他节点负责 (见 /shards)
+        elif circuit_breaker.is_open(p.id):
+            p_read.status = "circuit_open" # 连续失败，已停止派单
+        elif st and st.get('stale'):
+            p_read.status = "stale" # 连接还在但长时间无上报
+        elif st and st.get('connected'):
             p_read.status = "online"
         else:
             p_read.status = "offline"
         result.append(p_read)
     return result
 
+@app.patch("/printers/{printer_id}", response_model=PrinterRead)
+def update_printer(printer_id: int, printer_update: PrinterUpdate, session: Session = Depends(get_session)):
+    printer = session.get(Printer, printer_id)
+    if not printer:
+        raise HTTPException(status_code=404, detail="Printer not found")
+
+    old_serial_no = printer.serial_no
+    old_conn = (printer.ip, printer.access_code, printer.serial_no)
+    changes = printer_update.dict(exclude_unset=True)
+    if "availability" in changes:
+        changes["availability"] = _validate_availability(changes["availability"])
+    for key, value in changes.items():
+        setattr(printer, key, value)
+    session.add(printer)
+    try:
+        session.commit()
+        session.refresh(printer)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Printer already exists (check IP/Serial)")
+
+    # 连接参数变化时热重连，无需重启服务；分片 (site) 变化后不再归本节点的断开
+    if not shards.owns(printer):
+        manager.remove_printer(old_serial_no)
+    elif (printer.ip, printer.access_code, printer.serial_no) != old_conn:
+        manager.update_printer(old_serial_no, printer)
+    snapshot_cache.invalidate()
+    return printer
+
 @app.delete("/printers/{printer_id}")
 def delete_printer(printer_id: int, session: Session = Depends(get_session)):
     printer = session.get(Printer, printer_id)
     if not printer:
         raise HTTPException(status_code=404, detail="Printer not found")
-    # 注意：这里没有停止 MQTT 连接的逻辑，实际应用需要完善
+
+    # 指定给这台打印机的任务，在同一个事务里处理：
+    # 未开始/上传中的放回公共队列；打印中的仍在实体打印机上运行，重新排队会被打两次，标记为已取消
+    active_tasks = session.exec(
+        select(Task)
+        .where(Task.assigned_printer_id == printer_id)
+        .where(Task.status.in_([TaskStatus.PENDING, TaskStatus.UPLOADING, TaskStatus.PRINTING]))
+    ).all()
+    for t in active_tasks:
+        scheduler.cancelling.discard(t.id)
+        if t.status == TaskStatus.PRINTING:
+            logger.warning(f"🗑️ 打印机已删除 ({printer.name})：打印中的任务 {t.id} 标记为已取消")
+            t.status = TaskStatus.CANCELLED
+            t.completed_at = datetime.now()
+        else:
+            if t.status == TaskStatus.UPLOADING:
+                logger.warning(f"🗑️ 打印机已删除 ({printer.name})：上传中的任务 {t.id} 重新排队")
+                t.status = TaskStatus.PENDING
+                t.claimed_by = None
+            t.assigned_printer_id = None
+        session.add(t)
+
+    sd_cache.forget_printer(session, printer_id)
+    circuit_breaker.reset(printer_id)
     session.delete(printer)
     session.commit()
+    # 断开 MQTT 并清理运行时状态
+    manager.remove_printer(printer.serial_no)
+    return {"ok": True}
+
+@app.get("/shards")
+def get_shards():
+    # 多节点分片：本节点持有的分片和所有分片的租约
+    return shards.snapshot()
+
+@app.get("/circuit-breakers")
+def get_circuit_breakers():
+    # 各打印机连续失败计数与熔断状态 (key 为打印机 ID)
+    return circuit_breaker.snapshot()
+
+@app.post("/printers/{printer_id}/breaker/reset")
+def reset_circuit_breaker(printer_id: int):
+    # 处理完故障 (清理堵头/卡料等) 后手动恢复派单
+    circuit_breaker.reset(printer_id)
+    snapshot_cache.invalidate()
+    return {"ok": True}
+
+@app.get("/printers/{printer_id}/files", response_model=List[PrinterFile])
+def get_printer_files(printer_id: int, session: Session = Depends(get_session)):
+    # 本系统在该打印机 SD 卡上缓存的文件 (按最近使用排序)
+    return session.exec(
+        select(PrinterFile)
+        .where(PrinterFile.printer_id == printer_id)
+        .order_by(PrinterFile.last_used.desc())
+    ).all()
+
+@app.post("/printers/{printer_id}/files/resync")
+def resync_printer_files(printer_id: int):
+    # 换卡/格式化后调用：下次派单前重新读取 SD 卡文件列表
+    sd_cache.invalidate(printer_id)
     return {"ok": True}
 
 @app.post("/upload", response_model=List[TaskRead])
@@ -139,12 +331,11 @@ async def upload_file(
     save_name = f"{file_id}_{file.filename}"
     save_path = os.path.join(settings.UPLOAD_DIR, save_name)
     
-    with open(save_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    file_hash = FileHandler.save_upload(file.file, save_path)
         
-    # 提取元数据 (只提取一次)
-    # 我们先创建一个临时 Task 对象来获取元数据，但不保存到数据库
-    # 或者稍微修改一下 FileHandler，这里简单处理：先入库第一条，拿到 ID 提取图片，然后更新所有
+    # 提取切片信息 (只提取一次)；缩略图按文件哈希在后台生成，同一文件的所有任务共用
+    slice_info = FileHandler.extract_slice_info(save_path)
+    thumbnails.submit(file_hash, save_path)
     
     created_tasks = []
     
@@ -157,34 +348,16 @@ async def upload_file(
             flow_cali=flow_cali,
             timelapse=timelapse,
             use_ams=use_ams,
-            assigned_printer_id=printer_id
+            assigned_printer_id=printer_id,
+            file_hash=file_hash,
+            thumbnail_path=thumbnails.url(file_hash),
+            estimated_time=slice_info.get("estimated_time", 0),
+            printer_model=slice_info.get("printer_model"),
+            filament_count=slice_info.get("filament_count", 1),
         )
         session.add(new_task)
-        # 需要 flush 才能拿到 id
-        session.flush() 
         created_tasks.append(new_task)
 
-    # 提交事务，确保 ID 生成
-    session.commit()
-    
-    # 3. 提取元数据 (只需要做一次)
-    # 使用第一条任务的 ID 来命名缩略图
-    first_task = created_tasks[0]
-    thumb_path, est_time = FileHandler.extract_metadata(save_path, first_task.id)
-    
-    # 4. 批量更新元数据
-    for task in created_tasks:
-        if thumb_path:
-            # 注意：这里所有任务共用一张缩略图，文件名基于第一个任务 ID
-            # 前端显示时没问题，但在删除任务时要注意：只有当所有引用该图片的任务都删除了，才能删图片
-            # 或者简单点：每个任务都复制一份图片（浪费空间）
-            # 或者优化 FileHandler.delete_local_files 逻辑
-            # 这里暂时：让所有任务指向同一个路径
-            task.thumbnail_path = thumb_path
-        if est_time:
-            task.estimated_time = est_time
-        session.add(task)
-        
     session.commit()
     
     # 刷新对象以返回最新状态
@@ -226,6 +399,9 @@ def retry_task(task_id: int, session: Session = Depends(get_session)):
     task.status = TaskStatus.PENDING
     task.completed_at = None
     task.assigned_printer_id = None # 重置分配，允许重新负载均衡
+    task.attempts = 0
+    task.error_code = None
+    task.last_failed_printer_id = None
     
     session.add(task)
     session.commit()
@@ -238,7 +414,10 @@ def get_tasks(session: Session = Depends(get_session)):
     return tasks
 
 @app.get("/status")
-def get_status():
+def get_status(request: Request):
+    return _snapshot_response(request, "status", _build_status)
+
+def _build_status():
     # 返回所有打印机的状态
     # 格式: { "printers": [ {status_dict}, ... ], "scheduler": "running" }
     all_states = manager.get_all_states()
@@ -252,13 +431,112 @@ def get_status():
 @app.post("/control/pause")
 def pause_queue():
     scheduler.paused = True
+    snapshot_cache.invalidate()
     return {"status": "paused"}
 
 @app.post("/control/resume")
 def resume_queue():
     scheduler.paused = False
+    snapshot_cache.invalidate()
     return {"status": "running"}
 
+@app.post("/commands")
+def send_command(request: CommandRequest):
+    # 批量指令：同时发给选中的打印机，在超时内收集各台回执后返回汇总
+    try:
+        return commands.run(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/utilization")
+def get_utilization(hours: float = 24):
+    # 按打印机统计利用率、空档拆分 (冷却/上传/等待任务) 和失败率
+    return {
+        "hours": hours,
+        "printers": timeline.compute_utilization(hours)
+    }
+
+@app.get("/retention")
+def get_retention():
+    return {
+        "keep_days": settings.RETENTION_KEEP_DAYS,
+        "keep_tasks": settings.RETENTION_KEEP_TASKS,
+        "interval": settings.RETENTION_INTERVAL,
+        "last_report": retention.last_report,
+    }
+
+@app.post("/retention/run")
+def run_retention():
+    # 立即执行一次保留策略，返回归档条数和回收的空间
+    return retention.run()
+
+@app.get("/archive/tasks/{day}")
+def get_archived_tasks(day: str):
+    # day 形如 20240131 (归档当天的日期)
+    return archived_tasks(day)
+
+@app.get("/logging")
+def get_logging():
+    return get_levels()
+
+@app.put("/logging/printers/{serial_no}")
+def update_printer_log_level(serial_no: str, level: str):
+    # 运行时调整单台打印机的日志级别 (DEBUG/INFO/WARNING/ERROR)
+    try:
+        set_printer_level(serial_no, level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return get_levels()
+
+@app.delete("/logging/printers/{serial_no}")
+def reset_printer_log_level(serial_no: str):
+    set_printer_level(serial_no, None)
+    return get_levels()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # 管理员接口：未配置 ADMIN_TOKEN 时整体关闭
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(x_admin_token or "", settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+def get_profiler():
+    return profiler.status()
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+def start_profiler(interval: float = 0.02, duration: float = 0):
+    # 对所有线程采样 (调度循环、上传线程池、paho 网络线程)，duration 为 0 时最长运行 PROFILER_MAX_SECONDS
+    if not profiler.start(interval, duration):
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    return profiler.status()
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+def stop_profiler():
+    # 返回 collapsed stacks，可直接用 flamegraph.pl 或 speedscope 打开
+    profiler.stop()
+    return profiler.collapsed()
+
+@app.get("/admin/profiler/collapsed", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+def get_profile():
+    # 最近一次 (或正在进行的) 采样结果
+    return profiler.collapsed()
+
+@app.get("/admin/tracing", dependencies=[Depends(require_admin)])
+def get_tracing():
+    return tracer.summary()
+
+@app.put("/admin/tracing", dependencies=[Depends(require_admin)])
+def update_tracing(enabled: bool):
+    # 运行时开关热点路径耗时追踪，重新开启时清空之前的统计
+    tracer.set_enabled(enabled)
+    return tracer.summary()
+
+@app.get("/admin/tracing/events", dependencies=[Depends(require_admin)])
+def get_tracing_events():
+    # Chrome trace event 格式，可在 Perfetto / chrome://tracing 中按线程查看
+    return tracer.events()
+
 @app.delete("/tasks/{task_id}")
 def delete_task(task_id: int, session: Session = Depends(get_session)):
     task = session.get(Task, task_id)
@@ -278,6 +556,13 @@ def delete_task(task_id: int, session: Session = Depends(get_session)):
         FileHandler.delete_local_files(task.filepath, task.thumbnail_path)
     else:
         logging.info(f"Skipping file deletion for {task.filename}, referenced by other tasks.")
+
+    # 缩略图/精简包按内容哈希共用 (不同上传可能是同一个文件)，没有任务再引用该哈希时才删除
+    if task.file_hash and not session.exec(
+        select(Task.id).where(Task.file_hash == task.file_hash).where(Task.id != task_id)
+    ).first():
+        thumbnails.delete(task.file_hash)
+        transfer.delete(task.file_hash)
     
     session.delete(task)
     session.commit()
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from sqlmodel import Field, SQLModel
 from datetime import datetime
 from app.enums import TaskStatus, PrinterStatus
@@ -9,6 +9,12 @@ class PrinterBase(SQLModel):
     ip: str = Field(unique=True)
     access_code: str
     serial_no: str = Field(unique=True)
+    # 负载均衡用的能力信息 (可选，未填写视为不限制)
+    model: Optional[str] = None # 切片文件中的 printer_model_id，例如 A1 mini 为 N1
+    has_ams: Optional[bool] = None
+    availability: Optional[str] = None # 允许任务结束 (换盘) 的时段，例如 "08:00-22:00"，为空表示全天
+    site: Optional[str] = Field(default=None, index=True) # 所在车间/网段 (多节点部署时按它分片)，为空归入 "default"
+    tags: Optional[str] = None # 自定义标签，逗号分隔 (批量指令按标签选择打印机)
     
 class Printer(PrinterBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -17,6 +23,17 @@ class Printer(PrinterBase, table=True):
 class PrinterCreate(PrinterBase):
     pass
 
+class PrinterUpdate(SQLModel):
+    name: Optional[str] = None
+    ip: Optional[str] = None
+    access_code: Optional[str] = None
+    serial_no: Optional[str] = None
+    model: Optional[str] = None
+    has_ams: Optional[bool] = None
+    availability: Optional[str] = None
+    site: Optional[str] = None
+    tags: Optional[str] = None
+
 class PrinterRead(PrinterBase):
     id: int
     status: str = PrinterStatus.OFFLINE # 运行时状态，不存数据库
@@ -25,9 +42,10 @@ class PrinterRead(PrinterBase):
 class TaskBase(SQLModel):
     filename: str
     filepath: str
-    status: str = TaskStatus.PENDING # pending, printing, completed, failed
+    status: str = Field(default=TaskStatus.PENDING, index=True) # pending, printing, completed, failed
     created_at: datetime = Field(default_factory=datetime.now)
     completed_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None # 打印指令下发时间 (统计实际打印时长)
     
     # 绑定特定打印机 (可选)
     assigned_printer_id: Optional[int] = Field(default=None, foreign_key="printer.id")
@@ -44,6 +62,17 @@ class TaskBase(SQLModel):
     # 元数据
     thumbnail_path: Optional[str] = None
     estimated_time: Optional[int] = 0 # 秒
+    file_hash: Optional[str] = Field(default=None, index=True) # 文件内容 MD5 (同时用作 SD 卡上的文件名)
+    transfer_hash: Optional[str] = None # 精简 3MF 的 MD5 (SLIM_3MF 开启时 SD 卡上按它命名)
+    printer_model: Optional[str] = None # 切片时选择的机型
+    filament_count: int = 1 # 用到的耗材数，>1 需要 AMS
+
+    # 失败重试
+    attempts: int = 0 # 已失败次数
+    error_code: Optional[int] = None # 最近一次失败的打印机错误码 (上传/指令失败时为空)
+    last_failed_printer_id: Optional[int] = None # 最近一次失败的打印机，重新排队时避开它
+    claimed_by: Optional[str] = None # 认领该任务的节点 (分片模式下的 NODE_ID)
+    dispatch_tag: Optional[str] = None # 最近一次下发写入 subtask_name 的标识 (每次下发都不同)
 
 class Task(TaskBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -53,3 +82,42 @@ class TaskCreate(TaskBase):
 
 class TaskRead(TaskBase):
     id: int
+
+# --- SD Card Cache Models ---
+class PrinterFile(SQLModel, table=True):
+    """打印机 SD 卡上由本系统上传的文件 (按内容哈希命名，见 app.sd_cache)"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    printer_id: int = Field(foreign_key="printer.id", index=True)
+    content_hash: str = Field(index=True)
+    remote_name: str
+    size: int = 0
+    last_used: datetime = Field(default_factory=datetime.now) # 最近一次用于打印的时间 (LRU)
+
+# --- Sharding Models ---
+class ShardLease(SQLModel, table=True):
+    """多节点部署时某个分片 (site) 当前由哪个节点负责，租约到期未续约则可被其他节点接管 (见 app.sharding)"""
+    site: str = Field(primary_key=True)
+    node_id: str = ""
+    expires_at: float = 0 # unix 时间戳
+    acquired_at: float = 0
+
+# --- Timeline Models ---
+class PrinterEvent(SQLModel, table=True):
+    """打印机状态时间线 (只追加，由 app.timeline 批量写入)"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    serial_no: str = Field(index=True)
+    ts: float = Field(index=True) # unix 时间戳
+    kind: str # EventKind
+    g_st: Optional[int] = None
+    progress: Optional[int] = None
+    error: Optional[int] = None
+
+# --- Command Models ---
+class CommandRequest(SQLModel):
+    command: str # pause / resume / stop / light_on / light_off / pushall
+    # 选择打印机：以下条件同时满足 (取交集)，全部为空表示整个农场
+    printer_ids: Optional[List[int]] = None
+    tags: Optional[List[str]] = None # 带有其中任一标签
+    status: Optional[List[str]] = None # 运行状态之一：printing / idle / finished / error / online / offline
+    timeout: Optional[float] = None # 等待回执的时间 (秒)，默认 COMMAND_TIMEOUT
+    pause_queue: Optional[bool] = None # 发送前先暂停派单，默认 stop 时暂停 (避免空出来的打印机马上被派新任务)
@@ -1,117 +1,341 @@
 import ssl
 import json
 import time
+import random
+import itertools
 import threading
 import logging
-import paho.mqtt.client as mqtt
-from typing import Dict, Optional
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from app.config import settings
 from app.models import Printer
+from app.enums import EventKind
+from app.timeline import timeline
+from app.profiling import tracer
+from app.snapshot import snapshot_cache
+from app.state_store import StateStore, Column, GstColumn, Flag, state_store
+
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqtt # 运行时在 add_printer 中按需导入，不拖慢 app.main 的导入
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 任务结果 (按打印机上报的 subtask_name 归属到具体任务)
+JOB_RUNNING, JOB_FINISHED, JOB_FAILED = "running", "finished", "failed"
+_JOB_HISTORY = 32 # 每台打印机记住最近多少个任务的结果
+
+_tls_context: Optional[ssl.SSLContext] = None
+
+def tls_context() -> ssl.SSLContext:
+    """
+    所有打印机共用一个 TLS 上下文。打印机是自签名证书、本来就不校验，
+    不需要像 client.tls_set() 那样为每台打印机加载一遍系统 CA (每次几十毫秒，上千台时启动要一分钟)
+    """
+    global _tls_context
+    if _tls_context is None:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        _tls_context = ctx
+    return _tls_context
+
+def job_tag(task_id: int, sequence_id: Optional[str] = None) -> str:
+    """
+    下发时写入 subtask_name 的标识，打印机上报时原样带回。带上下发指令的 sequence_id，每次下发都不同：
+    同一任务重试/重新排队回到同一台打印机、或删除任务后 ID 被复用时，不会读到上一次下发的结果。
+    不带 sequence_id 的 bbm-<id> 是旧版本下发的任务。
+    """
+    return f"bbm-{task_id}-{sequence_id}" if sequence_id else f"bbm-{task_id}"
+
 class PrinterState:
-    def __init__(self, serial_no: str):
+    """
+    单台打印机的运行时状态。字段实际存放在 StateStore 的列里 (见 app.state_store)，
+    这里只是指向某个槽位的轻量视图，属性读写和方法与原来一致。
+    """
+    __slots__ = ("serial_no", "slot", "_store")
+
+    g_st = GstColumn("g_st")                     # 全局状态码 (-1:未知, 1:空闲, 6:打印中...)
+    print_error = Column("print_error")          # 错误码
+    progress = Column("progress")                # 进度
+    nozzle_temp = Column("nozzle_temp")          # 喷头温度
+    bed_temp = Column("bed_temp")                # 热床温度
+    last_finish_time = Column("last_finish_time") # 上次完成时间戳
+    is_cooling_down = Flag("cooling")            # 是否处于换盘冷却期
+    connected = Flag("connected")                # MQTT连接状态
+    last_report_time = Column("last_report_time") # 最近一次收到上报的时间戳 (断开时清零)
+    connected_at = Column("connected_at")        # 最近一次 MQTT 连接成功的时间戳
+    job_error = Column("job_error")              # 当前任务期间出现过的错误码 (锁存到上报的 subtask_name 变化，0 表示无)
+    job_key = Column("job_key")                  # 打印机上报的当前/最近一个任务 (subtask_name)
+    reports_job_ids = Flag("reports_job")        # 固件是否回传 subtask_name (不回传时退回按空闲判定完成)
+
+    def __init__(self, serial_no: str, store: StateStore = state_store):
         self.serial_no = serial_no
-        self.g_st = -1          # 全局状态码 (-1:未知, 1:空闲, 6:打印中...)
-        self.print_error = 0    # 错误码
-        self.progress = 0       # 进度
-        self.nozzle_temp = 0    # 喷头温度
-        self.bed_temp = 0       # 热床温度
-        self.lock = threading.Lock()
-        self.last_finish_time = 0 # 上次完成时间戳
-        self.is_cooling_down = False # 是否处于换盘冷却期
-        self.connected = False # MQTT连接状态
+        self._store = store
+        self.slot = store.allocate(serial_no, self)
+
+    def release(self):
+        """打印机移除后归还槽位；仍持有该视图的代码读到的是一个独立的默认状态 (离线)，不会串到新打印机上"""
+        store, slot = self._store, self.slot
+        detached = StateStore()
+        self.slot = detached.allocate(self.serial_no, self)
+        self._store = detached
+        store.release(slot)
+
+    @property
+    def lock(self) -> threading.Lock:
+        return self._store.lock_for(self.slot) # 分条锁，见 StateStore
+
+    @property
+    def job_outcomes(self) -> "OrderedDict[str, Tuple[str, int]]":
+        """job_key -> (结果, 错误码)；首次用到时才创建"""
+        outcomes = self._store.job_outcomes[self.slot]
+        if outcomes is None:
+            outcomes = self._store.job_outcomes[self.slot] = OrderedDict()
+        return outcomes
 
     def update(self, payload):
-        with self.lock:
-            old_gst = self.g_st
-            old_progress = self.progress
-            
-            if 'g_st' in payload: self.g_st = int(payload['g_st'])
-            if 'print_error' in payload: self.print_error = int(payload['print_error'])
-            if 'mc_percent' in payload: self.progress = int(payload['mc_percent'])
-            if 'nozzle_temper' in payload: self.nozzle_temp = float(payload['nozzle_temper'])
-            if 'bed_temper' in payload: self.bed_temp = float(payload['bed_temper'])
+        # 热路径：直接按槽位读写列，避免每个字段都走一次描述符
+        st, i = self._store, self.slot
+        with st.lock_for(i):
+            now = time.time()
+            st.last_report_time[i] = now
+            old_gst = st.g_st[i]
+            old_progress = st.progress[i]
+            old_error = st.print_error[i]
+            old_view = self._view()
+
+            if 'g_st' in payload:
+                g_st = int(payload['g_st'])
+                st.g_st[i] = g_st
+                st.g_code[i] = g_st & 0xFF
+            if 'print_error' in payload: st.print_error[i] = int(payload['print_error'])
+            if 'mc_percent' in payload: st.progress[i] = int(payload['mc_percent'])
+            if 'nozzle_temper' in payload: st.nozzle_temp[i] = float(payload['nozzle_temper'])
+            if 'bed_temper' in payload: st.bed_temp[i] = float(payload['bed_temper'])
+            if payload.get('subtask_name'):
+                job_key = str(payload['subtask_name'])
+                if job_key != st.job_key[i]:
+                    # 换了任务：上一个任务锁存的错误 (打印机会持续上报 FAILED/错误码) 不能算到新任务头上
+                    st.job_key[i] = job_key
+                    st.job_error[i] = 0
+                st.reports_job[i] = 1
+            gcode_state = payload.get('gcode_state')
+            g_st, progress, print_error = st.g_st[i], st.progress[i], st.print_error[i]
+
+            # 错误检测：错误码从无到有，或固件直接报告任务失败
+            if print_error and print_error != old_error:
+                st.job_error[i] = print_error
+                logger.warning("[%s] ⚠️ 打印错误: %s (g_st=%s, progress=%s)",
+                               self.serial_no, print_error, g_st, progress, extra={"serial_no": self.serial_no})
+            elif gcode_state == 'FAILED' and not st.job_error[i]:
+                st.job_error[i] = print_error or -1
             
             # 判断逻辑变更：兼容 -1 状态
             # 1. 传统 g_st 判定: 6 -> 100/1
-            gst_finished = (old_gst == 6 and (self.g_st == 100 or self.g_st == 1))
+            gst_finished = (old_gst == 6 and (g_st == 100 or g_st == 1))
             
             # 2. 进度判定: 之前没满，现在满了
-            progress_finished = (old_progress < 100 and self.progress == 100)
+            progress_finished = (old_progress < 100 and progress == 100)
             
+            if progress_finished and print_error == 0:
+                # 报错后被人工处理并继续打完 (例如断料续打)，不算失败
+                st.job_error[i] = 0
+
             if gst_finished or progress_finished:
-                logger.info(f"[{self.serial_no}] 🎉 判定打印完成 (g_st: {old_gst}->{self.g_st}, progress: {old_progress}->{self.progress})，进入冷却期...")
-                self.last_finish_time = time.time()
-                self.is_cooling_down = True
+                logger.info("[%s] 🎉 判定打印完成 (g_st: %s->%s, progress: %s->%s)，进入冷却期...",
+                            self.serial_no, old_gst, g_st, old_progress, progress, extra={"serial_no": self.serial_no})
+                st.last_finish_time[i] = now
+                st.cooling[i] = 1
+                timeline.record(self.serial_no, EventKind.FINISH, g_st, progress, print_error)
+
+            # 把本条上报的结论记到它所属的任务上
+            if st.job_key[i]:
+                job_error = st.job_error[i]
+                if gcode_state == 'FAILED' or job_error:
+                    self._set_outcome(JOB_FAILED, job_error or print_error or -1)
+                elif gcode_state == 'FINISH' or gst_finished or progress_finished:
+                    self._set_outcome(JOB_FINISHED, 0)
+                elif gcode_state in ('RUNNING', 'PREPARE', 'PAUSE') or g_st == 6:
+                    self._set_outcome(JOB_RUNNING, 0)
+            
+            # 记录时间线 (只记录状态转换与进度里程碑)
+            if g_st != old_gst:
+                timeline.record(self.serial_no, EventKind.STATE, g_st, progress, print_error)
+            elif progress // settings.TIMELINE_PROGRESS_STEP != old_progress // settings.TIMELINE_PROGRESS_STEP:
+                timeline.record(self.serial_no, EventKind.PROGRESS, g_st, progress, print_error)
+            if print_error != old_error:
+                timeline.record(self.serial_no, EventKind.ERROR, g_st, progress, print_error)
+
+            # 页面上可见的字段变化时才让快照失效 (温度按整数度比较，避免每条上报都失效)
+            if self._view() != old_view:
+                snapshot_cache.invalidate()
                 
-            # 日志优化：只在关键字段变化时返回 True，告知上层打印日志
-            has_changed = (self.g_st != old_gst) or (self.progress != old_progress)
+            # 日志合并：只在 g_st/错误码变化或进度跨过 LOG_PROGRESS_STEP 档位时返回 True，告知上层打印日志
+            step = settings.LOG_PROGRESS_STEP
+            has_changed = (
+                (g_st != old_gst) or
+                (print_error != old_error) or
+                (progress // step != old_progress // step)
+            )
             return has_changed
 
+    def _view(self) -> tuple:
+        st, i = self._store, self.slot
+        return (st.g_st[i], st.print_error[i], st.progress[i], int(st.nozzle_temp[i]), int(st.bed_temp[i]),
+                st.cooling[i], st.job_key[i], st.job_error[i])
+
     def check_cooldown(self):
         """检查冷却是否结束"""
-        with self.lock:
-            if self.is_cooling_down:
-                elapsed = time.time() - self.last_finish_time
+        st, i = self._store, self.slot
+        if not st.cooling[i]:
+            return True # 快速路径：绝大多数时候不在冷却，不用加锁
+        with st.lock_for(i):
+            if st.cooling[i]:
+                elapsed = time.time() - st.last_finish_time[i]
                 if elapsed >= settings.SWAP_COOLDOWN:
-                    self.is_cooling_down = False
-                    logger.info(f"[{self.serial_no}] ❄️ 冷却期结束，准备就绪")
+                    st.cooling[i] = 0
+                    snapshot_cache.invalidate()
+                    logger.info("[%s] ❄️ 冷却期结束，准备就绪", self.serial_no, extra={"serial_no": self.serial_no})
+                    timeline.record(self.serial_no, EventKind.COOLDOWN_END)
                 else:
                     return False # 还在冷却
             return True
 
+    def _set_outcome(self, outcome: str, error: int):
+        """调用方持有锁。已结束的任务不会被改回 running，已完成的任务不会被改成失败"""
+        current = self.job_outcomes.get(self.job_key)
+        if current and (outcome == JOB_RUNNING or current[0] == JOB_FINISHED):
+            return
+        if current != (outcome, error):
+            self.job_outcomes[self.job_key] = (outcome, error)
+            self.job_outcomes.move_to_end(self.job_key)
+            while len(self.job_outcomes) > _JOB_HISTORY:
+                self.job_outcomes.popitem(last=False)
+
+    def job_outcome(self, tag: str) -> Optional[Tuple[str, int]]:
+        """打印机报告过的该次下发 (job_tag) 的结果，从未报告过返回 None"""
+        with self.lock:
+            outcomes = self._store.job_outcomes[self.slot]
+            return outcomes.get(tag) if outcomes else None
+
+    def begin_job(self, tag: str):
+        """下发新任务前清除上一次任务的错误锁存和当前任务标识，以及同一标识残留的结果"""
+        st, i = self._store, self.slot
+        with st.lock_for(i):
+            st.job_error[i] = 0
+            st.job_key[i] = None
+            outcomes = st.job_outcomes[i]
+            if outcomes:
+                outcomes.pop(tag, None)
+        snapshot_cache.invalidate()
+
+    def report_age(self) -> float:
+        """距离最近一次上报的秒数 (从未上报返回 inf)"""
+        last_report = self._store.last_report_time[self.slot]
+        if not last_report:
+            return float("inf")
+        return time.time() - last_report
+
+    def is_stale(self) -> bool:
+        """数据过期：连接看似正常但打印机长时间没有上报"""
+        return self.report_age() > settings.STALE_THRESHOLD
+
     def is_safe_to_print(self):
         """核心安全检查"""
+        if not self._store.connected[self.slot]:
+            return False, "Offline"
+
+        # 过期的数据不可信 (包括刚连上还没收到 pushall 回复的情况)，不往这台打印机派活
+        if self.is_stale():
+            return False, f"Stale (last report {self.report_age():.0f}s ago)"
+
         if not self.check_cooldown():
             return False, "Cooling down"
 
-        with self.lock:
-            # 宽松判定：
-            # 1. g_st == 1 (标准空闲)
-            # 2. g_st == -1 且 error=0 且 (progress=100 或 progress=0)
-            # 注意：如果 progress=100 且冷却已过，我们认为上一张已推走
-            is_idle = (self.g_st == 1)
-            is_unknown_but_likely_idle = (
-                self.g_st == -1 and 
-                self.print_error == 0 and 
-                (self.progress == 100 or self.progress == 0)
-            )
-            
-            if is_idle or is_unknown_but_likely_idle:
-                return True, "Ready"
-            
-            return False, f"Busy/Error (g_st={self.g_st}, err={self.print_error}, prog={self.progress})"
+        st, i = self._store, self.slot
+        with st.lock_for(i):
+            g_st, print_error, progress = st.g_st[i], st.print_error[i], st.progress[i]
+        # 宽松判定：
+        # 1. g_st == 1 (标准空闲)
+        # 2. g_st == -1 且 error=0 且 (progress=100 或 progress=0)，且数据新鲜 (上面已检查)
+        # 注意：如果 progress=100 且冷却已过，我们认为上一张已推走
+        is_idle = (g_st == 1)
+        is_unknown_but_likely_idle = (
+            g_st == -1 and 
+            print_error == 0 and 
+            (progress == 100 or progress == 0)
+        )
+        
+        if is_idle or is_unknown_but_likely_idle:
+            return True, "Ready"
+        
+        return False, f"Busy/Error (g_st={g_st}, err={print_error}, prog={progress})"
 
     def get_status_dict(self):
         with self.lock:
-            return {
-                "serial_no": self.serial_no,
-                "g_st": self.g_st,
-                "error": self.print_error,
-                "progress": self.progress,
-                "nozzle_temp": self.nozzle_temp,
-                "bed_temp": self.bed_temp,
-                "is_cooling": self.is_cooling_down,
-                "connected": self.connected
-            }
+            return self._status_dict()
+
+    def _status_dict(self) -> dict:
+        """调用方持有锁；get_all_states 不加锁读取，得到的是近似快照"""
+        st, i = self._store, self.slot
+        connected = st.connected[i] == 1
+        last_report = st.last_report_time[i]
+        age = time.time() - last_report if last_report else float("inf")
+        return {
+            "serial_no": self.serial_no,
+            "g_st": st.g_st[i],
+            "error": st.print_error[i],
+            "progress": st.progress[i],
+            "nozzle_temp": st.nozzle_temp[i],
+            "bed_temp": st.bed_temp[i],
+            "is_cooling": st.cooling[i] == 1,
+            "connected": connected,
+            "job_error": st.job_error[i],
+            "job": st.job_key[i],
+            "stale": connected and age > settings.STALE_THRESHOLD,
+            "last_report_age": round(age, 1) if last_report else None
+        }
 
 class PrinterManager:
-    def __init__(self):
-        self.clients: Dict[str, mqtt.Client] = {}
+    def __init__(self, store: StateStore = state_store):
+        self.store = store
+        self.clients: Dict[str, "mqtt.Client"] = {}
         self.states: Dict[str, PrinterState] = {}
+        self.printers: Dict[str, Printer] = {} # 连接参数快照，用于强制重连
         self.lock = threading.Lock()
+        self._sequence = itertools.count(int(time.time())) # 指令 sequence_id，进程内唯一且随重启递增
+        self._acks: Dict[Tuple[str, str], list] = {} # (serial_no, sequence_id) -> [Event, 回执]
+        self._pushall_acks: Dict[str, str] = {} # serial_no -> 等待回执的 pushall sequence_id
 
     def get_state(self, serial_no: str) -> Optional[PrinterState]:
         return self.states.get(serial_no)
 
     def get_all_states(self) -> Dict[str, dict]:
-        return {sn: state.get_status_dict() for sn, state in self.states.items()}
+        # 只读快照，不加锁：各字段都是单值读取，最多与正在进行的一次上报差一个字段
+        states = list(self.states.values())
+        return {state.serial_no: state._status_dict() for state in states}
+
+    def ready_states(self) -> List[PrinterState]:
+        """
+        当前可以派单的打印机。先整列扫描出冷却中的槽位让到期的结束冷却，
+        再扫描出 "已连接 + 不在冷却 + g_st 空闲/未知" 的候选，只对候选做完整的 is_safe_to_print 判定。
+        """
+        for state in self.store.views_of(self.store.cooling_slots()):
+            state.check_cooldown()
+        return [s for s in self.store.views_of(self.store.idle_candidates()) if s.is_safe_to_print()[0]]
+
+    def connected_states(self) -> List[PrinterState]:
+        return self.store.views_of(self.store.connected_slots())
 
     def add_printer(self, printer: Printer):
+        """
+        注册打印机并在后台建立连接 (非阻塞)。
+        connect_async + loop_start 让 TCP 连接发生在 paho 自己的网络线程里，
+        首次连接失败也会按 reconnect_delay_set 的退避策略持续重试，
+        因此一台离线打印机不会阻塞 HTTP 请求或启动流程，批量添加时各台并行建连。
+        """
+        import paho.mqtt.client as mqtt
+
         with self.lock:
             if printer.serial_no in self.clients:
                 logger.warning(f"Printer {printer.serial_no} already managed, skipping add.")
@@ -120,81 +344,228 @@ class PrinterManager:
             logger.info(f"Adding printer manager for {printer.name} ({printer.ip})...")
             
             # 初始化状态
-            self.states[printer.serial_no] = PrinterState(printer.serial_no)
+            self.states[printer.serial_no] = PrinterState(printer.serial_no, self.store)
+            snapshot_cache.invalidate()
             
-            # 初始化 MQTT 客户端
-            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+            # 初始化 MQTT 客户端 (userdata 为序列号，所有客户端共用同一组回调)
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, userdata=printer.serial_no)
             client.username_pw_set("bblp", printer.access_code)
-            client.tls_set(cert_reqs=ssl.CERT_NONE)
+            client.tls_set_context(tls_context())
             client.tls_insecure_set(True)
+            self._set_jittered_backoff(client)
             
-            # 绑定回调 (闭包捕获 serial_no)
-            client.on_connect = self._create_on_connect(printer.serial_no)
-            client.on_message = self._create_on_message(printer.serial_no)
-            client.on_disconnect = self._create_on_disconnect(printer.serial_no)
+            client.on_connect = self._on_connect
+            client.on_message = self._on_message
+            client.on_disconnect = self._on_disconnect
             
+            # 先登记再启动网络线程，保证 on_connect 回调能识别当前客户端
+            self.clients[printer.serial_no] = client
+            self.printers[printer.serial_no] = Printer(
+                id=printer.id, name=printer.name, ip=printer.ip,
+                access_code=printer.access_code, serial_no=printer.serial_no
+            )
             try:
-                client.connect(printer.ip, 8883, 60)
+                client.connect_async(printer.ip, settings.PRINTER_MQTT_PORT, 60)
                 client.loop_start()
-                self.clients[printer.serial_no] = client
-            except Exception as e:
-                logger.error(f"Failed to connect to printer {printer.serial_no}: {e}")
-
-    def _create_on_connect(self, serial_no: str):
-        def on_connect(client, userdata, flags, rc, properties=None):
-            if rc == 0:
-                logger.info(f"[{serial_no}] ✅ MQTT 连接成功")
-                if serial_no in self.states:
-                    self.states[serial_no].connected = True
-                
-                client.subscribe(f"device/{serial_no}/report")
-                
-                # 发送状态全量查询
-                push_cmd = {"pushing": {"sequence_id": "1", "command": "pushall"}}
-                client.publish(f"device/{serial_no}/request", json.dumps(push_cmd))
-            else:
-                logger.error(f"[{serial_no}] ❌ MQTT 连接失败 code: {rc}")
-        return on_connect
-
-    def _create_on_disconnect(self, serial_no: str):
-        def on_disconnect(client, userdata, flags, rc, properties=None):
-            logger.warning(f"[{serial_no}] 🔌 MQTT 断开连接")
-            if serial_no in self.states:
-                self.states[serial_no].connected = False
-        return on_disconnect
-
-    def _create_on_message(self, serial_no: str):
-        def on_message(client, userdata, msg):
-            try:
-                payload_str = msg.payload.decode()
-                payload = json.loads(payload_str)
-                state = self.states.get(serial_no)
-                
-                if state and 'print' in payload:
-                    has_changed = state.update(payload['print'])
-                    if has_changed:
-                        status = state.get_status_dict()
-                        logger.info(f"[{serial_no}] 🔄 状态: {status['g_st']} | {status['progress']}%")
             except Exception as e:
-                logger.error(f"[{serial_no}] 解析错误: {e}")
-        return on_message
+                self.clients.pop(printer.serial_no, None)
+                self.states.pop(printer.serial_no).release()
+                self.printers.pop(printer.serial_no, None)
+                logger.error(f"Failed to start MQTT client for printer {printer.serial_no}: {e}")
+
+    def add_printers(self, printers: List[Printer]):
+        """批量添加 (启动时/批量导入)，连接在后台并行建立"""
+        for p in printers:
+            self.add_printer(p)
+
+    def remove_printer(self, serial_no: str):
+        """停止并移除打印机的 MQTT 客户端和运行时状态"""
+        with self.lock:
+            client = self.clients.pop(serial_no, None)
+            state = self.states.pop(serial_no, None)
+            self.printers.pop(serial_no, None)
+        if state:
+            state.release()
+        snapshot_cache.invalidate()
+        if client is None:
+            return
+        logger.info(f"Removing printer manager for {serial_no}...")
+        # loop_stop 会 join 网络线程，若该线程正卡在连接超时里会阻塞，放到后台执行
+        threading.Thread(target=self._teardown_client, args=(client,), daemon=True).start()
+
+    def update_printer(self, old_serial_no: str, printer: Printer):
+        """IP/访问码/序列号变更后重建连接"""
+        self.remove_printer(old_serial_no)
+        self.add_printer(printer)
+
+    def restart_printer(self, serial_no: str):
+        """丢弃当前客户端并重新建连 (健康检查判定连接假死时使用)"""
+        printer = self.printers.get(serial_no)
+        if printer:
+            self.update_printer(serial_no, printer)
+
+    def request_pushall(self, serial_no: str) -> bool:
+        """请求打印机全量上报 (轻量心跳探测)"""
+        client = self.clients.get(serial_no)
+        if not client or not client.is_connected():
+            return False
+        push_cmd = {"pushing": {"sequence_id": self.next_sequence_id(), "command": "pushall"}}
+        client.publish(f"device/{serial_no}/request", json.dumps(push_cmd))
+        return True
 
-    def publish_print_task(self, printer: Printer, filename: str, md5: str, params: dict):
+    def publish_command(self, serial_no: str, section: str, body: dict) -> Optional[str]:
+        """
+        发送通用指令 ({section: {sequence_id, **body}})，返回 sequence_id (未连接返回 None)，可用 wait_for_ack 等待回执。
+        pushall 的回复是一条全量上报而不是带 result 的回执，收到该打印机的下一条 print 上报即视为成功。
+        """
+        client = self.clients.get(serial_no)
+        if not client or not client.is_connected():
+            return None
+        sequence_id = self.next_sequence_id()
+        payload = {section: dict(body, sequence_id=sequence_id)}
+        # 先登记再发送，避免回执比登记先到
+        self._acks[(serial_no, sequence_id)] = [threading.Event(), None]
+        if section == "pushing":
+            self._pushall_acks[serial_no] = sequence_id
+        client.publish(f"device/{serial_no}/request", json.dumps(payload))
+        return sequence_id
+
+    def next_sequence_id(self) -> str:
+        # itertools.count 的 next() 在 CPython 下是原子的，无需加锁
+        return str(next(self._sequence))
+
+    def wait_for_ack(self, serial_no: str, sequence_id: str, timeout: float) -> Optional[bool]:
+        """
+        等待打印机对指令的回执 (同一 sequence_id 且带 result 的 print 报文)。
+        返回 True 成功 / False 打印机拒绝 / None 超时未收到
+        """
+        entry = self._acks.get((serial_no, sequence_id))
+        if entry is None:
+            return None
+        try:
+            if not entry[0].wait(timeout):
+                return None
+            result = str(entry[1].get("result", "")).lower()
+            if result not in ("success", "ok"):
+                logger.warning("[%s] 打印机拒绝指令 %s: %s", serial_no, sequence_id, entry[1].get("reason", result),
+                               extra={"serial_no": serial_no})
+                return False
+            return True
+        finally:
+            self._acks.pop((serial_no, sequence_id), None)
+
+    def _resolve_ack(self, serial_no: str, payload: dict):
+        entry = self._acks.get((serial_no, str(payload.get("sequence_id"))))
+        if entry is not None:
+            entry[1] = payload
+            entry[0].set()
+
+    @staticmethod
+    def _set_jittered_backoff(client: "mqtt.Client"):
+        """
+        带随机抖动的重连退避：paho 从 min_delay 开始每次翻倍直到 max_delay，
+        每台打印机的起点和上限都随机化，路由器重启后所有客户端不会在同一时刻一起重连。
+        只在创建客户端时设置一次：reconnect_delay_set 会把 paho 当前的退避进度清零，
+        在断开回调里重复调用会让退避永远停在起点。
+        """
+        jitter = settings.RECONNECT_JITTER
+        client.reconnect_delay_set(
+            min_delay=random.uniform(1, 1 + jitter * 4),
+            max_delay=int(settings.RECONNECT_MAX_DELAY * random.uniform(1 - jitter, 1)) or 1
+        )
+
+    @staticmethod
+    def _teardown_client(client: "mqtt.Client"):
+        try:
+            client.disconnect()
+            client.loop_stop()
+        except Exception as e:
+            logger.error(f"Failed to stop MQTT client: {e}")
+
+    def _is_current(self, serial_no: str, client: "mqtt.Client") -> bool:
+        # 已删除/已替换的旧客户端的回调直接忽略
+        return self.clients.get(serial_no) is client
+
+    # 回调：所有客户端共用，userdata 即打印机序列号
+    def _on_connect(self, client, serial_no, flags, rc, properties=None):
+        if not self._is_current(serial_no, client):
+            return
+        if rc == 0:
+            logger.info("[%s] ✅ MQTT 连接成功", serial_no, extra={"serial_no": serial_no})
+            state = self.states.get(serial_no)
+            if state:
+                state.connected = True
+                state.connected_at = time.time()
+            snapshot_cache.invalidate()
+            timeline.record(serial_no, EventKind.CONNECT)
+            
+            client.subscribe(f"device/{serial_no}/report")
+            
+            # 发送状态全量查询
+            self.request_pushall(serial_no)
+        else:
+            logger.error("[%s] ❌ MQTT 连接失败 code: %s", serial_no, rc, extra={"serial_no": serial_no})
+
+    def _on_disconnect(self, client, serial_no, flags, rc, properties=None):
+        if not self._is_current(serial_no, client):
+            return
+        logger.warning("[%s] 🔌 MQTT 断开连接", serial_no, extra={"serial_no": serial_no})
+        state = self.states.get(serial_no)
+        if state:
+            state.connected = False
+            # 断开前的上报不代表重连后的状态：重连后收到新上报之前按无上报处理
+            state.last_report_time = 0.0
+        snapshot_cache.invalidate()
+        timeline.record(serial_no, EventKind.DISCONNECT)
+
+    @tracer.traced("mqtt.on_message")
+    def _on_message(self, client, serial_no, msg):
+        try:
+            payload = json.loads(msg.payload)
+            state = self.states.get(serial_no)
+            if state:
+                # 任何上报都说明打印机还活着
+                state.last_report_time = time.time()
+            
+            for section in ('print', 'system'):
+                if section in payload and 'result' in payload[section]:
+                    # 指令回执 (灯光等 system 指令的回执在 system 里)，唤醒等待该 sequence_id 的线程
+                    self._resolve_ack(serial_no, payload[section])
+            if 'print' in payload and serial_no in self._pushall_acks:
+                sequence_id = self._pushall_acks.pop(serial_no, None)
+                self._resolve_ack(serial_no, {"sequence_id": sequence_id, "result": "success"})
+
+            if state and 'print' in payload:
+                has_changed = state.update(payload['print'])
+                if has_changed:
+                    # 惰性格式化：真正的字符串拼接在日志监听线程完成
+                    logger.info("[%s] 🔄 状态: %s | %s%%", serial_no, state.g_st, state.progress,
+                                extra={"serial_no": serial_no, "g_st": state.g_st, "progress": state.progress})
+        except Exception as e:
+            logger.error("[%s] 解析错误: %s", serial_no, e, extra={"serial_no": serial_no})
+
+    def publish_print_task(self, printer: Printer, filename: str, md5: str, params: dict,
+                           task_id: int = 0) -> Optional[str]:
+        """
+        下发打印指令，返回 sequence_id (失败返回 None)，可用 wait_for_ack 等待回执。
+        subtask_name 写入本系统的任务标识，打印机之后的上报会带回它，用于判定这个任务的完成/失败。
+        """
         client = self.clients.get(printer.serial_no)
-        if not client:
+        if not client or not client.is_connected():
             logger.error(f"Cannot publish task: Printer {printer.serial_no} not connected")
-            return False
+            return None
 
+        sequence_id = self.next_sequence_id()
         payload = {
             "print": {
-                "sequence_id": str(int(time.time())), 
+                "sequence_id": sequence_id,
                 "command": "project_file",
                 "param": "Metadata/plate_1.gcode", 
                 "project_id": "0",
                 "profile_id": "0",
-                "task_id": "0",
-                "subtask_id": "0",
-                "subtask_name": "",
+                "task_id": str(task_id),
+                "subtask_id": str(task_id),
+                "subtask_name": job_tag(task_id, sequence_id) if task_id else "",
                 "file": filename,
                 "url": f"file:///sdcard/{filename}",
                 "md5": md5,
@@ -206,9 +577,14 @@ class PrinterManager:
                 "use_ams": params.get('use_ams', False)
             }
         }
+        state = self.states.get(printer.serial_no)
+        if state:
+            state.begin_job(job_tag(task_id, sequence_id))
+        # 先登记再发送，避免回执比登记先到
+        self._acks[(printer.serial_no, sequence_id)] = [threading.Event(), None]
         client.publish(f"device/{printer.serial_no}/request", json.dumps(payload))
-        logger.info(f"[{printer.serial_no}] 🚀 打印指令已发送: {filename}")
-        return True
+        logger.info(f"[{printer.serial_no}] 🚀 打印指令已发送: {filename} (seq={sequence_id})")
+        return sequence_id
 
 # 全局单例
 manager = PrinterManager()
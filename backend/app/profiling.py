@@ -0,0 +1,211 @@
+import re
+import sys
+import time
+import logging
+import threading
+import functools
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 同类线程合并成一个根节点：paho-mqtt-client-<SN> -> paho-mqtt-client，upload_3 -> upload，
+# 未命名的 "Thread-7 (_loop)" -> "Thread (_loop)"
+_THREAD_SUFFIX = re.compile(r"(_\d+|-[A-Za-z]*\d[\w]*)$")
+_THREAD_DEFAULT = re.compile(r"^Thread-\d+ ")
+
+def _thread_group(name: str) -> str:
+    return _THREAD_SUFFIX.sub("", _THREAD_DEFAULT.sub("Thread ", name)) or name
+
+def _quantile_ms(durations: list, q: float) -> Optional[float]:
+    """durations 已排序"""
+    if not durations:
+        return None
+    return round(durations[min(len(durations) - 1, int(len(durations) * q))] * 1000, 2)
+
+class SamplingProfiler:
+    """
+    采样分析器：后台线程按 interval 读取所有线程的调用栈 (sys._current_frames)，按栈计数。
+    - 不插桩、不用 sys.setprofile，被分析的代码没有额外开销，代价只在采样线程本身 (每次采样持有一次 GIL)
+    - 输出 collapsed stacks ("线程;外层函数;...;内层函数 次数")，可直接交给 flamegraph.pl / speedscope
+    - 函数帧只记到函数级，最内层帧带行号，能看出卡在哪一行 (锁等待、socket 读写、SQLite 调用)
+    - 最长运行 PROFILER_MAX_SECONDS，忘记停止也会自动结束，结果保留到下一次开始
+    """
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+        self.interval = 0.02
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._labels: Dict[object, str] = {} # code 对象 -> 帧名称缓存
+        self._lock = threading.Lock()
+
+    def start(self, interval: float = 0.02, duration: float = 0) -> bool:
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            self.interval = max(interval, 0.001)
+            self.started_at = time.time()
+            self.stopped_at = 0.0
+            self.samples = 0
+            self.stacks = Counter()
+        limit = min(duration or settings.PROFILER_MAX_SECONDS, settings.PROFILER_MAX_SECONDS)
+        self.thread = threading.Thread(target=self._loop, args=(limit,), name="profiler", daemon=True)
+        self.thread.start()
+        logger.info(f"🔬 采样分析已开始 (间隔 {self.interval * 1000:.0f} ms, 最长 {limit:.0f} 秒)")
+        return True
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            module = code.co_filename.rsplit("/", 1)[-1]
+            label = self._labels[code] = f"{code.co_name} ({module})"
+        return label
+
+    def _stack(self, frame, thread: str) -> str:
+        parts = [f"{self._label(frame.f_code)}:{frame.f_lineno}"]
+        frame = frame.f_back
+        while frame is not None:
+            parts.append(self._label(frame.f_code))
+            frame = frame.f_back
+        parts.append(thread)
+        return ";".join(reversed(parts))
+
+    def _loop(self, limit: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + limit
+        names: Dict[int, str] = {}
+        # 线程 -> (上次的最内层帧, 行号, 栈)：空闲线程 (大部分 paho 线程) 两次采样间停在同一帧同一行，
+        # 帧对象存活期间调用链不变，直接复用上次拼好的栈，单次采样的开销基本只和活跃线程数有关
+        last: Dict[int, Tuple[object, int, str]] = {}
+        while self.running and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = {t.ident: _thread_group(t.name) for t in threading.enumerate()}
+            current = {}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                cached = last.get(ident)
+                if cached is not None and cached[0] is frame and cached[1] == frame.f_lineno:
+                    stack = cached[2]
+                else:
+                    stack = self._stack(frame, names.get(ident, "unknown"))
+                current[ident] = (frame, frame.f_lineno, stack)
+                self.stacks[stack] += 1
+            last = current
+            del frames, current
+            self.samples += 1
+            time.sleep(self.interval)
+        last.clear()
+        self.running = False
+        self.stopped_at = time.time()
+        logger.info(f"🔬 采样分析结束: {self.samples} 次采样, {len(self.stacks)} 种调用栈")
+
+    def collapsed(self) -> str:
+        stacks = dict(self.stacks) # 采样线程可能还在写入，先做一次快照
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1]))
+
+    def status(self) -> dict:
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "seconds": round(end - self.started_at, 1) if self.started_at else 0,
+        }
+
+class SpanTracer:
+    """
+    热点路径耗时追踪 (运行时开关，默认关闭)：
+    - 用 @tracer.traced(name) 标记函数，关闭时每次调用只多一次属性判断
+    - 开启后记录每个名称的次数/总耗时/最大耗时，保留最近 TRACE_BUFFER 条用于分位数和时间线
+    - events() 输出 Chrome trace event 格式，可在 Perfetto / chrome://tracing 中按线程查看
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stats: Dict[str, list] = {} # name -> [次数, 总耗时, 最大耗时]
+        self._spans: Deque[Tuple[str, str, float, float]] = deque(maxlen=settings.TRACE_BUFFER) # (name, 线程, 开始, 耗时)
+
+    def set_enabled(self, enabled: bool):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+        logger.info(f"⏱️ 耗时追踪已{'开启' if enabled else '关闭'}")
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._spans = deque(maxlen=settings.TRACE_BUFFER)
+
+    def record(self, name: str, start: float, duration: float):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += duration
+            stat[2] = max(stat[2], duration)
+            self._spans.append((name, threading.current_thread().name, start, duration))
+
+    def traced(self, name: str):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.time()
+                t0 = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, start, time.perf_counter() - t0)
+            return wrapper
+        return decorator
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = {name: list(s) for name, s in self._stats.items()}
+            recent: Dict[str, list] = {}
+            for name, _, _, duration in self._spans:
+                recent.setdefault(name, []).append(duration)
+        result = {}
+        for name, (count, total, longest) in sorted(stats.items()):
+            durations = sorted(recent.get(name, []))
+            result[name] = {
+                "count": count,
+                "total_ms": round(total * 1000, 1),
+                "avg_ms": round(total / count * 1000, 2),
+                "p50_ms": _quantile_ms(durations, 0.5),
+                "p95_ms": _quantile_ms(durations, 0.95),
+                "max_ms": round(longest * 1000, 2),
+            }
+        return {"enabled": self.enabled, "spans": result}
+
+    def events(self) -> dict:
+        with self._lock:
+            spans = list(self._spans)
+        tids: Dict[str, int] = {}
+        events = []
+        for name, thread, start, duration in spans:
+            tid = tids.setdefault(thread, len(tids) + 1)
+            events.append({"name": name, "ph": "X", "pid": 1, "tid": tid,
+                           "ts": round(start * 1e6), "dur": round(duration * 1e6)})
+        events.extend({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}}
+                      for thread, tid in tids.items())
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+# 全局单例
+profiler = SamplingProfiler()
+tracer = SpanTracer()
@@ -0,0 +1,203 @@
+import os
+import gzip
+import json
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Task
+from app.enums import TaskStatus
+from app.file_handler import FileHandler
+from app.thumbnails import thumbnails
+from app.transfer import transfer
+from app.sharding import shards
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FINISHED = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+BATCH_SIZE = 500
+
+class RetentionJob:
+    """
+    已结束任务 (completed/failed/cancelled) 的保留策略，后台按 RETENTION_INTERVAL 运行：
+    - 超过 RETENTION_KEEP_DAYS 天，或超出最近 RETENTION_KEEP_TASKS 条的任务，写入 ARCHIVE_DIR 下按天的 gzip JSONL 后从库中删除
+    - 归档任务的上传文件/缩略图/精简包只有在没有任何剩余任务 (包括待打印的) 引用时才删除
+    - 上传目录中没有任务引用的孤儿文件 (超过 RETENTION_ORPHAN_GRACE 秒) 一并清理
+    - 删除后用 incremental_vacuum 分批归还空闲页，不做阻塞整库的 VACUUM
+    """
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self.last_report: Optional[dict] = None
+        self._lock = threading.Lock() # 定时运行和手动触发不能同时进行
+
+    def start(self):
+        if not self.running and settings.RETENTION_INTERVAL > 0:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self):
+        while self.running:
+            time.sleep(settings.RETENTION_INTERVAL)
+            if not shards.is_leader():
+                continue # 多节点共用一个库时只由一个节点执行
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"保留策略执行异常: {e}")
+
+    def run(self) -> dict:
+        with self._lock:
+            started = time.time()
+            db_before = _db_size()
+            ids = self._expired_ids()
+            archived, archive_path, files = 0, None, []
+            for i in range(0, len(ids), BATCH_SIZE):
+                count, archive_path, released = self._archive_batch(ids[i:i + BATCH_SIZE])
+                archived += count
+                files.extend(released)
+            freed_files = self._delete_unreferenced(files)
+            orphans = self._sweep_orphans()
+            freed_files = {k: freed_files[k] + orphans[k] for k in freed_files}
+            vacuumed = incremental_vacuum()
+
+            report = {
+                "ran_at": datetime.now(),
+                "archived_tasks": archived,
+                "archive_file": archive_path,
+                "deleted_files": freed_files["count"],
+                "freed_file_bytes": freed_files["bytes"],
+                "db_bytes_before": db_before,
+                "db_bytes_after": _db_size(),
+                "vacuumed_pages": vacuumed,
+                "duration": round(time.time() - started, 3),
+            }
+            report["reclaimed_bytes"] = report["freed_file_bytes"] + max(0, db_before - report["db_bytes_after"])
+            self.last_report = report
+            if archived or freed_files["count"]:
+                logger.info(f"🧹 已归档 {archived} 个任务，删除 {freed_files['count']} 个文件，"
+                            f"共回收 {report['reclaimed_bytes'] / 1024 ** 2:.1f} MB")
+            return report
+
+    def _expired_ids(self) -> List[int]:
+        """按天数和条数两条规则选出要归档的已结束任务 (任一规则命中即归档)"""
+        finished_at = func.coalesce(Task.completed_at, Task.created_at)
+        ids: Set[int] = set()
+        with Session(engine) as session:
+            if settings.RETENTION_KEEP_DAYS > 0:
+                cutoff = datetime.now() - timedelta(days=settings.RETENTION_KEEP_DAYS)
+                ids.update(session.exec(
+                    select(Task.id).where(Task.status.in_(FINISHED)).where(finished_at < cutoff)
+                ).all())
+            if settings.RETENTION_KEEP_TASKS > 0:
+                ids.update(session.exec(
+                    select(Task.id).where(Task.status.in_(FINISHED))
+                    .order_by(finished_at.desc(), Task.id.desc())
+                    .offset(settings.RETENTION_KEEP_TASKS)
+                ).all())
+        return sorted(ids)
+
+    def _archive_batch(self, ids: List[int]):
+        """一批任务：先追加写归档文件，再删库 (归档写失败则不删)"""
+        with Session(engine) as session:
+            # 只删仍处于结束状态的 (期间可能被重试放回队列)
+            tasks = session.exec(select(Task).where(Task.id.in_(ids)).where(Task.status.in_(FINISHED))).all()
+            if not tasks:
+                return 0, None, []
+            path = os.path.join(settings.ARCHIVE_DIR, f"tasks-{datetime.now():%Y%m%d}.jsonl.gz")
+            lines = "".join(json.dumps(t.model_dump(mode="json"), ensure_ascii=False) + "\n" for t in tasks)
+            # gzip 支持多个成员拼接，直接追加即可
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                f.write(lines)
+            released = [(t.filepath, t.thumbnail_path, t.file_hash) for t in tasks]
+            session.execute(delete(Task).where(Task.id.in_([t.id for t in tasks])))
+            session.commit()
+        return len(tasks), path, released
+
+    def _delete_unreferenced(self, files) -> dict:
+        freed = {"count": 0, "bytes": 0}
+        if not files:
+            return freed
+        with Session(engine) as session:
+            for filepath, thumbnail_path, file_hash in set(files):
+                if filepath and not session.exec(select(Task.id).where(Task.filepath == filepath)).first():
+                    if os.path.exists(filepath):
+                        freed["count"] += 1
+                        freed["bytes"] += _file_size(filepath)
+                    FileHandler.delete_local_files(filepath, thumbnail_path)
+                if file_hash and not session.exec(select(Task.id).where(Task.file_hash == file_hash)).first():
+                    thumbnails.delete(file_hash)
+                    transfer.delete(file_hash)
+        return freed
+
+    def _sweep_orphans(self) -> dict:
+        """上传目录里没有任何任务引用的文件 (例如手动删库、旧版本残留)；刚写入的文件可能还没入库，留出宽限期"""
+        freed = {"count": 0, "bytes": 0}
+        if settings.RETENTION_ORPHAN_GRACE <= 0 or not os.path.isdir(settings.UPLOAD_DIR):
+            return freed
+        with Session(engine) as session:
+            # 按文件名比较：UPLOAD_DIR 挂载位置变过时库里的绝对路径可能和当前目录不一致
+            referenced = {os.path.basename(p) for p in session.exec(select(Task.filepath).distinct()).all() if p}
+        deadline = time.time() - settings.RETENTION_ORPHAN_GRACE
+        for entry in os.scandir(settings.UPLOAD_DIR):
+            if not entry.is_file() or entry.name in referenced:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime < deadline:
+                FileHandler.delete_local_files(entry.path)
+                freed["count"] += 1
+                freed["bytes"] += stat.st_size
+        return freed
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _db_size() -> int:
+    return _file_size(settings.DB_PATH)
+
+def incremental_vacuum() -> int:
+    """
+    每次归还最多 RETENTION_VACUUM_PAGES 个空闲页，各自一个短事务，中间让出写锁，直到没有空闲页。
+    返回归还的页数 (auto_vacuum 不是 INCREMENTAL 时为 0)
+    """
+    released = 0
+    raw = engine.raw_connection()
+    try:
+        if raw.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free = raw.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            # sqlite3 模块的 execute() 只 step 一次 (每次只归还一页)，executescript 会执行到底
+            raw.executescript(f"PRAGMA incremental_vacuum({int(settings.RETENTION_VACUUM_PAGES)});")
+            remaining = raw.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            released += free - remaining
+            free = remaining
+            time.sleep(0.01)
+    finally:
+        raw.close()
+    return released
+
+def archived_tasks(day: str) -> List[dict]:
+    """读取某天 (YYYYMMDD) 的归档任务"""
+    path = os.path.join(settings.ARCHIVE_DIR, f"tasks-{day}.jsonl.gz")
+    if not day.isdigit() or not os.path.exists(path):
+        return []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# 全局单例
+retention = RetentionJob()
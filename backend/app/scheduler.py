@@ -1,15 +1,25 @@
 import time
 import threading
 import logging
-import requests
 from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
 from sqlmodel import Session, select
 from app.database import engine
 from app.models import Task, Printer
-from app.mqtt_client import manager
+from app.mqtt_client import manager, job_tag, JOB_RUNNING, JOB_FINISHED, JOB_FAILED
 from app.file_handler import FileHandler
+from app.sd_cache import sd_cache
+from app.transfer import transfer
+from app.balancer import balancer
+from app.circuit_breaker import circuit_breaker
+from app.sharding import shards
 from app.config import settings
+from app.enums import EventKind, TaskStatus
+from app.timeline import timeline
+from app.profiling import tracer
+from collections import defaultdict
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
 
 logger = logging.getLogger(__name__)
 
@@ -18,16 +28,30 @@ class Scheduler:
         self.running = False
         self.thread = None
         self.paused = False # 全局暂停开关
-        # 创建线程池，最大并发数设为 5 (可根据打印机数量调整)
-        self.executor = ThreadPoolExecutor(max_workers=5)
+        self.cancelling: Set[int] = set() # 操作员已发出停止的任务 ID，之后上报的失败按取消处理
+        # 创建线程池，最大并发数由 UPLOAD_WORKERS 控制 (可根据打印机数量调整)
+        self.executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS, thread_name_prefix="upload")
 
     def start(self):
         if not self.running:
             self.running = True
+            if not shards.enabled:
+                self._recover_interrupted() # 分片模式下由 ShardCoordinator 在接管分片时按打印机恢复
             self.thread = threading.Thread(target=self._loop, daemon=True)
             self.thread.start()
             logger.info("📅 调度器已启动")
 
+    def _recover_interrupted(self):
+        """上次退出时还在上传/等待回执的任务放回队列 (否则会一直占着打印机)"""
+        with Session(engine) as session:
+            tasks = session.exec(select(Task).where(Task.status == TaskStatus.UPLOADING)).all()
+            for t in tasks:
+                t.status = TaskStatus.PENDING
+                session.add(t)
+            if tasks:
+                session.commit()
+                logger.info(f"♻️ {len(tasks)} 个中断的上传任务已放回队列")
+
     def stop(self):
         self.running = False
         self.executor.shutdown(wait=False)
@@ -40,93 +64,213 @@ class Scheduler:
             except Exception as e:
                 logger.error(f"调度循环异常: {e}")
             
-            time.sleep(2) # 2秒轮询一次
+            time.sleep(settings.SCHEDULER_INTERVAL) # 默认 2 秒轮询一次
 
     def _check_and_run(self):
         with Session(engine) as session:
-            # 获取所有打印机
-            printers = session.exec(select(Printer)).all()
+            # 获取所有打印机 (分片模式下只处理本节点负责的)
+            all_printers = session.exec(select(Printer)).all()
+            printers = [p for p in all_printers if shards.owns(p)]
+
+            # 一次查出所有上传中/打印中的任务，按打印机分组
+            active_by_printer = defaultdict(list)
+            for t in session.exec(
+                select(Task).where(Task.status.in_([TaskStatus.UPLOADING, TaskStatus.PRINTING]))
+            ).all():
+                active_by_printer[t.assigned_printer_id].append(t)
+
+            # 整列扫描出可派单的打印机，只有它们和手上有任务的打印机需要逐台处理
+            ready = {state.serial_no for state in manager.ready_states()}
             
-            for printer in printers:
-                self._process_printer(session, printer)
+            # 先逐台同步状态，收集本轮空闲的打印机 (熔断中的打印机不再派单)
+            free_printers = [
+                p for p in printers
+                if (p.serial_no in ready or p.id in active_by_printer)
+                and self._process_printer(session, p, active_by_printer.get(p.id, []))
+                and circuit_breaker.allow(p.id)
+            ]
 
-    def _process_printer(self, session: Session, printer: Printer):
-        """处理单个打印机的调度逻辑"""
+            # 再把空闲打印机和候选任务作为一批统一分配
+            if free_printers:
+                self._dispatch_batch(session, free_printers, avoid_failed=len(all_printers) > 1)
+
+    @tracer.traced("scheduler.process_printer")
+    def _process_printer(self, session: Session, printer: Printer, active_tasks: List[Task]) -> bool:
+        """同步单个打印机上传中/打印中任务 (active_tasks) 的状态，返回它当前是否可以接新任务"""
         state = manager.get_state(printer.serial_no)
         if not state:
-            return
+            return False
 
-        # 0. 同步状态：如果打印机空闲，但数据库里有该打印机的 printing 任务
+        # 0. 同步状态：按打印机上报的任务标识 (subtask_name) 判定每个任务的完成/失败
         is_safe, reason = state.is_safe_to_print()
-        
-        if is_safe:
-            # 查找该打印机正在进行的任务
-            printing_tasks = session.exec(
-                select(Task)
-                .where(Task.status == "printing")
-                .where(Task.assigned_printer_id == printer.id)
-            ).all()
-            
-            for t in printing_tasks:
+
+        busy = False
+        changed = False
+        for t in active_tasks:
+            if t.status == TaskStatus.UPLOADING:
+                busy = True # 还在上传/等待回执，不能再派新任务
+                continue
+
+            outcome = state.job_outcome(t.dispatch_tag or job_tag(t.id))
+            if outcome is None:
+                # 打印机还没有报告过这个任务：指令可能还在路上，继续等待
+                waited = (datetime.now() - t.started_at).total_seconds() if t.started_at else float("inf")
+                if not is_safe or waited < settings.JOB_CONFIRM_TIMEOUT:
+                    busy = True
+                    continue
+                if state.reports_job_ids:
+                    # 打印机一直空闲且从未报告这个任务：没有开始
+                    self._fail_task(session, t, printer, "打印机未开始任务")
+                    changed = True
+                    continue
+                # 固件不回传 subtask_name：退回按空闲判定 (打印中报过错算失败)
+                outcome = (JOB_FAILED, state.job_error) if state.job_error else (JOB_FINISHED, 0)
+
+            status, error_code = outcome
+            if status == JOB_RUNNING:
+                busy = True
+            elif status == JOB_FAILED:
+                # 打印过程中报过错且没有正常打完：算失败，重新排队
+                self._fail_task(session, t, printer, f"打印错误 {error_code}", error_code)
+                changed = True
+            else:
                 logger.info(f"[{printer.name}] 🔄 自动修正任务状态: {t.filename} -> completed")
-                t.status = "completed"
+                t.status = TaskStatus.COMPLETED
                 t.completed_at = datetime.now()
                 session.add(t)
-                
+                self.cancelling.discard(t.id) # 停止指令到达前已经打完
+                circuit_breaker.record_success(printer.id)
+                changed = True
+
                 # 触发 Webhook 通知
                 self._send_notification(f"✅ 打印完成: {t.filename} ({printer.name})")
-                
-            if printing_tasks:
-                session.commit()
+
+        if changed:
+            session.commit()
 
         # 1. 检查打印机状态
-        if not is_safe:
+        return is_safe and not busy
+
+    def request_cancel(self, printer_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """
+        操作员停止 (急停) 前调用：记下这些打印机上正在上传/打印的任务。
+        之后它们上报的失败 (停止后打印机报 FAILED) 按取消处理，不重新排队、不计入熔断；
+        还在上传的任务不再下发打印指令。返回 打印机 ID -> 任务 ID 列表。
+        """
+        printer_ids = list(printer_ids)
+        if not printer_ids:
+            return {}
+        with Session(engine) as session:
+            rows = session.exec(
+                select(Task.assigned_printer_id, Task.id)
+                .where(Task.assigned_printer_id.in_(printer_ids))
+                .where(Task.status.in_([TaskStatus.UPLOADING, TaskStatus.PRINTING]))
+            ).all()
+        by_printer: Dict[int, List[int]] = defaultdict(list)
+        for printer_id, task_id in rows:
+            by_printer[printer_id].append(task_id)
+            self.cancelling.add(task_id)
+        return by_printer
+
+    def confirm_cancel(self, printer_ids: Iterable[int]) -> List[int]:
+        """打印机已确认停止：其上打印中的任务直接标记为取消，返回这些任务的 ID"""
+        printer_ids = list(printer_ids)
+        if not printer_ids:
+            return []
+        with Session(engine) as session:
+            tasks = session.exec(
+                select(Task)
+                .where(Task.assigned_printer_id.in_(printer_ids))
+                .where(Task.status == TaskStatus.PRINTING)
+            ).all()
+            task_ids = [t.id for t in tasks]
+            for t in tasks:
+                self._cancel_task(session, t, "操作员停止")
+            session.commit()
+        return task_ids
+
+    def _cancel_task(self, session: Session, task: Task, reason: str):
+        """调用方负责 commit"""
+        self.cancelling.discard(task.id)
+        task.status = TaskStatus.CANCELLED
+        task.completed_at = datetime.now()
+        session.add(task)
+        logger.warning(f"⏹️ {reason}，任务 {task.id} 已取消")
+
+    def _fail_task(self, session: Session, task: Task, printer: Printer, reason: str,
+                   error_code: Optional[int] = None):
+        """
+        记录一次失败：计入打印机熔断计数；未超过 MAX_TASK_ATTEMPTS 时放回队列，
+        并记下失败的打印机，下次分配时避开它 (见 balancer)。调用方负责 commit。
+        操作员停止的任务 (request_cancel) 按取消处理。
+        """
+        if task.id in self.cancelling:
+            self._cancel_task(session, task, f"操作员停止 ({reason})")
             return
+        task.attempts = (task.attempts or 0) + 1
+        task.error_code = error_code
+        task.last_failed_printer_id = printer.id
+
+        if task.attempts < settings.MAX_TASK_ATTEMPTS:
+            logger.warning(f"[{printer.name}] 🔁 {reason}，任务 {task.id} 重新排队 (第 {task.attempts} 次失败)")
+            task.status = TaskStatus.PENDING
+            task.assigned_printer_id = None
+            task.started_at = None
+            self._send_notification(f"🔁 {reason}，重新排队: {task.filename} ({printer.name})")
+        else:
+            logger.error(f"[{printer.name}] ❌ {reason}，任务 {task.id} 已失败 {task.attempts} 次，标记为 failed")
+            task.status = TaskStatus.FAILED
+            task.completed_at = datetime.now()
+            self._send_notification(f"❌ {reason}: {task.filename} ({printer.name})")
+        session.add(task)
+
+        if circuit_breaker.record_failure(printer.id, error_code):
+            logger.error(f"[{printer.name}] ⛔ 连续失败 {settings.CIRCUIT_BREAKER_THRESHOLD} 次，已熔断，停止派单")
+            self._send_notification(f"⛔ 打印机连续失败，已停止派单: {printer.name}")
 
-        # 2. 检查队列 (简单的负载均衡)
+    def _dispatch_batch(self, session: Session, printers: List[Printer], avoid_failed: bool = True):
+        """基于代价的批量分配 (见 app.balancer)：考虑 SD 卡缓存、机型/AMS 兼容性和历史打印速度"""
+        # 2. 取候选任务 (按优先级和队列顺序)
+        printer_ids = [p.id for p in printers]
         statement = (
             select(Task)
             .where(Task.status == "pending")
             .where(
                 (Task.assigned_printer_id == None) | 
-                (Task.assigned_printer_id == printer.id)
+                (Task.assigned_printer_id.in_(printer_ids))
             )
             .order_by(Task.priority.desc(), Task.id) # 优先处理 priority 高的，同级按 ID 顺序
-            .limit(1)
+            .limit(balancer.candidate_limit(len(printers)))
         )
-        task = session.exec(statement).first()
+        candidates = session.exec(statement).all()
         
-        if not task:
-            return
-
-        # --- 新增并发检查逻辑 ---
-        # 检查是否有其他任务正在上传同一个文件
-        # 如果有，则跳过当前任务，等待那个任务传完
-        uploading_same_file = session.exec(
-            select(Task)
-            .where(Task.status == "uploading")
-            .where(Task.filepath == task.filepath)
-        ).first()
-
-        if uploading_same_file:
-            logger.info(f"[{printer.name}] 文件正在被任务 {uploading_same_file.id} 上传中，当前任务 {task.id} 等待...")
+        if not candidates:
             return
-        # ------------------------
 
-        logger.info(f"[{printer.name}] ✨ 发现新任务: {task.filename} (ID: {task.id})")
-        
-        # 3. 开始处理流程
-        # 3.1 锁定任务 (防止被其他打印机抢走)
-        task.status = "uploading"
-        task.assigned_printer_id = printer.id # 明确归属
-        session.add(task)
-        session.commit()
-        session.refresh(task)
+        # 远程文件按内容哈希命名，不同打印机并发上传同一个文件互不影响，无需再互相等待
+        for printer, task in balancer.assign(session, printers, candidates, avoid_failed):
+            cached = balancer.is_cached(session, printer, task)
+            logger.info(f"[{printer.name}] ✨ 发现新任务: {task.filename} (ID: {task.id}{', SD 卡已缓存' if cached else ''})")
+            
+            # 3. 开始处理流程
+            # 3.1 锁定任务：条件 UPDATE 原子认领，多个节点共用队列时只有一个能成功
+            claimed = session.execute(
+                update(Task)
+                .where(Task.id == task.id)
+                .where(Task.status == TaskStatus.PENDING)
+                .where((Task.assigned_printer_id == None) | (Task.assigned_printer_id == printer.id))
+                .values(status=TaskStatus.UPLOADING, assigned_printer_id=printer.id, claimed_by=settings.NODE_ID or None)
+            ).rowcount
+            session.commit()
+            if not claimed:
+                logger.info(f"[{printer.name}] 任务 {task.id} 已被其他节点认领，跳过")
+                continue
 
-        # 3.2 提交到线程池异步执行 (避免阻塞主循环)
-        # 传递 ID 而不是对象，防止 Session 跨线程问题
-        self.executor.submit(self._execute_task_job, printer.id, task.id)
+            # 3.2 提交到线程池异步执行 (避免阻塞主循环)
+            # 传递 ID 而不是对象，防止 Session 跨线程问题
+            self.executor.submit(self._execute_task_job, printer.id, task.id)
 
+    @tracer.traced("scheduler.execute_task_job")
     def _execute_task_job(self, printer_id: int, task_id: int):
         """在独立线程中执行耗时的上传和指令发送"""
         # 每个线程必须创建独立的 Session
@@ -139,17 +283,49 @@ class Scheduler:
                 return
 
             try:
-                # 1. 上传文件 (FTP)
-                if not FileHandler.upload_to_printer(task.filepath, task.filename, printer_ip=printer.ip, access_code=printer.access_code):
-                    logger.error(f"[{printer.name}] 上传失败，任务标记为 failed")
-                    task.status = "failed"
+                timeline.record(printer.serial_no, EventKind.UPLOAD_START)
+
+                # 1. 计算 MD5 (上传时已算好，旧任务补算一次)
+                if not task.file_hash:
+                    task.file_hash = FileHandler.calculate_md5(task.filepath)
                     session.add(task)
                     session.commit()
-                    self._send_notification(f"❌ 上传失败: {task.filename} ({printer.name})")
+                # 精简 3MF (SLIM_3MF)：上传和指令里的 md5 都换成精简包的
+                local_path, md5 = transfer.prepare(session, task)
+                session.commit()
+
+                # 2. 上传文件 (FTP)，SD 卡上按哈希命名，已缓存则跳过
+                remote_name = sd_cache.ensure_file(printer, local_path, md5)
+                if not remote_name:
+                    self._fail_task(session, task, printer, "上传失败")
+                    session.commit()
                     return
 
-                # 2. 计算 MD5
-                md5 = FileHandler.calculate_md5(task.filepath)
+                # 分片租约可能在上传期间失效 (续约失败/被接管)：不再下发，任务放回队列。
+                # 只改本节点认领的：如果其他节点已经接管并重新认领，不能覆盖它的认领
+                if not shards.owns(printer):
+                    logger.warning(f"[{printer.name}] 🧩 分片租约已失效，放弃下发，任务 {task.id} 放回队列")
+                    session.execute(
+                        update(Task)
+                        .where(Task.id == task.id)
+                        .where(Task.status == TaskStatus.UPLOADING)
+                        .where(Task.claimed_by == settings.NODE_ID)
+                        .values(status=TaskStatus.PENDING)
+                    )
+                    session.commit()
+                    return
+
+                # 上传期间打印机被删除，任务已重新排队：不再下发
+                session.refresh(task)
+                if task.status != TaskStatus.UPLOADING or task.assigned_printer_id != printer.id:
+                    logger.warning(f"[{printer.name}] 任务 {task.id} 上传期间已被改派 ({task.status})，放弃下发")
+                    return
+
+                # 上传期间操作员发出了停止：不再下发
+                if task.id in self.cancelling:
+                    self._cancel_task(session, task, "操作员停止 (上传期间)")
+                    session.commit()
+                    return
 
                 # 3. 发送 MQTT 指令
                 params = {
@@ -160,24 +336,32 @@ class Scheduler:
                 }
                 
                 # 注意：manager 是全局单例，本身是线程安全的
-                if manager.publish_print_task(printer, task.filename, md5, params):
+                sequence_id = manager.publish_print_task(printer, remote_name, md5, params, task_id=task.id)
+                if not sequence_id:
+                    self._fail_task(session, task, printer, "MQTT指令发送失败")
+                    session.commit()
+                # 等待打印机回执：明确拒绝的算失败；超时不算失败，之后按上报的任务标识确认是否开始
+                elif manager.wait_for_ack(printer.serial_no, sequence_id, settings.PRINT_ACK_TIMEOUT) is False:
+                    # 卡上的文件可能已不存在：不能让重试继续命中缓存、跳过上传
+                    sd_cache.forget_file(printer.id, md5)
+                    self._fail_task(session, task, printer, "打印机拒绝任务")
+                    session.commit()
+                else:
                     # 4. 更新状态
                     task.status = "printing"
+                    task.dispatch_tag = job_tag(task.id, sequence_id)
+                    task.started_at = datetime.now()
                     task.completed_at = None
                     session.add(task)
                     session.commit()
+                    timeline.record(printer.serial_no, EventKind.DISPATCH)
                     logger.info(f"[{printer.name}] ✅ 任务 {task.id} 已下发 (异步)")
                     self._send_notification(f"🚀 开始打印: {task.filename} ({printer.name})")
-                else:
-                    logger.error(f"[{printer.name}] MQTT指令发送失败")
-                    task.status = "failed"
-                    session.add(task)
-                    session.commit()
                     
             except Exception as e:
                 logger.error(f"[{printer.name}] 异步执行异常: {e}")
-                task.status = "failed"
-                session.add(task)
+                session.rollback()
+                self._fail_task(session, task, printer, "下发异常")
                 session.commit()
 
     def _send_notification(self, content: str):
@@ -185,6 +369,8 @@ class Scheduler:
         if not settings.WEBHOOK_URL:
             return
             
+        import requests # 按需导入：没配置 Webhook 时不加载 (requests 导入较慢)
+
         try:
             # 适配常见的 Webhook 格式 (如企业微信、钉钉、飞书、PushPlus)
             # 这里使用通用的 JSON 格式
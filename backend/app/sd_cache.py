@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Set
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Printer, PrinterFile, Task
+from app.enums import TaskStatus
+from app.file_handler import FileHandler, ImplicitFTP_TLS
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 本系统上传的文件统一按内容哈希命名，只有这类文件会被缓存管理 (淘汰)，用户自己放的文件不动
+_CACHE_NAME_RE = re.compile(r"^([0-9a-f]{32})\.gcode\.3mf$")
+
+class SDCardCache:
+    """
+    每台打印机 SD 卡的文件缓存：
+    - 远程文件名 = 内容 MD5，不同文件同名不会再误用
+    - printerfile 表记录每张卡上有哪些哈希，首次使用时用 FTP 列表校准
+    - 空间预算 (SD_CACHE_MAX_BYTES) 不足时按最近打印时间 (LRU) 淘汰
+    """
+    def __init__(self):
+        self._synced: Set[int] = set()
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    @staticmethod
+    def remote_name(content_hash: str) -> str:
+        return f"{content_hash}.gcode.3mf"
+
+    def _lock_for(self, printer_id: int) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(printer_id, threading.Lock())
+
+    def cached_hashes(self, session: Session, printer_id: int) -> Set[str]:
+        return set(session.exec(
+            select(PrinterFile.content_hash).where(PrinterFile.printer_id == printer_id)
+        ).all())
+
+    def forget_printer(self, session: Session, printer_id: int):
+        """打印机被删除时清理缓存记录"""
+        for entry in session.exec(select(PrinterFile).where(PrinterFile.printer_id == printer_id)).all():
+            session.delete(entry)
+        self._synced.discard(printer_id)
+
+    def invalidate(self, printer_id: int):
+        """下次使用前重新用 FTP 列表校准 (换卡/格式化后)"""
+        self._synced.discard(printer_id)
+
+    def forget_file(self, printer_id: int, content_hash: str):
+        """打印机拒绝了按缓存下发的文件 (卡上已被删除/换卡)：删掉这条记录并重新校准，下次重新上传"""
+        with self._lock_for(printer_id):
+            with Session(engine) as session:
+                entry = self._entry(session, printer_id, content_hash)
+                if entry:
+                    session.delete(entry)
+                    session.commit()
+            self._synced.discard(printer_id)
+
+    def ensure_file(self, printer: Printer, local_path: str, content_hash: str) -> Optional[str]:
+        """
+        确保文件已在打印机 SD 卡上，返回远程文件名；上传失败返回 None。
+        已缓存时完全跳过 FTP。
+        数据库写入都放在各自的短事务里：校准/淘汰在 STOR 之前提交，新文件记录在上传完成后再写，
+        上传期间 (可能持续几分钟) 不持有 SQLite 写锁。
+        """
+        remote = self.remote_name(content_hash)
+        with self._lock_for(printer.id):
+            with Session(engine) as session:
+                entry = self._entry(session, printer.id, content_hash)
+                if entry and printer.id in self._synced:
+                    logger.info(f"[{printer.name}] 📦 SD 卡缓存命中: {remote}，跳过上传")
+                    entry.last_used = datetime.now()
+                    session.add(entry)
+                    session.commit()
+                    return remote
+
+            def prepare(ftp: ImplicitFTP_TLS, local_size: int):
+                with Session(engine) as session:
+                    if printer.id not in self._synced:
+                        self._sync(session, printer, ftp)
+                    self._evict(session, printer, ftp, local_size, keep=content_hash)
+                    session.commit()
+
+            if not FileHandler.upload_to_printer(local_path, remote, printer_ip=printer.ip,
+                                                 access_code=printer.access_code, before_upload=prepare):
+                return None
+
+            with Session(engine) as session:
+                entry = self._entry(session, printer.id, content_hash) or \
+                    PrinterFile(printer_id=printer.id, content_hash=content_hash, remote_name=remote)
+                entry.size = os.path.getsize(local_path)
+                entry.last_used = datetime.now()
+                session.add(entry)
+                session.commit()
+            return remote
+
+    @staticmethod
+    def _entry(session: Session, printer_id: int, content_hash: str) -> Optional[PrinterFile]:
+        return session.exec(
+            select(PrinterFile)
+            .where(PrinterFile.printer_id == printer_id)
+            .where(PrinterFile.content_hash == content_hash)
+        ).first()
+
+    def _sync(self, session: Session, printer: Printer, ftp: ImplicitFTP_TLS):
+        """用 FTP 列表校准数据库记录：卡上没有的删掉，卡上有但不认识的哈希文件补记录"""
+        names = set(ftp.nlst())
+        entries = session.exec(select(PrinterFile).where(PrinterFile.printer_id == printer.id)).all()
+        known = set()
+        for entry in entries:
+            if entry.remote_name in names:
+                known.add(entry.remote_name)
+            else:
+                session.delete(entry)
+        for name in names - known:
+            m = _CACHE_NAME_RE.match(name)
+            if not m:
+                continue
+            try:
+                size = ftp.size(name) or 0
+            except Exception:
+                size = 0
+            # 不知道上次使用时间，按最旧处理，优先淘汰
+            session.add(PrinterFile(printer_id=printer.id, content_hash=m.group(1), remote_name=name,
+                                    size=size, last_used=datetime.fromtimestamp(0)))
+        session.flush()
+        self._synced.add(printer.id)
+        logger.info(f"[{printer.name}] SD 卡缓存已校准: {len(names)} 个文件")
+
+    def _evict(self, session: Session, printer: Printer, ftp: ImplicitFTP_TLS, incoming: int, keep: str):
+        entries = session.exec(
+            select(PrinterFile)
+            .where(PrinterFile.printer_id == printer.id)
+            .order_by(PrinterFile.last_used)
+        ).all()
+        if any(e.content_hash == keep for e in entries):
+            return # 文件已在卡上，不需要额外空间
+
+        # 正在上传/打印的任务用到的文件不能删
+        in_use = set()
+        for file_hash, transfer_hash in session.exec(
+            select(Task.file_hash, Task.transfer_hash)
+            .where(Task.assigned_printer_id == printer.id)
+            .where(Task.status.in_([TaskStatus.UPLOADING, TaskStatus.PRINTING]))
+        ).all():
+            in_use.update((file_hash, transfer_hash))
+
+        used = sum(e.size for e in entries)
+        for entry in entries:
+            if used + incoming <= settings.SD_CACHE_MAX_BYTES:
+                break
+            if entry.content_hash in in_use:
+                continue
+            try:
+                ftp.delete(entry.remote_name)
+            except Exception as e:
+                # 文件可能还在卡上，保留记录 (下次校准时以 FTP 列表为准)
+                logger.warning(f"[{printer.name}] 删除 SD 卡文件失败 {entry.remote_name}: {e}")
+                continue
+            logger.info(f"[{printer.name}] 🧹 SD 卡空间不足，淘汰 {entry.remote_name} (上次使用 {entry.last_used})")
+            used -= entry.size
+            session.delete(entry)
+        session.flush()
+
+# 全局单例
+sd_cache = SDCardCache()
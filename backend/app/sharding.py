@@ -0,0 +1,192 @@
+import time
+import threading
+import logging
+from typing import List, Set
+from sqlalchemy import insert, update, or_
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Printer, ShardLease, Task
+from app.enums import TaskStatus
+from app.mqtt_client import manager
+from app.snapshot import snapshot_cache
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SITE = "default"
+LEADER_SITE = "__leader__" # 全局唯一的维护任务 (保留策略等) 只在持有该租约的节点上运行
+
+def site_of(printer: Printer) -> str:
+    return printer.site or DEFAULT_SITE
+
+class ShardCoordinator:
+    """
+    多节点分片 (设置了 NODE_ID 时启用)：
+    - 打印机按 site 分片，每个分片同一时刻只由一个节点负责：只有它连接这些打印机 (MQTT/FTPS 流量留在本地网段) 并向其派单
+    - 分片归属来自 shardlease 表里的租约，用条件 UPDATE 抢占/续约 (rowcount 判定是否成功)，
+      节点失联超过 SHARD_LEASE_TTL 后，其他配置了该分片的节点在下一次续约时接管
+    - 接管时把这些打印机上 "上传中" 的任务放回队列 (原节点的上传已中断)
+    - 任务队列是共享的，任务由各节点在派单时用条件 UPDATE 原子认领 (见 Scheduler._dispatch_batch)
+    未启用时 owns() 恒为真，行为与单节点完全相同。
+    """
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self.sites: Set[str] = set() # 当前持有的分片
+        self.valid_until = 0.0 # 持有的租约在本地视角下的有效期 (续约失败时不会延长)
+        self.leader = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.NODE_ID)
+
+    @staticmethod
+    def configured_sites() -> Set[str]:
+        return {s.strip() for s in settings.NODE_SITES.split(",") if s.strip()}
+
+    def owns(self, printer: Printer) -> bool:
+        """本节点当前是否负责这台打印机 (派单前的最后一道检查，租约过期即视为不再负责)"""
+        if not self.enabled:
+            return True
+        return site_of(printer) in self.sites and time.time() < self.valid_until
+
+    def is_leader(self) -> bool:
+        return not self.enabled or (self.leader and time.time() < self.valid_until)
+
+    def start(self):
+        if self.enabled and not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name="shard-lease", daemon=True)
+            self.thread.start()
+            logger.info(f"🧩 分片模式: 节点 {settings.NODE_ID}，负责 {settings.NODE_SITES or '全部分片'}")
+
+    def stop(self):
+        """主动释放租约，其他节点无需等待过期即可接管"""
+        if not self.running:
+            return
+        self.running = False
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(ShardLease).where(ShardLease.node_id == settings.NODE_ID).values(expires_at=0)
+                )
+        except Exception as e:
+            logger.error(f"释放分片租约失败: {e}")
+        self.sites = set()
+        self.leader = False
+
+    def _loop(self):
+        while self.running:
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"分片续约异常: {e}")
+            time.sleep(settings.SHARD_RENEW_INTERVAL)
+
+    def _wanted_sites(self, session: Session) -> Set[str]:
+        configured = self.configured_sites()
+        if configured:
+            return configured
+        return {site_of(p) for p in session.exec(select(Printer)).all()}
+
+    def renew(self):
+        """
+        抢占/续约想要的分片，然后按结果增减本节点管理的打印机。
+        本节点认为的有效期从开始续约的时间算起并减去 SHARD_CLOCK_MARGIN (写事务可能等锁)，
+        接管别人的租约也要等它过期 SHARD_CLOCK_MARGIN 之后，容忍节点间的时钟偏差。
+        """
+        started = time.time()
+        node_id = settings.NODE_ID
+        margin = settings.SHARD_CLOCK_MARGIN
+        with Session(engine) as session:
+            wanted = self._wanted_sites(session)
+        owned = set()
+        with engine.begin() as conn:
+            now = time.time()
+            for site in wanted | {LEADER_SITE}:
+                conn.execute(insert(ShardLease).prefix_with("OR IGNORE").values(site=site))
+                # 条件更新：自己持有 (续约) 或已过期 (接管)，rowcount 为 1 才算拿到
+                claimed = conn.execute(
+                    update(ShardLease)
+                    .where(ShardLease.site == site)
+                    .where(or_(ShardLease.node_id == node_id, ShardLease.expires_at < now - margin))
+                    .values(
+                        node_id=node_id,
+                        expires_at=now + settings.SHARD_LEASE_TTL,
+                        acquired_at=now if site not in self.sites and site != LEADER_SITE else ShardLease.acquired_at,
+                    )
+                ).rowcount
+                if claimed:
+                    owned.add(site)
+            # 配置里去掉的分片主动放手
+            for site in self.sites - wanted:
+                conn.execute(
+                    update(ShardLease)
+                    .where(ShardLease.site == site)
+                    .where(ShardLease.node_id == node_id)
+                    .values(expires_at=0)
+                )
+
+        self.leader = LEADER_SITE in owned
+        owned.discard(LEADER_SITE)
+        acquired, lost = owned - self.sites, self.sites - owned
+        self.sites = owned
+        self.valid_until = started + settings.SHARD_LEASE_TTL - margin
+        if acquired:
+            logger.info(f"🧩 接管分片: {', '.join(sorted(acquired))}")
+            self._recover_uploads(acquired)
+        if lost:
+            logger.warning(f"🧩 失去分片: {', '.join(sorted(lost))}")
+        self.reconcile()
+
+    def _recover_uploads(self, sites: Set[str]):
+        """新接管分片的打印机上停在 uploading 的任务：原负责节点已失联，放回队列重新分配"""
+        with Session(engine) as session:
+            printer_ids = [p.id for p in session.exec(select(Printer)).all() if site_of(p) in sites]
+            if not printer_ids:
+                return
+            tasks = session.exec(
+                select(Task)
+                .where(Task.status == TaskStatus.UPLOADING)
+                .where(Task.assigned_printer_id.in_(printer_ids))
+            ).all()
+            for t in tasks:
+                t.status = TaskStatus.PENDING
+                session.add(t)
+            if tasks:
+                session.commit()
+                logger.info(f"♻️ {len(tasks)} 个中断的上传任务已放回队列")
+
+    def reconcile(self):
+        """让本节点的 MQTT 连接与持有的分片一致 (打印机增删、site 修改也在这里收敛)"""
+        with Session(engine) as session:
+            printers = session.exec(select(Printer)).all()
+        mine = {p.serial_no: p for p in printers if self.owns(p)}
+        extra = [serial_no for serial_no in list(manager.printers) if serial_no not in mine]
+        for serial_no in extra:
+            manager.remove_printer(serial_no)
+        missing: List[Printer] = [p for s, p in mine.items() if s not in manager.printers]
+        if missing:
+            manager.add_printers(missing)
+        if extra or missing:
+            snapshot_cache.invalidate() # /printers 中的 remote 状态
+
+    def snapshot(self) -> dict:
+        with Session(engine) as session:
+            leases = session.exec(select(ShardLease)).all()
+        now = time.time()
+        return {
+            "node_id": settings.NODE_ID,
+            "enabled": self.enabled,
+            "configured_sites": sorted(self.configured_sites()),
+            "owned_sites": sorted(self.sites),
+            "leader": self.is_leader(),
+            "leases": [
+                {"site": l.site, "node_id": l.node_id, "expires_in": round(l.expires_at - now, 1),
+                 "active": l.expires_at > now}
+                for l in leases
+            ],
+        }
+
+# 全局单例
+shards = ShardCoordinator()
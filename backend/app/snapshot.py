@@ -0,0 +1,59 @@
+import json
+import time
+import hashlib
+import itertools
+import threading
+from typing import Any, Callable, Dict, NamedTuple
+from fastapi.encoders import jsonable_encoder
+from app.config import settings
+
+class Snapshot(NamedTuple):
+    """不可变快照：已序列化好的 JSON 字节 + ETag"""
+    version: int
+    built_at: float
+    body: bytes
+    etag: str
+
+class SnapshotCache:
+    """
+    农场状态的只读快照 (写时复制)：
+    - 打印机状态变化、打印机增删改、调度开关等写操作只调用 invalidate() 递增版本号，不做任何序列化
+    - 读接口 (/printers、/status) 在版本未变时直接返回上一次序列化好的字节，无需查库、也不碰各打印机的锁；
+      版本变化后由第一个读请求重建一次，其余并发读请求等待复用
+    - 快照里含有随时间变化的字段 (距上次上报秒数、数据是否过期)，超过 SNAPSHOT_MAX_AGE 也会重建
+    """
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self.version = 0
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def invalidate(self):
+        # itertools.count 的 next() 是原子的，写路径 (MQTT 回调线程) 不需要加锁
+        self.version = next(self._counter)
+
+    def _is_fresh(self, snap: Snapshot) -> bool:
+        return snap.version == self.version and time.time() - snap.built_at < settings.SNAPSHOT_MAX_AGE
+
+    def get(self, key: str, builder: Callable[[], Any]) -> Snapshot:
+        snap = self._snapshots.get(key)
+        if snap is not None and self._is_fresh(snap):
+            return snap
+
+        with self._guard:
+            lock = self._build_locks.setdefault(key, threading.Lock())
+        with lock:
+            snap = self._snapshots.get(key)
+            if snap is not None and self._is_fresh(snap):
+                return snap # 等锁期间已被其他请求重建
+            version = self.version # 先取版本号：构建期间再有变化时，下一次读取会重建
+            body = json.dumps(jsonable_encoder(builder()), ensure_ascii=False, separators=(",", ":")).encode()
+            # ETag 按内容计算，定时重建但内容没变时客户端仍可得到 304
+            etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+            snap = Snapshot(version, time.time(), body, etag)
+            self._snapshots[key] = snap
+            return snap
+
+# 全局单例
+snapshot_cache = SnapshotCache()
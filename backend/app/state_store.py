@@ -0,0 +1,184 @@
+import threading
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, List, Optional
+
+# 状态锁分条：槽位按下标取模映射到固定数量的锁，不为每台打印机创建锁对象
+LOCK_STRIPES = 64
+
+# g_st 的低 8 位单独存一列 (bytearray)，用于整列扫描：-1 -> 255, 1 -> 1, 6 -> 6, 100 -> 100
+G_IDLE_CODE, G_UNKNOWN_CODE = 1, 255
+
+def _table(pred) -> bytes:
+    return bytes(1 if pred(i) else 0 for i in range(256))
+
+_IDLE_CODES = _table(lambda c: c in (G_IDLE_CODE, G_UNKNOWN_CODE))
+_NOT = _table(lambda b: b == 0)
+
+def _mask_and(*masks: bytes) -> bytes:
+    # 多个 0/1 字节串逐字节相与：转成大整数做位与，整个过程在 C 里完成
+    n = min(len(m) for m in masks)
+    acc = -1
+    for m in masks:
+        acc &= int.from_bytes(m[:n], "little")
+    return acc.to_bytes(n, "little")
+
+class StateStore:
+    """
+    全农场打印机运行时状态的列式存储：
+    每个字段一列 (array/bytearray)，按槽位下标访问；PrinterState 只是指向某个槽位的 __slots__ 视图。
+    布尔字段各占一个 bytearray (0/1)，写入是单字节赋值，不存在同一字节多位的读改写竞争。
+    - 锁分条 (lock_for(slot)，LOCK_STRIPES 把)，只保护同一台打印机的多字段更新，
+      不同打印机的上报基本互不阻塞，也不给每台打印机多一个锁对象；lock 只用于分配/释放槽位 (列的增长)
+    - "所有空闲/所有冷却中" 这类查询对整列做 bytes.translate + 大整数位与，再用 itertools.compress 取下标，
+      不加锁，也不需要逐台遍历 Python 对象
+    删除的槽位放进空闲列表复用。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.serials: List[Optional[str]] = []
+        self.slot_of: Dict[str, int] = {}
+        self.views: list = []
+        self._free: List[int] = []
+
+        self.g_st = array("i")
+        self.g_code = bytearray()
+        self.print_error = array("q")
+        self.job_error = array("q")
+        self.progress = array("h")
+        self.nozzle_temp = array("d")
+        self.bed_temp = array("d")
+        self.last_finish_time = array("d")
+        self.last_report_time = array("d")
+        self.connected_at = array("d")
+        self.active = bytearray()
+        self.connected = bytearray()
+        self.cooling = bytearray()
+        self.reports_job = bytearray() # 固件回传 subtask_name
+        self.job_key: List[Optional[str]] = []
+        self.job_outcomes: list = [] # 每槽一个 OrderedDict，首个任务出现时才创建
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def lock_for(self, slot: int) -> threading.Lock:
+        return self._stripes[slot % LOCK_STRIPES]
+
+    def allocate(self, serial_no: str, view) -> int:
+        with self.lock:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self.serials)
+                self.serials.append(None)
+                self.views.append(None)
+                self.g_st.append(0)
+                self.g_code.append(0)
+                self.print_error.append(0)
+                self.job_error.append(0)
+                self.progress.append(0)
+                self.nozzle_temp.append(0.0)
+                self.bed_temp.append(0.0)
+                self.last_finish_time.append(0.0)
+                self.last_report_time.append(0.0)
+                self.connected_at.append(0.0)
+                self.active.append(0)
+                self.connected.append(0)
+                self.cooling.append(0)
+                self.reports_job.append(0)
+                self.job_key.append(None)
+                self.job_outcomes.append(None)
+            self.serials[slot] = serial_no
+            self.views[slot] = view
+            self.g_st[slot] = -1
+            self.g_code[slot] = G_UNKNOWN_CODE
+            self.print_error[slot] = 0
+            self.job_error[slot] = 0
+            self.progress[slot] = 0
+            self.nozzle_temp[slot] = 0.0
+            self.bed_temp[slot] = 0.0
+            self.last_finish_time[slot] = 0.0
+            self.last_report_time[slot] = 0.0
+            self.connected_at[slot] = 0.0
+            self.connected[slot] = 0
+            self.cooling[slot] = 0
+            self.reports_job[slot] = 0
+            self.active[slot] = 1
+            self.job_key[slot] = None
+            self.job_outcomes[slot] = None
+            self.slot_of[serial_no] = slot
+            return slot
+
+    def release(self, slot: int):
+        with self.lock:
+            serial_no = self.serials[slot]
+            if serial_no is None:
+                return
+            if self.slot_of.get(serial_no) == slot:
+                del self.slot_of[serial_no]
+            self.serials[slot] = None
+            self.views[slot] = None
+            self.active[slot] = 0
+            self.connected[slot] = 0
+            self.job_outcomes[slot] = None
+            self._free.append(slot)
+
+    # --- 整列扫描 (无锁：读的是某一时刻的字节拷贝，结果只用于筛选候选) ---
+    def _slots(self, mask: bytes) -> List[int]:
+        return list(compress(range(len(mask)), mask))
+
+    def idle_candidates(self) -> List[int]:
+        """已连接、不在冷却、g_st 为空闲或未知的槽位 (是否真的可派单仍由 PrinterState.is_safe_to_print 判定)"""
+        return self._slots(_mask_and(
+            bytes(self.active), bytes(self.connected),
+            bytes(self.cooling).translate(_NOT), bytes(self.g_code).translate(_IDLE_CODES),
+        ))
+
+    def cooling_slots(self) -> List[int]:
+        return self._slots(_mask_and(bytes(self.active), bytes(self.cooling)))
+
+    def connected_slots(self) -> List[int]:
+        return self._slots(_mask_and(bytes(self.active), bytes(self.connected)))
+
+    def views_of(self, slots: Iterable[int]) -> list:
+        views = self.views
+        return [v for v in (views[s] for s in slots) if v is not None]
+
+class Column:
+    """把视图属性映射到 StateStore 中的一列"""
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        return getattr(view._store, self.name)[view.slot]
+
+    def __set__(self, view, value):
+        getattr(view._store, self.name)[view.slot] = value
+
+class GstColumn(Column):
+    """g_st 写入时同步维护用于扫描的 g_code 列"""
+    __slots__ = ()
+
+    def __set__(self, view, value):
+        view._store.g_st[view.slot] = value
+        view._store.g_code[view.slot] = value & 0xFF
+
+class Flag(Column):
+    """0/1 字节列，表现为 bool 属性"""
+    __slots__ = ()
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        return getattr(view._store, self.name)[view.slot] == 1
+
+    def __set__(self, view, value):
+        getattr(view._store, self.name)[view.slot] = 1 if value else 0
+
+# 全局单例
+state_store = StateStore()
@@ -0,0 +1,121 @@
+import io
+import os
+import re
+import queue
+import shutil
+import zipfile
+import logging
+import threading
+from typing import Optional
+from app.config import settings
+
+try:
+    from PIL import Image # 可选依赖：安装 Pillow 后才做缩放，否则直接使用 3MF 自带的两种尺寸
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 变体 -> (最大边长, 优先使用的 3MF 内图片)
+VARIANTS = {
+    "small": (128, ("Metadata/plate_1_small.png", "Metadata/plate_1.png")),
+    "medium": (512, ("Metadata/plate_1.png", "Metadata/plate_1_small.png")),
+}
+_HASH_RE = re.compile(r"^[0-9a-f]{32}$")
+
+class ThumbnailService:
+    """
+    缩略图按文件内容哈希 (上传时的 MD5) 存放在 THUMBNAIL_DIR/{hash}/{variant}.png：
+    - 同一个文件重复上传/批量生成多个任务只生成一次
+    - 上传接口只入队，后台线程 (首次入队时才启动) 解压生成，上传立即返回
+    - 同一哈希的内容永远不变，接口可以返回 immutable 的长缓存头
+    """
+    def __init__(self):
+        self.queue: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+        self.thread = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def url(file_hash: str, variant: str = "small") -> str:
+        return f"/thumbnails/{file_hash}/{variant}.png"
+
+    @staticmethod
+    def path(file_hash: str, variant: str) -> Optional[str]:
+        """校验后的本地路径；哈希或变体不合法时返回 None (防止路径穿越)"""
+        if variant not in VARIANTS or not _HASH_RE.match(file_hash or ""):
+            return None
+        return os.path.join(settings.THUMBNAIL_DIR, file_hash, f"{variant}.png")
+
+    def exists(self, file_hash: str) -> bool:
+        return all(os.path.exists(self.path(file_hash, v) or "") for v in VARIANTS)
+
+    def submit(self, file_hash: str, file_path: str):
+        """登记生成任务 (已生成或已在队列中的直接跳过)"""
+        if not self.path(file_hash, "small") or self.exists(file_hash):
+            return
+        with self._lock:
+            if file_hash in self._pending:
+                return
+            self._pending.add(file_hash)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+        self.queue.put((file_hash, file_path))
+
+    def _loop(self):
+        while True:
+            file_hash, file_path = self.queue.get()
+            try:
+                self.generate(file_hash, file_path)
+            except Exception as e:
+                logger.error(f"生成缩略图失败 ({file_hash}): {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(file_hash)
+
+    def generate(self, file_hash: str, file_path: str) -> bool:
+        """从 3MF 中提取并生成全部变体，返回是否有可用的图片"""
+        with zipfile.ZipFile(file_path, "r") as z:
+            names = set(z.namelist())
+            sources = {}
+            for variant, (size, candidates) in VARIANTS.items():
+                name = next((n for n in candidates if n in names), None)
+                if name is None:
+                    continue
+                if name not in sources:
+                    sources[name] = z.read(name)
+                self._write(self.path(file_hash, variant), self._resize(sources[name], size))
+        if not sources:
+            logger.info(f"3MF 中没有缩略图: {os.path.basename(file_path)}")
+        return bool(sources)
+
+    @staticmethod
+    def _resize(data: bytes, size: int) -> bytes:
+        if Image is None:
+            return data
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= size:
+                return data
+            img.thumbnail((size, size))
+            out = io.BytesIO()
+            img.save(out, format="PNG", optimize=True)
+            return out.getvalue()
+
+    @staticmethod
+    def _write(target: str, data: bytes):
+        # 先写临时文件再改名：读请求不会拿到写了一半的图片
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+
+    def delete(self, file_hash: str):
+        directory = os.path.dirname(self.path(file_hash, "small") or "")
+        if directory and os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+            logger.info(f"已删除缩略图: {file_hash}")
+
+# 全局单例
+thumbnails = ThumbnailService()
@@ -0,0 +1,62 @@
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple
+from app.config import settings
+
+# "08:00-22:00" 或 "22:00-07:30" (跨零点)，多个时间段用逗号分隔
+_WINDOW_RE = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$")
+
+Window = Tuple[int, int] # 一天内的 [开始分钟, 结束分钟)
+
+@lru_cache(maxsize=256)
+def parse_windows(spec: Optional[str]) -> Tuple[Window, ...]:
+    """解析时间段配置；空字符串/None 表示全天可用。格式错误抛 ValueError"""
+    windows = []
+    for part in (spec or "").split(","):
+        part = part.strip().replace(" ", "")
+        if not part:
+            continue
+        m = _WINDOW_RE.match(part)
+        if not m:
+            raise ValueError(f"时间段格式错误: {part!r}，应为 HH:MM-HH:MM")
+        h1, m1, h2, m2 = (int(x) for x in m.groups())
+        if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+            raise ValueError(f"时间段格式错误: {part!r}")
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        if start == end:
+            raise ValueError(f"时间段长度为 0: {part!r}")
+        windows.append((start % 1440, end % 1440 or 1440))
+    return tuple(windows)
+
+def in_windows(dt: datetime, windows: Tuple[Window, ...]) -> bool:
+    if not windows:
+        return True
+    minute = dt.hour * 60 + dt.minute + dt.second / 60
+    for start, end in windows:
+        if start < end:
+            if start <= minute < end:
+                return True
+        elif minute >= start or minute < end: # 跨零点
+            return True
+    return False
+
+def is_long_job(duration: float) -> bool:
+    return settings.LONG_JOB_SECONDS > 0 and duration >= settings.LONG_JOB_SECONDS
+
+def can_start(availability: Optional[str], now: datetime, duration: float) -> bool:
+    """
+    现在开始一个预计耗时 duration 秒的任务是否符合时间规则：
+    - 打印机的可用时段 (availability) 约束的是任务结束 (换盘) 的时刻，
+      例如 "08:00-22:00" 表示夜里不换盘，晚上只会开始能在 22:00 前打完的任务
+    - 长任务 (>= LONG_JOB_SECONDS) 只在谷电时段 (OFFPEAK_WINDOWS) 内开始
+    """
+    if is_long_job(duration) and not in_windows(now, parse_windows(settings.OFFPEAK_WINDOWS)):
+        return False
+    finish = now + timedelta(seconds=duration)
+    return in_windows(finish, parse_windows(availability))
+
+def validate(spec: Optional[str]) -> Optional[str]:
+    """接口层校验，返回规范化后的配置 (去空格)"""
+    parse_windows(spec)
+    return ",".join(p.strip().replace(" ", "") for p in spec.split(",") if p.strip()) if spec else spec
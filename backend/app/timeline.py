@@ -0,0 +1,203 @@
+import time
+import queue
+import threading
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+from sqlalchemy import insert, delete
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import PrinterEvent
+from app.enums import EventKind
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class TimelineRecorder:
+    """
+    打印机状态时间线。
+    record() 只是入队 (MQTT 回调线程里调用，不能碰数据库)，
+    后台线程按 TIMELINE_FLUSH_INTERVAL 批量写入，避免高频上报放大 DB 负载。
+    """
+    def __init__(self):
+        self.queue: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+        self.running = False
+        self.thread = None
+        self._last_prune = 0.0
+
+    def record(self, serial_no: str, kind: EventKind, g_st: Optional[int] = None,
+               progress: Optional[int] = None, error: Optional[int] = None):
+        self.queue.put((serial_no, time.time(), kind.value, g_st, progress, error))
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        # 退出前把剩余事件写完
+        self.flush()
+
+    def _loop(self):
+        while self.running:
+            time.sleep(settings.TIMELINE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                if time.time() - self._last_prune > 3600:
+                    self.prune()
+            except Exception as e:
+                logger.error(f"时间线写入异常: {e}")
+
+    def _drain(self) -> List[dict]:
+        rows = []
+        last = {}
+        while len(rows) < settings.TIMELINE_BATCH_SIZE:
+            try:
+                serial_no, ts, kind, g_st, progress, error = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            # 降采样：同一打印机连续重复的事件只保留第一条
+            key = (kind, g_st, progress, error)
+            if last.get(serial_no) == key:
+                continue
+            last[serial_no] = key
+            rows.append({
+                "serial_no": serial_no, "ts": ts, "kind": kind,
+                "g_st": g_st, "progress": progress, "error": error,
+            })
+        return rows
+
+    def flush(self):
+        """把队列中的事件批量写入数据库 (一批一个事务)"""
+        while True:
+            rows = self._drain()
+            if not rows:
+                return
+            with Session(engine) as session:
+                session.execute(insert(PrinterEvent), rows)
+                session.commit()
+            if len(rows) < settings.TIMELINE_BATCH_SIZE:
+                return
+
+    def prune(self):
+        """保留策略：旧的进度事件降采样删除，超过保留期的全部删除"""
+        self._last_prune = time.time()
+        now = time.time()
+        with Session(engine) as session:
+            session.execute(
+                delete(PrinterEvent)
+                .where(PrinterEvent.kind == EventKind.PROGRESS.value)
+                .where(PrinterEvent.ts < now - settings.TIMELINE_DOWNSAMPLE_DAYS * 86400)
+            )
+            session.execute(
+                delete(PrinterEvent)
+                .where(PrinterEvent.ts < now - settings.TIMELINE_RETENTION_DAYS * 86400)
+            )
+            session.commit()
+
+    def compute_utilization(self, hours: float = 24) -> Dict[str, dict]:
+        """
+        按打印机统计窗口内的利用率、两次打印之间的空档以及失败率。
+        空档 (上一次完成/失败 -> 下一次下发) 拆成三段：
+        冷却 (finish -> cooldown_end)、等待任务 (cooldown_end -> upload_start)、上传 (upload_start -> dispatch)。
+        """
+        self.flush()
+        now = time.time()
+        since = now - hours * 3600
+        with Session(engine) as session:
+            events = session.exec(
+                select(PrinterEvent)
+                .where(PrinterEvent.ts >= since)
+                .order_by(PrinterEvent.serial_no, PrinterEvent.ts)
+            ).all()
+
+        by_printer: Dict[str, List[PrinterEvent]] = defaultdict(list)
+        for ev in events:
+            by_printer[ev.serial_no].append(ev)
+
+        result = {}
+        for serial_no, evs in by_printer.items():
+            result[serial_no] = self._analyze(evs, since, now)
+        return result
+
+    @staticmethod
+    def _analyze(events: List[PrinterEvent], since: float, now: float) -> dict:
+        busy = 0.0
+        offline = 0.0
+        prints = 0
+        finished = 0
+        failures = 0
+        print_start = None
+        offline_since = None
+        gap_start = None
+        cooldown_end = None
+        upload_start = None
+        gaps = {"cooldown": [], "waiting": [], "upload": []}
+
+        for ev in events:
+            kind = ev.kind
+            if kind == EventKind.DISCONNECT.value:
+                if offline_since is None:
+                    offline_since = ev.ts
+            elif kind == EventKind.CONNECT.value:
+                if offline_since is not None:
+                    offline += ev.ts - offline_since
+                    offline_since = None
+            elif kind == EventKind.UPLOAD_START.value:
+                upload_start = ev.ts
+            elif kind == EventKind.DISPATCH.value:
+                prints += 1
+                if gap_start is not None:
+                    cd_end = cooldown_end or gap_start
+                    up_start = upload_start if upload_start and upload_start >= cd_end else ev.ts
+                    gaps["cooldown"].append(cd_end - gap_start)
+                    gaps["waiting"].append(max(0.0, up_start - cd_end))
+                    gaps["upload"].append(ev.ts - up_start)
+                print_start = ev.ts
+                gap_start = cooldown_end = upload_start = None
+            elif kind == EventKind.COOLDOWN_END.value:
+                if gap_start is not None:
+                    cooldown_end = ev.ts
+            elif kind in (EventKind.FINISH.value, EventKind.ERROR.value):
+                if kind == EventKind.ERROR.value and not ev.error:
+                    continue # 错误清除
+                if kind == EventKind.FINISH.value:
+                    finished += 1
+                else:
+                    failures += 1
+                if print_start is not None:
+                    busy += ev.ts - print_start
+                    print_start = None
+                gap_start = ev.ts
+                cooldown_end = upload_start = None
+
+        if print_start is not None:
+            busy += now - print_start
+        if offline_since is not None:
+            offline += now - offline_since
+
+        window = now - since
+
+        def avg(values):
+            return round(sum(values) / len(values), 1) if values else None
+
+        return {
+            "utilization": round(busy / window, 4) if window > 0 else 0,
+            "busy_seconds": round(busy, 1),
+            "offline_seconds": round(offline, 1),
+            "prints": prints,
+            "finished": finished,
+            "failures": failures,
+            "failure_rate": round(failures / prints, 4) if prints else 0,
+            "avg_gap": {
+                "cooldown": avg(gaps["cooldown"]),
+                "waiting_for_task": avg(gaps["waiting"]),
+                "upload": avg(gaps["upload"]),
+            },
+            "gaps": len(gaps["cooldown"]),
+        }
+
+# 全局单例
+timeline = TimelineRecorder()
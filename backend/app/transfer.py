@@ -0,0 +1,140 @@
+import os
+import re
+import shutil
+import zipfile
+import logging
+import threading
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import update
+from sqlmodel import Session
+from app.models import Task
+from app.file_handler import FileHandler
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 精简包保留的条目：打包描述、第 1 盘的 gcode (及其 md5/包围盒)、Metadata 下的各种 .config (切片/耗材信息)。
+# _rels/.rels 会改写，去掉指向未保留条目 (3D/3dmodel.model、缩略图) 的关系
+_KEEP_EXACT = {
+    "[Content_Types].xml",
+    "_rels/.rels",
+    "Metadata/plate_1.gcode",
+    "Metadata/plate_1.gcode.md5",
+    "Metadata/plate_1.json",
+}
+_KEEP_RE = re.compile(r"^Metadata/[^/]+\.config$")
+_RELATIONSHIP_RE = re.compile(rb'<Relationship\b[^>]*?\bTarget="/?([^"]*)"[^>]*?(?:/>|>\s*</Relationship>)\s*')
+# 固定的时间戳和权限：同一个源文件每次生成的字节完全相同 (内容哈希稳定，SD 卡缓存可复用)
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+def _keep(name: str) -> bool:
+    return name in _KEEP_EXACT or bool(_KEEP_RE.match(name))
+
+def _slim_rels(data: bytes, kept: Set[str]) -> bytes:
+    """去掉 Target 不在精简包里的 Relationship (逐字节替换，输出仍然确定)"""
+    return _RELATIONSHIP_RE.sub(lambda m: m.group(0) if m.group(1).decode() in kept else b"", data)
+
+class TransferPreparer:
+    """
+    发给打印机前的精简 3MF (SLIM_3MF 开启时)：
+    原文件里的盘面 PNG、3D 模型 XML、其他盘的 gcode 打印机都用不到，只保留运行 Metadata/plate_1.gcode 需要的条目。
+    - 按原文件哈希缓存在 TRANSFER_DIR/{file_hash}.gcode.3mf，同一文件的多个任务只生成一次
+    - 精简包的 MD5 记在 Task.transfer_hash：SD 卡上按它命名，project_file 指令里的 md5 也用它
+    - 缺少 plate_1.gcode 或精简后没有变小时原样发送，之后不再尝试；生成出错 (磁盘满、文件损坏) 只本次原样发送
+    - 未在真机固件上验证过，默认关闭
+    """
+    def __init__(self):
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._skip: Set[str] = set() # 精简无效的文件哈希，不再重复尝试
+
+    @staticmethod
+    def path_for(file_hash: str) -> str:
+        return os.path.join(settings.TRANSFER_DIR, f"{file_hash}.gcode.3mf")
+
+    @staticmethod
+    def remote_hash(task: Task) -> Optional[str]:
+        """打印机 SD 卡上对应的内容哈希 (负载均衡/SD 卡缓存判断用)"""
+        if settings.SLIM_3MF and task.transfer_hash:
+            return task.transfer_hash
+        return task.file_hash
+
+    def local_path(self, task: Task) -> str:
+        """实际要上传的本地文件 (估算上传耗时用)"""
+        if settings.SLIM_3MF and task.transfer_hash and task.file_hash:
+            slim = self.path_for(task.file_hash)
+            if os.path.exists(slim):
+                return slim
+        return task.filepath
+
+    def prepare(self, session: Session, task: Task) -> Tuple[str, str]:
+        """返回 (要上传的本地路径, 它的 MD5)；需要时生成精简包并记下 transfer_hash (调用方负责 commit)"""
+        if not settings.SLIM_3MF or not task.file_hash or task.file_hash in self._skip:
+            return task.filepath, task.file_hash
+
+        with self._guard:
+            lock = self._locks.setdefault(task.file_hash, threading.Lock())
+        with lock:
+            target = self.path_for(task.file_hash)
+            if not os.path.exists(target):
+                try:
+                    usable = self.build(task.filepath, target)
+                except Exception as e:
+                    logger.error(f"精简 3MF 失败，本次按原文件发送: {e}")
+                    return task.filepath, task.file_hash
+                if not usable:
+                    self._skip.add(task.file_hash)
+                    return task.filepath, task.file_hash
+            if not task.transfer_hash:
+                transfer_hash = FileHandler.calculate_md5(target)
+                # 同一文件的其他任务一起记下，负载均衡可以直接认出 SD 卡上的缓存
+                session.execute(
+                    update(Task)
+                    .where(Task.file_hash == task.file_hash)
+                    .where(Task.transfer_hash == None)
+                    .values(transfer_hash=transfer_hash)
+                )
+                task.transfer_hash = transfer_hash
+                session.add(task)
+            return target, task.transfer_hash
+
+    @staticmethod
+    def build(source: str, target: str) -> bool:
+        """生成精简包，返回是否应当使用它 (False 表示这个文件不值得精简)；生成出错时抛出异常"""
+        tmp = f"{target}.tmp"
+        try:
+            with zipfile.ZipFile(source, "r") as src:
+                infos = [i for i in src.infolist() if _keep(i.filename)]
+                kept = {i.filename for i in infos}
+                if "Metadata/plate_1.gcode" not in kept:
+                    logger.warning(f"3MF 中没有 Metadata/plate_1.gcode，不做精简: {os.path.basename(source)}")
+                    return False
+                with zipfile.ZipFile(tmp, "w") as dst:
+                    for info in infos:
+                        out = zipfile.ZipInfo(info.filename, date_time=_ZIP_EPOCH)
+                        out.compress_type = info.compress_type
+                        out.external_attr = 0o644 << 16
+                        if info.filename == "_rels/.rels":
+                            dst.writestr(out, _slim_rels(src.read(info), kept))
+                            continue
+                        with src.open(info) as fin, dst.open(out, "w", force_zip64=info.file_size > 0x7FFFFFFF) as fout:
+                            shutil.copyfileobj(fin, fout, 1024 * 1024)
+            original, slim = os.path.getsize(source), os.path.getsize(tmp)
+            if slim >= original:
+                os.remove(tmp)
+                return False
+            os.replace(tmp, target)
+            logger.info(f"📦 精简 3MF: {os.path.basename(source)} {original / 1024:.0f} KB -> {slim / 1024:.0f} KB")
+            return True
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def delete(self, file_hash: str):
+        path = self.path_for(file_hash)
+        if os.path.exists(path):
+            os.remove(path)
+
+# 全局单例
+transfer = TransferPreparer()
@@ -0,0 +1,6 @@
+"""
+本地模拟打印机农场 (MQTT + 隐式 FTPS 替身)，用于在没有真机的情况下压测调度器。
+
+    python -m sim.fleet --printers 10          # 只启动模拟打印机
+    python -m sim.bench --printers 1 10 100    # 端到端吞吐压测
+"""
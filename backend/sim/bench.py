@@ -0,0 +1,224 @@
+"""
+端到端吞吐压测：模拟打印机农场 + 真实的 /upload、Scheduler、PrinterManager。
+
+    cd backend
+    python -m sim.bench --printers 1 10 100 --jobs 3 --print-duration 20
+
+每个规模在独立子进程中运行 (后端是进程级单例)，模拟打印机再放到孙进程，
+这样统计到的 CPU/内存只属于后端本身。
+"""
+import os
+import sys
+import json
+import time
+import math
+import socket
+import zipfile
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+import subprocess
+import multiprocessing
+
+def _fleet_process(conn, count, mqtt_port, ftp_port, print_duration, swap_duration, fail_rate, jammed):
+    from sim.fleet import SimFleet
+    fleet = SimFleet(count, mqtt_port=mqtt_port, ftp_port=ftp_port,
+                     print_duration=print_duration, swap_duration=swap_duration,
+                     fail_rate=fail_rate, jammed=jammed)
+    fleet.start()
+    conn.send([
+        {"name": p.name, "ip": p.ip, "access_code": p.access_code, "serial_no": p.serial_no}
+        for p in fleet.printers
+    ])
+    conn.recv() # 等待父进程索取统计
+    conn.send(fleet.stats())
+    fleet.stop()
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_fake_3mf(path: str, size_mb: float, estimated_time: int = 0):
+    """生成一个结构与 Bambu Studio 导出文件相近的 .gcode.3mf"""
+    line = b"G1 X10.000 Y10.000 E0.01234 F1200\n"
+    gcode = line * max(1, int(size_mb * 1024 * 1024 / len(line)))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("Metadata/plate_1.gcode", gcode)
+        z.writestr("Metadata/plate_1.png", os.urandom(64 * 1024))
+        z.writestr("Metadata/plate_1_small.png", os.urandom(4 * 1024))
+        z.writestr(
+            "Metadata/slice_info.config",
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<config><plate>'
+            f'<metadata key="index" value="1"/><metadata key="printer_model_id" value="N1"/>'
+            f'<metadata key="prediction" value="{estimated_time}"/></plate></config>\n',
+        )
+
+def run_scenario(args) -> dict:
+    count = args.printers[0]
+    workdir = tempfile.mkdtemp(prefix=f"bambu_bench_{count}_")
+    os.environ.update({
+        "DATA_DIR": workdir,
+        "DB_PATH": os.path.join(workdir, "bbm.db"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "STATIC_DIR": os.path.join(workdir, "static"),
+        "THUMBNAIL_DIR": os.path.join(workdir, "thumbnails"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "TRANSFER_DIR": os.path.join(workdir, "transfer"),
+        "DEFAULT_PRINTER_IP": "",
+        "PRINTER_MQTT_PORT": str(args.mqtt_port),
+        "PRINTER_FTP_PORT": str(args.ftp_port),
+        "SWAP_COOLDOWN": str(math.ceil(args.swap_duration)),
+        "SCHEDULER_INTERVAL": str(args.scheduler_interval),
+        "LOG_LEVEL": "WARNING",
+    })
+    if args.upload_workers:
+        os.environ["UPLOAD_WORKERS"] = str(args.upload_workers)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fleet_proc = multiprocessing.Process(
+        target=_fleet_process,
+        args=(child_conn, count, args.mqtt_port, args.ftp_port, args.print_duration, args.swap_duration,
+              args.fail_rate, args.jammed),
+        daemon=True,
+    )
+    fleet_proc.start()
+    sim_printers = parent_conn.recv()
+
+    import requests
+    import uvicorn
+    from app.main import app
+    from app.timeline import timeline
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+
+    for p in sim_printers:
+        requests.post(f"{base}/printers", json=p).raise_for_status()
+
+    # 资源采样
+    peak_threads = 0
+    sampling = True
+
+    def sample():
+        nonlocal peak_threads
+        while sampling:
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.2)
+    threading.Thread(target=sample, daemon=True).start()
+
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    total_jobs = count * args.jobs
+    file_count = args.files or count
+    files = []
+    for i in range(file_count):
+        path = os.path.join(workdir, f"bench_{i}.gcode.3mf")
+        make_fake_3mf(path, args.file_size, int(args.print_duration))
+        files.append(path)
+
+    t0 = time.time()
+    for i, path in enumerate(files):
+        repeat = total_jobs // file_count + (1 if i < total_jobs % file_count else 0)
+        if not repeat:
+            continue
+        with open(path, "rb") as f:
+            requests.post(
+                f"{base}/upload",
+                files={"file": (os.path.basename(path), f)},
+                data={"repeat_count": repeat},
+            ).raise_for_status()
+    upload_done = time.time()
+
+    deadline = t0 + args.timeout
+    completed = 0
+    while time.time() < deadline:
+        tasks = requests.get(f"{base}/tasks").json()
+        completed = sum(1 for t in tasks if t["status"] == "completed")
+        if completed >= total_jobs or all(t["status"] in ("completed", "failed") for t in tasks):
+            break
+        time.sleep(0.5)
+    elapsed = time.time() - t0
+    sampling = False
+
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    parent_conn.send("stats")
+    fleet_stats = parent_conn.recv()
+    fleet_proc.join(timeout=5)
+
+    # 稳态下发延迟：打印机换盘完成 (空闲) -> 收到下一条 project_file
+    gaps = [g for s in fleet_stats for g in s["dispatch_gaps"][1:]]
+    first_starts = [s["start_times"][0] - t0 for s in fleet_stats if s["start_times"]]
+    analytics = timeline.compute_utilization(hours=elapsed / 3600 + 0.01)
+    uploads = [a["avg_gap"]["upload"] for a in analytics.values() if a["avg_gap"]["upload"] is not None]
+
+    server.should_exit = True
+    return {
+        "printers": count,
+        "jobs": total_jobs,
+        "completed": completed,
+        "failed": total_jobs - completed,
+        "printer_failures": sum(s["prints_failed"] for s in fleet_stats),
+        "elapsed_s": round(elapsed, 1),
+        "prints_per_hour": round(completed / elapsed * 3600, 1) if elapsed else 0,
+        "upload_api_s": round(upload_done - t0, 2),
+        "first_print_p50_s": round(statistics.median(first_starts), 2) if first_starts else None,
+        "first_print_max_s": round(max(first_starts), 2) if first_starts else None,
+        "dispatch_latency_p50_s": round(statistics.median(gaps), 2) if gaps else None,
+        "dispatch_latency_max_s": round(max(gaps), 2) if gaps else None,
+        "avg_upload_s": round(statistics.mean(uploads), 2) if uploads else None,
+        "bytes_to_printers": sum(s["sd_bytes_written"] for s in fleet_stats),
+        "cpu_s": round((cpu_end.ru_utime - cpu_start.ru_utime) + (cpu_end.ru_stime - cpu_start.ru_stime), 2),
+        "max_rss_mb": round(cpu_end.ru_maxrss / 1024, 1),
+        "peak_threads": peak_threads,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Bambu Farm 端到端吞吐压测")
+    parser.add_argument("--printers", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--jobs", type=int, default=3, help="每台打印机的任务数")
+    parser.add_argument("--files", type=int, default=0, help="不同文件数 (默认与打印机数相同)")
+    parser.add_argument("--file-size", type=float, default=2.0, help="gcode 大小 (MB)")
+    parser.add_argument("--print-duration", type=float, default=20.0)
+    parser.add_argument("--swap-duration", type=float, default=2.0)
+    parser.add_argument("--scheduler-interval", type=float, default=2.0)
+    parser.add_argument("--upload-workers", type=int, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="每次打印的随机失败概率")
+    parser.add_argument("--jammed", type=int, default=0, help="每次都失败的故障打印机台数")
+    parser.add_argument("--mqtt-port", type=int, default=18883)
+    parser.add_argument("--ftp-port", type=int, default=10990)
+    parser.add_argument("--timeout", type=float, default=900.0)
+    parser.add_argument("--json", action="store_true", help="只输出单个规模的 JSON 结果 (内部使用)")
+    args = parser.parse_args()
+
+    if args.json:
+        print(json.dumps(run_scenario(args)), flush=True)
+        os._exit(0)
+
+    results = []
+    for count in args.printers:
+        cmd = [sys.executable, "-m", "sim.bench", "--json", "--printers", str(count)]
+        for key in ("jobs", "files", "file_size", "print_duration", "swap_duration",
+                    "scheduler_interval", "upload_workers", "fail_rate", "jammed", "mqtt_port", "ftp_port", "timeout"):
+            cmd += [f"--{key.replace('_', '-')}", str(getattr(args, key))]
+        print(f"▶ {count} printers ...", flush=True)
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+        if out.returncode != 0 or not lines:
+            print(out.stderr[-2000:])
+            continue
+        results.append(json.loads(lines[-1]))
+
+    if results:
+        keys = list(results[0])
+        print("\t".join(keys))
+        for r in results:
+            print("\t".join(str(r[k]) for k in keys))
+
+if __name__ == "__main__":
+    main()
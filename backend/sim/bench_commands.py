@@ -0,0 +1,103 @@
+"""
+批量指令基准：POST /commands 一次发给 N 台打印机，与逐台调用 (N 次请求) 的耗时对比。
+
+    cd backend
+    python -m sim.bench_commands --printers 200 --sizes 1 10 50 100 200
+
+模拟打印机 (sim.fleet) 放在子进程，后端在本进程内启动。每个规模用前 N 台打印机，
+对 light_off / light_on / pushall 各测 --repeat 次取中位数，同时确认全部回执为 ok。
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+import multiprocessing
+from sim.bench import _fleet_process, _free_port
+
+def main():
+    parser = argparse.ArgumentParser(description="批量指令基准")
+    parser.add_argument("--printers", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--commands", nargs="+", default=["light_off", "light_on", "pushall"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sequential", action="store_true", help="同时测量逐台调用的耗时")
+    parser.add_argument("--mqtt-port", type=int, default=18883)
+    parser.add_argument("--ftp-port", type=int, default=10990)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bambu_bench_commands_")
+    os.environ.update({
+        "DATA_DIR": workdir,
+        "DB_PATH": os.path.join(workdir, "bbm.db"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "STATIC_DIR": os.path.join(workdir, "static"),
+        "THUMBNAIL_DIR": os.path.join(workdir, "thumbnails"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "TRANSFER_DIR": os.path.join(workdir, "transfer"),
+        "DEFAULT_PRINTER_IP": "",
+        "PRINTER_MQTT_PORT": str(args.mqtt_port),
+        "PRINTER_FTP_PORT": str(args.ftp_port),
+        "LOG_LEVEL": "WARNING",
+    })
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fleet_proc = multiprocessing.Process(
+        target=_fleet_process,
+        args=(child_conn, args.printers, args.mqtt_port, args.ftp_port, 60.0, 2.0, 0.0, 0),
+        daemon=True,
+    )
+    fleet_proc.start()
+    sim_printers = parent_conn.recv()
+
+    import requests
+    import uvicorn
+    from app.main import app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+
+    requests.post(f"{base}/printers/bulk", json=sim_printers).raise_for_status()
+    ids = [p["id"] for p in sorted(requests.get(f"{base}/printers").json(), key=lambda p: p["id"])]
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        states = requests.get(f"{base}/status").json()["printers"]
+        if sum(1 for s in states if s["connected"]) == len(ids):
+            break
+        time.sleep(0.2)
+
+    session = requests.Session()
+
+    def fanout(command: str, printer_ids) -> tuple:
+        start = time.perf_counter()
+        result = session.post(f"{base}/commands", json={"command": command, "printer_ids": printer_ids}).json()
+        return time.perf_counter() - start, result["counts"].get("ok", 0)
+
+    print("printers\tcommand\tfanout_ms\tacked" + ("\tsequential_ms" if args.sequential else ""))
+    for n in args.sizes:
+        targets = ids[:n]
+        for command in args.commands:
+            runs = [fanout(command, targets) for _ in range(args.repeat)]
+            line = f"{n}\t{command}\t{statistics.median(r[0] for r in runs) * 1000:.1f}\t{min(r[1] for r in runs)}/{n}"
+            if args.sequential:
+                seq = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    for printer_id in targets:
+                        fanout(command, [printer_id])
+                    seq.append(time.perf_counter() - start)
+                line += f"\t{statistics.median(seq) * 1000:.1f}"
+            print(line, flush=True)
+
+    parent_conn.send("stats")
+    parent_conn.recv()
+    server.should_exit = True
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+启动耗时基准：从启动 uvicorn 进程到 HTTP 接口可用的时间，与数据库中打印机数量/是否可达无关才算合格。
+
+    cd backend
+    python -m sim.bench_startup --printers 0 100 1000
+
+打印机 IP 使用 198.18.0.0/15 (基准测试保留网段，不可路由)，模拟全部离线 (TCP 连接会一直挂到超时)。
+每个规模重复 --repeat 次取中位数；另外单独测量 import app.main 的耗时。
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update(
+        DATA_DIR=workdir,
+        DB_PATH=os.path.join(workdir, "bbm.db"),
+        UPLOAD_DIR=os.path.join(workdir, "uploads"),
+        STATIC_DIR=os.path.join(workdir, "static"),
+        THUMBNAIL_DIR=os.path.join(workdir, "thumbnails"),
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        DEFAULT_PRINTER_IP="",
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=os.getcwd(),
+    )
+    return env
+
+_SEED = """
+import sys
+from sqlmodel import Session
+from app.database import create_db_and_tables, engine
+from app.models import Printer
+create_db_and_tables()
+n = int(sys.argv[1])
+with Session(engine) as session:
+    for i in range(n):
+        session.add(Printer(name=f"P{i}", ip=f"198.18.{i // 256}.{i % 256}", access_code="12345678", serial_no=f"OFF{i:06d}"))
+    session.commit()
+"""
+
+def _seed(workdir: str, printers: int):
+    subprocess.run([sys.executable, "-c", _SEED, str(printers)], env=_env(workdir), check=True)
+
+def measure_import(workdir: str) -> float:
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=_env(workdir), capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def measure_ready(workdir: str, timeout: float) -> float:
+    """启动 uvicorn，轮询 /status 直到返回 200，返回耗时 (秒)"""
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        return float("nan")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument("--printers", type=int, nargs="+", default=[0, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    print("printers\timport_s\tready_s")
+    for n in args.printers:
+        workdir = tempfile.mkdtemp(prefix="bambu_bench_startup_")
+        _seed(workdir, n)
+        imports = [measure_import(workdir) for _ in range(args.repeat)]
+        ready = [measure_ready(workdir, args.timeout) for _ in range(args.repeat)]
+        print(f"{n}\t{statistics.median(imports):.3f}\t{statistics.median(ready):.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+打印机状态存储微基准：1k 台打印机的内存占用、整农场查询和上报更新的耗时。
+
+    cd backend
+    python -m sim.bench_state --printers 1000
+
+同一组随机状态分别放进两种实现对比：
+- legacy: StateStore 之前的写法 (sim.legacy_state，每台打印机一个对象 + 一把锁 + 一个 LoggerAdapter，逐台遍历)
+- store: 当前的 StateStore 列存储 + PrinterState 视图 (整列扫描)
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+def _timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="打印机状态存储微基准")
+    parser.add_argument("--printers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--idle-ratio", type=float, default=0.3)
+    parser.add_argument("--cooling-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bambu_bench_state_")
+    os.environ.setdefault("DATA_DIR", workdir)
+    os.environ.setdefault("DB_PATH", os.path.join(workdir, "bbm.db"))
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(workdir, "uploads"))
+    os.environ.setdefault("STATIC_DIR", os.path.join(workdir, "static"))
+    os.environ.setdefault("THUMBNAIL_DIR", os.path.join(workdir, "thumbnails"))
+    os.environ.setdefault("ARCHIVE_DIR", os.path.join(workdir, "archive"))
+    os.environ.setdefault("TRANSFER_DIR", os.path.join(workdir, "transfer"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from app.mqtt_client import PrinterState, PrinterManager
+    from app.state_store import StateStore
+    from sim.legacy_state import LegacyPrinterState
+
+    n = args.printers
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        objs = build()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        return objs, sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    legacy, legacy_mem = measure(lambda: [LegacyPrinterState(f"SIM{i:06d}") for i in range(n)])
+    store_box = {}
+
+    def build_store():
+        store_box["store"] = StateStore()
+        return [PrinterState(f"SIM{i:06d}", store_box["store"]) for i in range(n)]
+
+    states, store_mem = measure(build_store)
+    store = store_box["store"]
+
+    rng = random.Random(0)
+    for old, s in zip(legacy, states):
+        r = rng.random()
+        g_st = 1 if r < args.idle_ratio else 6
+        payload = {"g_st": g_st, "mc_percent": 0 if g_st == 1 else 40, "nozzle_temper": 220.0,
+                   "bed_temper": 60.0, "print_error": 0, "subtask_name": f"bbm-{rng.randint(1, 10 ** 6)}"}
+        for state in (old, s):
+            state.connected = True
+            state.update(payload)
+            if r > 1 - args.cooling_ratio:
+                state.is_cooling_down = True
+                state.last_finish_time = time.time()
+
+    manager = PrinterManager(store)
+    manager.states = {s.serial_no: s for s in states}
+
+    results = {
+        "printers": n,
+        "legacy_state_bytes": legacy_mem,
+        "store_state_bytes": store_mem,
+        "legacy_bytes_per_printer": round(legacy_mem / n, 1),
+        "store_bytes_per_printer": round(store_mem / n, 1),
+        "legacy_idle_ms": _timeit(lambda: [s for s in legacy if s.is_safe_to_print()[0]], args.repeat),
+        "store_idle_ms": _timeit(manager.ready_states, args.repeat),
+        "store_idle_candidates_only_ms": _timeit(store.idle_candidates, args.repeat),
+        "legacy_cooling_ms": _timeit(lambda: [s for s in legacy if s.is_cooling_down], args.repeat),
+        "store_cooling_ms": _timeit(store.cooling_slots, args.repeat),
+        "legacy_status_dicts_ms": _timeit(lambda: {s.serial_no: s.get_status_dict() for s in legacy},
+                                          args.repeat // 4 or 1),
+        "store_status_dicts_ms": _timeit(manager.get_all_states, args.repeat // 4 or 1),
+    }
+
+    # 更新吞吐：4 个线程模拟 MQTT 回调，同时主线程做整农场扫描
+    payload = {"g_st": 6, "mc_percent": 41, "nozzle_temper": 220.4, "bed_temper": 60.1}
+    updates_per_thread = 20000
+
+    def run_updates(objs, scan) -> tuple:
+        stop = False
+        scans = 0
+
+        def writer(offset):
+            for k in range(updates_per_thread):
+                objs[(offset + k) % n].update(payload)
+
+        def reader():
+            nonlocal scans
+            while not stop:
+                scan()
+                scans += 1
+
+        rt = threading.Thread(target=reader)
+        rt.start()
+        writers = [threading.Thread(target=writer, args=(i * 97,)) for i in range(4)]
+        start = time.perf_counter()
+        for t in writers:
+            t.start()
+        for t in writers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stop = True
+        rt.join()
+        return round(elapsed / (updates_per_thread * 4) * 1e6, 2), scans
+
+    results["legacy_update_us"], results["legacy_scans_during_updates"] = run_updates(
+        legacy, lambda: [s for s in legacy if s.is_safe_to_print()[0]])
+    results["store_update_us"], results["store_scans_during_updates"] = run_updates(states, manager.ready_states)
+
+    for key, value in results.items():
+        print(f"{key}\t{round(value, 3) if isinstance(value, float) else value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+精简 3MF 基准：原文件与精简包的传输字节数、生成耗时和 FTPS 上传耗时。
+
+    cd backend
+    python -m sim.bench_transfer path/to/a.gcode.3mf path/to/b.gcode.3mf
+    python -m sim.bench_transfer --plates 1 4 --gcode-mb 5
+
+传入真实切片文件时逐个测量；不传文件时按 Bambu Studio 导出的结构生成样例
+(每盘 gcode + 盘面/挑选/俯视 PNG + 3D 模型 XML + 各类 config)。
+上传到本机模拟 FTPS 服务器 (sim.ftps_server)，并按 UPLOAD_BANDWIDTH 估算真机上的上传时间。
+"""
+import os
+import time
+import random
+import socket
+import zipfile
+import argparse
+import tempfile
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_sliced_3mf(path: str, plates: int, gcode_mb: float, seed: int = 0):
+    """生成结构与 Bambu Studio 导出文件相近的多盘 .gcode.3mf"""
+    rng = random.Random(seed)
+    lines = [f"G1 X{rng.uniform(0, 180):.3f} Y{rng.uniform(0, 180):.3f} E{rng.uniform(0, 0.1):.5f}\n"
+             for _ in range(2000)]
+    block = "".join(lines).encode()
+    gcode = block * max(1, int(gcode_mb * 1024 * 1024 / len(block)))
+    vertices = "".join(f'<vertex x="{rng.uniform(0, 100):.4f}" y="{rng.uniform(0, 100):.4f}" z="{rng.uniform(0, 50):.4f}"/>\n'
+                       for _ in range(60000)).encode()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        z.writestr("_rels/.rels", '<?xml version="1.0"?><Relationships/>')
+        z.writestr("3D/3dmodel.model", b"<model><mesh><vertices>" + vertices + b"</vertices></mesh></model>")
+        z.writestr("Metadata/project_settings.config", '{"filament_type": ["PLA"]}' + " " * 20000)
+        z.writestr("Metadata/model_settings.config", "<config/>")
+        z.writestr("Metadata/_rels/model_settings.config.rels", "<Relationships/>")
+        z.writestr(
+            "Metadata/slice_info.config",
+            '<?xml version="1.0" encoding="UTF-8"?>\n<config><plate>'
+            '<metadata key="index" value="1"/><metadata key="printer_model_id" value="N1"/>'
+            '<metadata key="prediction" value="3600"/></plate></config>\n',
+        )
+        for i in range(1, plates + 1):
+            z.writestr(f"Metadata/plate_{i}.gcode", gcode)
+            z.writestr(f"Metadata/plate_{i}.gcode.md5", "0" * 32)
+            z.writestr(f"Metadata/plate_{i}.json", '{"bbox_objects": []}')
+            z.writestr(f"Metadata/plate_{i}.png", rng.randbytes(180 * 1024))
+            z.writestr(f"Metadata/plate_{i}_small.png", rng.randbytes(12 * 1024))
+            z.writestr(f"Metadata/pick_{i}.png", rng.randbytes(40 * 1024))
+            z.writestr(f"Metadata/top_{i}.png", rng.randbytes(90 * 1024))
+
+def _upload_seconds(path: str, port: int, repeat: int) -> float:
+    from app.file_handler import FileHandler
+    best = float("inf")
+    for k in range(repeat):
+        start = time.perf_counter()
+        assert FileHandler.upload_to_printer(path, f"bench_{k}_{os.path.basename(path)}", "127.0.0.1", "12345678", retries=1)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="精简 3MF 传输基准")
+    parser.add_argument("files", nargs="*", help="真实的切片文件 (.gcode.3mf)")
+    parser.add_argument("--plates", type=int, nargs="+", default=[1, 4], help="样例文件的盘数 (未传文件时)")
+    parser.add_argument("--gcode-mb", type=float, default=5.0, help="样例文件每盘 gcode 大小 (MB)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bambu_bench_transfer_")
+    port = _free_port()
+    os.environ.setdefault("DATA_DIR", workdir)
+    os.environ.setdefault("DB_PATH", os.path.join(workdir, "bbm.db"))
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(workdir, "uploads"))
+    os.environ.setdefault("STATIC_DIR", os.path.join(workdir, "static"))
+    os.environ.setdefault("THUMBNAIL_DIR", os.path.join(workdir, "thumbnails"))
+    os.environ.setdefault("ARCHIVE_DIR", os.path.join(workdir, "archive"))
+    os.environ.setdefault("TRANSFER_DIR", os.path.join(workdir, "transfer"))
+    os.environ["PRINTER_FTP_PORT"] = str(port)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import logging
+    logging.disable(logging.WARNING)
+    from sim.tls import make_server_context
+    from sim.ftps_server import SimFtpsServer, SimSdCard
+    from app.transfer import TransferPreparer
+    from app.config import settings
+
+    server = SimFtpsServer("127.0.0.1", port, make_server_context(), "bblp", "12345678", SimSdCard(16 * 1024 ** 3))
+    server.start()
+
+    files = args.files
+    if not files:
+        files = []
+        for plates in args.plates:
+            path = os.path.join(workdir, f"sample_{plates}plate.gcode.3mf")
+            make_sliced_3mf(path, plates, args.gcode_mb)
+            files.append(path)
+
+    print("file\toriginal_kb\tslim_kb\tsaved_pct\tbuild_ms\tupload_s\tslim_upload_s\test_upload_s\test_slim_upload_s")
+    for path in files:
+        target = os.path.join(workdir, "transfer", os.path.basename(path))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        start = time.perf_counter()
+        slimmed = TransferPreparer.build(path, target)
+        build_ms = (time.perf_counter() - start) * 1000
+        slim_path = target if slimmed else path
+        original, slim = os.path.getsize(path), os.path.getsize(slim_path)
+        print(f"{os.path.basename(path)}\t{original / 1024:.0f}\t{slim / 1024:.0f}\t{(1 - slim / original) * 100:.1f}\t"
+              f"{build_ms:.0f}\t{_upload_seconds(path, port, args.repeat):.3f}\t"
+              f"{_upload_seconds(slim_path, port, args.repeat):.3f}\t"
+              f"{original / settings.UPLOAD_BANDWIDTH:.2f}\t{slim / settings.UPLOAD_BANDWIDTH:.2f}")
+    server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import time
+import argparse
+import logging
+import threading
+from typing import List
+from sim.tls import make_server_context
+from sim.printer import SimPrinter
+
+logger = logging.getLogger(__name__)
+
+class SimFleet:
+    """
+    启动 N 台模拟打印机。每台绑定独立的回环地址 (127.0.0.x)，
+    这样 MQTT/FTPS 端口可以和真机一样全部相同，后端无需任何特殊处理。
+    fail_rate 为每次打印的随机失败概率，前 jammed 台打印机每次都会失败 (模拟堵头的故障机)。
+    """
+    def __init__(self, count: int, base_host: str = "127.0.1.", mqtt_port: int = 18883, ftp_port: int = 10990,
+                 print_duration: float = 10.0, swap_duration: float = 2.0, report_interval: float = 1.0,
+                 access_code: str = "12345678", fail_rate: float = 0.0, jammed: int = 0):
+        if count > 250:
+            raise ValueError("SimFleet supports at most 250 printers per base_host")
+        ssl_ctx = make_server_context()
+        self.mqtt_port = mqtt_port
+        self.ftp_port = ftp_port
+        self.printers: List[SimPrinter] = [
+            SimPrinter(
+                i, f"{base_host}{i + 1}", mqtt_port, ftp_port, ssl_ctx,
+                access_code=access_code, print_duration=print_duration,
+                swap_duration=swap_duration, report_interval=report_interval,
+                fail_rate=fail_rate, jammed=i < jammed,
+            )
+            for i in range(count)
+        ]
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        for p in self.printers:
+            p.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._tick_loop, daemon=True, name="sim-fleet-ticker")
+        self.thread.start()
+        logger.info(f"🧪 已启动 {len(self.printers)} 台模拟打印机 (MQTT:{self.mqtt_port} FTPS:{self.ftp_port})")
+
+    def stop(self):
+        self.running = False
+        for p in self.printers:
+            p.stop()
+
+    def _tick_loop(self):
+        # 单线程推进所有打印机，避免 N 台打印机 N 个计时线程
+        while self.running:
+            now = time.time()
+            for p in self.printers:
+                p.tick(now)
+            time.sleep(0.1)
+
+    def stats(self) -> List[dict]:
+        return [p.stats() for p in self.printers]
+
+def main():
+    parser = argparse.ArgumentParser(description="启动模拟打印机农场")
+    parser.add_argument("--printers", type=int, default=3)
+    parser.add_argument("--mqtt-port", type=int, default=18883)
+    parser.add_argument("--ftp-port", type=int, default=10990)
+    parser.add_argument("--print-duration", type=float, default=60.0)
+    parser.add_argument("--swap-duration", type=float, default=5.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--jammed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fleet = SimFleet(args.printers, mqtt_port=args.mqtt_port, ftp_port=args.ftp_port,
+                     print_duration=args.print_duration, swap_duration=args.swap_duration,
+                     fail_rate=args.fail_rate, jammed=args.jammed)
+    fleet.start()
+    print(f"后端需设置 PRINTER_MQTT_PORT={args.mqtt_port} PRINTER_FTP_PORT={args.ftp_port}")
+    for p in fleet.printers:
+        print(f"{p.name}\tip={p.ip}\taccess_code={p.access_code}\tserial_no={p.serial_no}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import ssl
+import socket
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class SimSdCard:
+    """内存中的 SD 卡 (文件名 -> 内容)，带容量上限"""
+    def __init__(self, capacity: int = 4 * 1024 ** 3):
+        self.capacity = capacity
+        self.files: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+        self.bytes_written = 0
+
+    def used(self) -> int:
+        with self.lock:
+            return sum(len(v) for v in self.files.values())
+
+    def write(self, name: str, data: bytes) -> bool:
+        with self.lock:
+            used = sum(len(v) for k, v in self.files.items() if k != name)
+            if used + len(data) > self.capacity:
+                return False
+            self.files[name] = data
+            self.bytes_written += len(data)
+            return True
+
+    def read(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            return self.files.get(name)
+
+    def delete(self, name: str) -> bool:
+        with self.lock:
+            return self.files.pop(name, None) is not None
+
+    def names(self):
+        with self.lock:
+            return list(self.files)
+
+class SimFtpsServer:
+    """
+    隐式 FTPS 替身 (连接建立即 TLS 握手)，实现 ftplib.FTP_TLS 用到的命令子集：
+    USER/PASS/PBSZ/PROT/TYPE/PWD/CWD/SIZE/PASV/EPSV/STOR/RETR/NLST/LIST/DELE/NOOP/QUIT。
+    """
+    def __init__(self, host: str, port: int, ssl_ctx: ssl.SSLContext, username: str, password: str,
+                 sd_card: SimSdCard):
+        self.host = host
+        self.port = port
+        self.ssl_ctx = ssl_ctx
+        self.username = username
+        self.password = password
+        self.sd_card = sd_card
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(16)
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True, name=f"sim-ftps-{self.host}").start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                raw, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(raw,), daemon=True).start()
+
+    def _serve(self, raw):
+        sock = raw
+        pasv = None
+        try:
+            sock = self.ssl_ctx.wrap_socket(raw, server_side=True)
+            fp = sock.makefile("rb")
+
+            def reply(line: str):
+                sock.sendall((line + "\r\n").encode())
+
+            reply("220 Bambu sim FTP ready")
+            logged_in = False
+            while self.running:
+                line = fp.readline()
+                if not line:
+                    return
+                cmd, _, arg = line.decode().strip().partition(" ")
+                cmd = cmd.upper()
+
+                if cmd == "USER":
+                    reply("331 Password required")
+                elif cmd == "PASS":
+                    logged_in = arg == self.password
+                    reply("230 Logged in" if logged_in else "530 Login incorrect")
+                elif cmd == "QUIT":
+                    reply("221 Bye")
+                    return
+                elif not logged_in:
+                    reply("530 Not logged in")
+                elif cmd in ("PBSZ", "PROT", "TYPE", "NOOP", "CWD"):
+                    reply("200 OK")
+                elif cmd == "PWD":
+                    reply('257 "/" is current directory')
+                elif cmd == "SIZE":
+                    data = self.sd_card.read(arg.lstrip("/"))
+                    reply(f"213 {len(data)}" if data is not None else "550 No such file")
+                elif cmd == "DELE":
+                    reply("250 Deleted" if self.sd_card.delete(arg.lstrip("/")) else "550 No such file")
+                elif cmd in ("PASV", "EPSV"):
+                    if pasv:
+                        pasv.close()
+                    pasv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    pasv.bind((self.host, 0))
+                    pasv.listen(1)
+                    port = pasv.getsockname()[1]
+                    if cmd == "EPSV":
+                        reply(f"229 Entering Extended Passive Mode (|||{port}|)")
+                    else:
+                        h = self.host.replace(".", ",")
+                        reply(f"227 Entering Passive Mode ({h},{port >> 8},{port & 0xFF})")
+                elif cmd in ("STOR", "RETR", "NLST", "LIST"):
+                    if not pasv:
+                        reply("425 Use PASV first")
+                        continue
+                    data_raw, _ = pasv.accept()
+                    pasv.close()
+                    pasv = None
+                    reply("150 Opening data connection")
+                    conn = self.ssl_ctx.wrap_socket(data_raw, server_side=True)
+                    ok = self._transfer(cmd, arg.lstrip("/"), conn)
+                    reply("226 Transfer complete" if ok else "552 Insufficient storage")
+                else:
+                    reply(f"502 {cmd} not implemented")
+        except (OSError, ssl.SSLError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"[sim-ftps {self.host}] 会话异常: {e}")
+        finally:
+            if pasv:
+                pasv.close()
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _transfer(self, cmd: str, name: str, conn: ssl.SSLSocket) -> bool:
+        ok = True
+        try:
+            if cmd == "STOR":
+                chunks = []
+                while True:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                ok = self.sd_card.write(name, b"".join(chunks))
+            elif cmd == "RETR":
+                conn.sendall(self.sd_card.read(name) or b"")
+            else:
+                names = self.sd_card.names()
+                if cmd == "LIST":
+                    lines = [f"-rw-r--r-- 1 root root {len(self.sd_card.read(n) or b'')} Jan 1 00:00 {n}" for n in names]
+                else:
+                    lines = names
+                conn.sendall("".join(l + "\r\n" for l in lines).encode())
+            conn.unwrap()
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+        return ok
@@ -0,0 +1,157 @@
+"""
+列式 StateStore 之前的打印机状态实现 (每台打印机一个普通对象 + 一把锁 + 一个 LoggerAdapter)，
+只给 sim.bench_state 作对比基线用，逻辑与当时的 app.mqtt_client.PrinterState 一致。
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.config import settings
+from app.enums import EventKind
+from app.log import printer_logger
+from app.mqtt_client import JOB_RUNNING, JOB_FINISHED, JOB_FAILED, _JOB_HISTORY
+from app.snapshot import snapshot_cache
+from app.timeline import timeline
+
+logger = logging.getLogger("app.mqtt_client")
+
+class LegacyPrinterState:
+    def __init__(self, serial_no: str):
+        self.serial_no = serial_no
+        self.g_st = -1
+        self.print_error = 0
+        self.progress = 0
+        self.nozzle_temp = 0
+        self.bed_temp = 0
+        self.lock = threading.Lock()
+        self.last_finish_time = 0
+        self.is_cooling_down = False
+        self.connected = False
+        self.last_report_time = 0.0
+        self.job_error = 0
+        self.job_key: Optional[str] = None
+        self.job_outcomes: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.reports_job_ids = False
+        self.log = printer_logger(logger, serial_no)
+
+    def update(self, payload):
+        with self.lock:
+            self.last_report_time = time.time()
+            old_gst = self.g_st
+            old_progress = self.progress
+            old_error = self.print_error
+            old_view = self._view()
+
+            if 'g_st' in payload: self.g_st = int(payload['g_st'])
+            if 'print_error' in payload: self.print_error = int(payload['print_error'])
+            if 'mc_percent' in payload: self.progress = int(payload['mc_percent'])
+            if 'nozzle_temper' in payload: self.nozzle_temp = float(payload['nozzle_temper'])
+            if 'bed_temper' in payload: self.bed_temp = float(payload['bed_temper'])
+            if payload.get('subtask_name'):
+                self.job_key = str(payload['subtask_name'])
+                self.reports_job_ids = True
+            gcode_state = payload.get('gcode_state')
+
+            if self.print_error and self.print_error != old_error:
+                self.job_error = self.print_error
+                self.log.warning("[%s] ⚠️ 打印错误: %s (g_st=%s, progress=%s)",
+                                 self.serial_no, self.print_error, self.g_st, self.progress)
+            elif gcode_state == 'FAILED' and not self.job_error:
+                self.job_error = self.print_error or -1
+
+            gst_finished = (old_gst == 6 and (self.g_st == 100 or self.g_st == 1))
+            progress_finished = (old_progress < 100 and self.progress == 100)
+            if progress_finished and self.print_error == 0:
+                self.job_error = 0
+            if gst_finished or progress_finished:
+                self.last_finish_time = time.time()
+                self.is_cooling_down = True
+                timeline.record(self.serial_no, EventKind.FINISH, self.g_st, self.progress, self.print_error)
+
+            if self.job_key:
+                if gcode_state == 'FAILED' or self.job_error:
+                    self._set_outcome(JOB_FAILED, self.job_error or self.print_error or -1)
+                elif gcode_state == 'FINISH' or gst_finished or progress_finished:
+                    self._set_outcome(JOB_FINISHED, 0)
+                elif gcode_state in ('RUNNING', 'PREPARE', 'PAUSE') or self.g_st == 6:
+                    self._set_outcome(JOB_RUNNING, 0)
+
+            if self.g_st != old_gst:
+                timeline.record(self.serial_no, EventKind.STATE, self.g_st, self.progress, self.print_error)
+            elif self.progress // settings.TIMELINE_PROGRESS_STEP != old_progress // settings.TIMELINE_PROGRESS_STEP:
+                timeline.record(self.serial_no, EventKind.PROGRESS, self.g_st, self.progress, self.print_error)
+            if self.print_error != old_error:
+                timeline.record(self.serial_no, EventKind.ERROR, self.g_st, self.progress, self.print_error)
+
+            if self._view() != old_view:
+                snapshot_cache.invalidate()
+
+            step = settings.LOG_PROGRESS_STEP
+            return ((self.g_st != old_gst) or (self.print_error != old_error) or
+                    (self.progress // step != old_progress // step))
+
+    def _view(self) -> tuple:
+        return (self.g_st, self.print_error, self.progress, int(self.nozzle_temp), int(self.bed_temp),
+                self.is_cooling_down, self.job_key, self.job_error)
+
+    def _set_outcome(self, outcome: str, error: int):
+        current = self.job_outcomes.get(self.job_key)
+        if current and (outcome == JOB_RUNNING or current[0] == JOB_FINISHED):
+            return
+        if current != (outcome, error):
+            self.job_outcomes[self.job_key] = (outcome, error)
+            self.job_outcomes.move_to_end(self.job_key)
+            while len(self.job_outcomes) > _JOB_HISTORY:
+                self.job_outcomes.popitem(last=False)
+
+    def check_cooldown(self):
+        with self.lock:
+            if self.is_cooling_down:
+                if time.time() - self.last_finish_time >= settings.SWAP_COOLDOWN:
+                    self.is_cooling_down = False
+                    snapshot_cache.invalidate()
+                else:
+                    return False
+            return True
+
+    def report_age(self) -> float:
+        if not self.last_report_time:
+            return float("inf")
+        return time.time() - self.last_report_time
+
+    def is_stale(self) -> bool:
+        return self.report_age() > settings.STALE_THRESHOLD
+
+    def is_safe_to_print(self):
+        if not self.connected:
+            return False, "Offline"
+        if self.is_stale():
+            return False, f"Stale (last report {self.report_age():.0f}s ago)"
+        if not self.check_cooldown():
+            return False, "Cooling down"
+        with self.lock:
+            is_idle = (self.g_st == 1)
+            is_unknown_but_likely_idle = (
+                self.g_st == -1 and self.print_error == 0 and (self.progress == 100 or self.progress == 0)
+            )
+            if is_idle or is_unknown_but_likely_idle:
+                return True, "Ready"
+            return False, f"Busy/Error (g_st={self.g_st}, err={self.print_error}, prog={self.progress})"
+
+    def get_status_dict(self):
+        with self.lock:
+            return {
+                "serial_no": self.serial_no,
+                "g_st": self.g_st,
+                "error": self.print_error,
+                "progress": self.progress,
+                "nozzle_temp": self.nozzle_temp,
+                "bed_temp": self.bed_temp,
+                "is_cooling": self.is_cooling_down,
+                "connected": self.connected,
+                "job_error": self.job_error,
+                "job": self.job_key,
+                "stale": self.connected and self.is_stale(),
+                "last_report_age": round(self.report_age(), 1) if self.last_report_time else None
+            }
@@ -0,0 +1,206 @@
+import ssl
+import socket
+import struct
+import logging
+import threading
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# MQTT 3.1.1 报文类型
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+def _encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+def _read_exact(sock, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("peer closed")
+        buf += chunk
+    return bytes(buf)
+
+def _read_str(body: bytes, pos: int):
+    (length,) = struct.unpack_from("!H", body, pos)
+    pos += 2
+    return body[pos:pos + length].decode(), pos + length
+
+class _Session:
+    def __init__(self, sock):
+        self.sock = sock
+        self.subscriptions: List[str] = []
+        self.send_lock = threading.Lock()
+
+    def send(self, packet_type: int, flags: int, body: bytes):
+        data = bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+        with self.send_lock:
+            self.sock.sendall(data)
+
+def _topic_matches(pattern: str, topic: str) -> bool:
+    if pattern == "#" or pattern == topic:
+        return True
+    p_parts, t_parts = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(p_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+class SimMqttServer:
+    """
+    单台打印机的 MQTT 端点替身 (拓竹打印机自己就是 broker)。
+    只实现 paho 用到的 MQTT 3.1.1 子集：CONNECT/SUBSCRIBE/PUBLISH(QoS0/1)/PING/DISCONNECT。
+    """
+    def __init__(self, host: str, port: int, ssl_ctx: ssl.SSLContext, username: str, password: str,
+                 on_publish: Callable[[str, bytes], None]):
+        self.host = host
+        self.port = port
+        self.ssl_ctx = ssl_ctx
+        self.username = username
+        self.password = password
+        self.on_publish = on_publish
+        self.sessions: List[_Session] = []
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(16)
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True, name=f"sim-mqtt-{self.host}").start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for s in sessions:
+            try:
+                s.sock.close()
+            except OSError:
+                pass
+
+    def disconnect_clients(self):
+        """断开所有客户端 (模拟网络抖动/打印机重启)"""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for s in sessions:
+            try:
+                s.sock.shutdown(socket.SHUT_RDWR)
+                s.sock.close()
+            except OSError:
+                pass
+
+    def publish(self, topic: str, payload: bytes):
+        body = struct.pack("!H", len(topic)) + topic.encode() + payload
+        with self.lock:
+            targets = [s for s in self.sessions if any(_topic_matches(p, topic) for p in s.subscriptions)]
+        for s in targets:
+            try:
+                s.send(PUBLISH, 0, body)
+            except OSError:
+                pass
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                raw, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(raw,), daemon=True).start()
+
+    def _serve(self, raw):
+        session = None
+        sock = raw
+        try:
+            sock = self.ssl_ctx.wrap_socket(raw, server_side=True)
+            session = _Session(sock)
+            while self.running:
+                header = _read_exact(sock, 1)[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = _read_exact(sock, 1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = _read_exact(sock, length) if length else b""
+                packet_type, flags = header >> 4, header & 0x0F
+
+                if packet_type == CONNECT:
+                    if not self._check_connect(body):
+                        session.send(CONNACK, 0, b"\x00\x05") # not authorized
+                        return
+                    session.send(CONNACK, 0, b"\x00\x00")
+                    with self.lock:
+                        self.sessions.append(session)
+                elif packet_type == SUBSCRIBE:
+                    pos, granted = 2, bytearray()
+                    while pos < len(body):
+                        topic, pos = _read_str(body, pos)
+                        pos += 1
+                        session.subscriptions.append(topic)
+                        granted.append(0)
+                    session.send(SUBACK, 0, body[:2] + bytes(granted))
+                elif packet_type == UNSUBSCRIBE:
+                    session.send(UNSUBACK, 0, body[:2])
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic, pos = _read_str(body, 0)
+                    if qos:
+                        packet_id = body[pos:pos + 2]
+                        pos += 2
+                        session.send(PUBACK, 0, packet_id)
+                    self.on_publish(topic, body[pos:])
+                elif packet_type == PINGREQ:
+                    session.send(PINGRESP, 0, b"")
+                elif packet_type == DISCONNECT:
+                    return
+        except (OSError, ConnectionError, ssl.SSLError):
+            pass
+        except Exception as e:
+            logger.error(f"[sim-mqtt {self.host}] 会话异常: {e}")
+        finally:
+            if session:
+                with self.lock:
+                    if session in self.sessions:
+                        self.sessions.remove(session)
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _check_connect(self, body: bytes) -> bool:
+        _, pos = _read_str(body, 0) # protocol name
+        pos += 1 # protocol level
+        flags = body[pos]
+        pos += 3 # flags + keepalive
+        _, pos = _read_str(body, pos) # client id
+        if flags & 0x04: # will
+            _, pos = _read_str(body, pos)
+            _, pos = _read_str(body, pos)
+        username = password = None
+        if flags & 0x80:
+            username, pos = _read_str(body, pos)
+        if flags & 0x40:
+            password, pos = _read_str(body, pos)
+        return username == self.username and password == self.password
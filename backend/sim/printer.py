@@ -0,0 +1,250 @@
+import io
+import json
+import time
+import random
+import hashlib
+import logging
+import zipfile
+import threading
+from typing import List, Optional
+from sim.mqtt_server import SimMqttServer
+from sim.ftps_server import SimFtpsServer, SimSdCard
+
+logger = logging.getLogger(__name__)
+
+# g_st 取值与 app.mqtt_client.PrinterState 保持一致
+G_IDLE, G_PRINTING, G_FINISH = 1, 6, 100
+# 模拟的打印失败错误码 (挤出机堵头)
+ERR_NOZZLE_CLOG = 0x0300_8003
+
+class SimPrinter:
+    """
+    模拟一台 A1 mini：
+    - 接收 project_file 指令，校验 SD 卡文件、md5 和其中的 gcode (param)，按 sequence_id 回执 result
+    - 上报中带回下发时的 task_id / subtask_name
+    - 按 print_duration 推进进度，按 report_interval 上报 print 报文 (g_st / mc_percent / 温度)
+    - 打印结束后进入换盘 (swap_duration)，换盘完成回到空闲
+    - 按 fail_rate (或 jammed=True 时每次) 在打印中途报错失败：上报 print_error 和
+      gcode_state=FAILED 后回到空闲，错误码保留到下一次开始打印
+    - 接收 pause / resume / stop 和 ledctrl (system) 指令并回执，暂停期间进度不推进
+    """
+    def __init__(self, index: int, host: str, mqtt_port: int, ftp_port: int, ssl_ctx,
+                 access_code: str = "12345678", print_duration: float = 10.0,
+                 swap_duration: float = 2.0, report_interval: float = 1.0,
+                 sd_capacity: int = 4 * 1024 ** 3, fail_rate: float = 0.0, jammed: bool = False):
+        self.index = index
+        self.name = f"Sim Printer {index}"
+        self.serial_no = f"SIM{index:06d}"
+        self.ip = host
+        self.access_code = access_code
+        self.print_duration = print_duration
+        self.swap_duration = swap_duration
+        self.report_interval = report_interval
+        self.last_report = 0.0
+        self.fail_rate = fail_rate
+        self.jammed = jammed
+        self.will_fail = False
+        self.failed = False
+        self.paused_at = 0.0 # 非 0 表示暂停中
+        self.light = "on"
+
+        self.lock = threading.Lock()
+        self.g_st = G_IDLE
+        self.progress = 0
+        self.print_error = 0
+        self.current_file: Optional[str] = None
+        self.task_id = "0"
+        self.subtask_name = ""
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.idle_since = time.time()
+
+        # 统计
+        self.prints_started = 0
+        self.prints_finished = 0
+        self.prints_failed = 0
+        self.dispatch_gaps: List[float] = [] # 空闲 -> 收到下一条 project_file 的间隔
+        self.start_times: List[float] = []
+        self.rejected = 0
+        self.commands = 0 # 收到的 pause/resume/stop/ledctrl 指令数
+
+        self.sd_card = SimSdCard(sd_capacity)
+        self.mqtt = SimMqttServer(host, mqtt_port, ssl_ctx, "bblp", access_code, self._on_request)
+        self.ftps = SimFtpsServer(host, ftp_port, ssl_ctx, "bblp", access_code, self.sd_card)
+
+    @property
+    def report_topic(self) -> str:
+        return f"device/{self.serial_no}/report"
+
+    def start(self):
+        self.mqtt.start()
+        self.ftps.start()
+
+    def stop(self):
+        self.mqtt.stop()
+        self.ftps.stop()
+
+    # --- 指令处理 ---
+    def _on_request(self, topic: str, payload: bytes):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if "pushing" in data and data["pushing"].get("command") == "pushall":
+            self.report()
+        elif "print" in data:
+            cmd = data["print"]
+            if cmd.get("command") == "project_file":
+                self._start_print(cmd)
+            elif cmd.get("command") in ("pause", "resume", "stop"):
+                self._control(cmd)
+        elif "system" in data and data["system"].get("command") == "ledctrl":
+            cmd = data["system"]
+            with self.lock:
+                self.light = cmd.get("led_mode", self.light)
+                self.commands += 1
+            self._ack("system", cmd, True)
+
+    def _ack(self, section: str, cmd: dict, ok: bool, reason: str = ""):
+        ack = {
+            section: {
+                "command": cmd.get("command"),
+                "sequence_id": cmd.get("sequence_id", "0"),
+                "result": "success" if ok else "fail",
+                "reason": reason,
+            }
+        }
+        self.mqtt.publish(self.report_topic, json.dumps(ack).encode())
+
+    def _control(self, cmd: dict):
+        """pause / resume / stop：只对打印中的任务有效，否则回执 fail"""
+        command, now = cmd["command"], time.time()
+        with self.lock:
+            self.commands += 1
+            ok = self.g_st == G_PRINTING and (command != "resume" or self.paused_at > 0)
+            if ok and command == "pause" and not self.paused_at:
+                self.paused_at = now
+            elif ok and command == "resume":
+                self.started_at += now - self.paused_at # 暂停的时间不计入打印时长
+                self.paused_at = 0.0
+            elif ok and command == "stop":
+                self.g_st = G_IDLE
+                self.failed = True # 真机停止后 gcode_state 为 FAILED
+                self.paused_at = 0.0
+                self.idle_since = now
+                self.prints_failed += 1
+        self._ack("print", cmd, ok, "" if ok else "printer not printing")
+        self.report()
+
+    @staticmethod
+    def _has_plate(content: bytes, param: str) -> bool:
+        """和真机一样要求 3MF 里有指令指定的 gcode (精简包也必须保留它)"""
+        try:
+            with zipfile.ZipFile(io.BytesIO(content)) as z:
+                return param in z.namelist()
+        except zipfile.BadZipFile:
+            return False
+
+    def _start_print(self, cmd: dict):
+        filename = cmd.get("file") or cmd.get("url", "").replace("file:///sdcard/", "")
+        content = self.sd_card.read(filename)
+        with self.lock:
+            ok = (
+                self.g_st == G_IDLE and content is not None and
+                hashlib.md5(content).hexdigest() == cmd.get("md5") and
+                self._has_plate(content, cmd.get("param", ""))
+            )
+            if ok:
+                now = time.time()
+                self.dispatch_gaps.append(now - self.idle_since)
+                self.g_st = G_PRINTING
+                self.progress = 0
+                self.print_error = 0
+                self.failed = False
+                self.will_fail = self.jammed or random.random() < self.fail_rate
+                self.current_file = filename
+                self.task_id = str(cmd.get("task_id", "0"))
+                self.subtask_name = cmd.get("subtask_name", "")
+                self.started_at = now
+                self.prints_started += 1
+                self.start_times.append(now)
+            else:
+                self.rejected += 1
+        if not ok:
+            logger.warning(f"[{self.serial_no}] 拒绝打印 {filename} (g_st={self.g_st}, 文件存在={content is not None})")
+        self._ack("print", cmd, ok, "" if ok else "file check failed or printer busy")
+        self.report()
+
+    # --- 状态推进 (由 SimFleet 的 ticker 线程调用) ---
+    def tick(self, now: float):
+        changed = False
+        with self.lock:
+            if self.g_st == G_PRINTING and not self.paused_at:
+                progress = min(100, int((now - self.started_at) / self.print_duration * 100))
+                if self.will_fail and progress >= 50:
+                    self.g_st = G_IDLE
+                    self.print_error = ERR_NOZZLE_CLOG
+                    self.failed = True
+                    self.idle_since = now
+                    self.prints_failed += 1
+                    changed = True
+                elif progress >= 100:
+                    self.g_st = G_FINISH
+                    self.progress = 100
+                    self.finished_at = now
+                    self.prints_finished += 1
+                    changed = True
+                elif progress != self.progress:
+                    self.progress = progress
+                    changed = True
+            elif self.g_st == G_FINISH and now - self.finished_at >= self.swap_duration:
+                # 换盘完成
+                self.g_st = G_IDLE
+                self.idle_since = now
+                changed = True
+        # 状态变化立即上报，否则按 report_interval 周期上报 (真机打印中约每秒一条)
+        if changed or now - self.last_report >= self.report_interval:
+            self.report()
+
+    def status_payload(self) -> dict:
+        with self.lock:
+            return {
+                "print": {
+                    "command": "push_status",
+                    "sequence_id": str(int(time.time() * 1000)),
+                    "g_st": self.g_st,
+                    "gcode_state": self._gcode_state(),
+                    "mc_percent": self.progress,
+                    "print_error": self.print_error,
+                    "gcode_file": self.current_file or "",
+                    "task_id": self.task_id,
+                    "subtask_name": self.subtask_name,
+                    "nozzle_temper": 220.0 + random.random() if self.g_st == G_PRINTING else 25.0,
+                    "bed_temper": 65.0 if self.g_st == G_PRINTING else 25.0,
+                }
+            }
+
+    def _gcode_state(self) -> str:
+        if self.failed:
+            return "FAILED"
+        if self.paused_at:
+            return "PAUSE"
+        return {G_PRINTING: "RUNNING", G_FINISH: "FINISH"}.get(self.g_st, "IDLE")
+
+    def report(self):
+        self.last_report = time.time()
+        self.mqtt.publish(self.report_topic, json.dumps(self.status_payload()).encode())
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "serial_no": self.serial_no,
+                "prints_started": self.prints_started,
+                "prints_finished": self.prints_finished,
+                "prints_failed": self.prints_failed,
+                "rejected": self.rejected,
+                "commands": self.commands,
+                "dispatch_gaps": list(self.dispatch_gaps),
+                "start_times": list(self.start_times),
+                "sd_bytes_written": self.sd_card.bytes_written,
+            }
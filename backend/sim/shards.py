@@ -0,0 +1,170 @@
+"""
+多节点分片的本地多进程测试：几个后端进程共用一个 SQLite 数据库和上传目录，各自负责一部分模拟打印机。
+
+    cd backend
+    python -m sim.shards --printers 6 --jobs 3
+
+节点 a 负责 east，节点 b 负责 west，节点 c 同时配置了 east,west (后启动，作为备份)。
+每台打印机指定 --jobs 个任务 (至少 2 个)，east 的打印机都开始第一个任务后 kill -9 节点 a，检查：
+- c 在租约过期后接管 east，east 剩下的任务全部在接管后被派单
+- 所有任务都完成，且没有任务被下发两次 (模拟打印机收到的 project_file 总数 == 任务数)
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import requests
+from sim.bench import _fleet_process, _free_port, make_fake_3mf
+
+NODES = [("a", "east"), ("b", "west"), ("c", "east,west")]
+
+def _start_node(node_id: str, sites: str, env: dict) -> tuple:
+    port = _free_port()
+    node_env = dict(env, NODE_ID=node_id, NODE_SITES=sites)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=node_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base}/status", timeout=1).ok:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"node {node_id} did not start")
+
+def _wait(predicate, timeout: float, interval: float = 0.5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="多节点分片本地测试")
+    parser.add_argument("--printers", type=int, default=6)
+    parser.add_argument("--jobs", type=int, default=3, help="每台打印机的任务数")
+    parser.add_argument("--print-duration", type=float, default=4.0)
+    parser.add_argument("--swap-duration", type=float, default=1.0)
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    parser.add_argument("--mqtt-port", type=int, default=18883)
+    parser.add_argument("--ftp-port", type=int, default=10990)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    if args.printers < 2 or args.jobs < 2:
+        parser.error("至少需要 2 台打印机 (east/west 各一台) 和每台 2 个任务 (接管后 east 还有任务可派)")
+
+    workdir = tempfile.mkdtemp(prefix="bambu_shards_")
+    env = dict(os.environ)
+    env.update(
+        DATA_DIR=workdir,
+        DB_PATH=os.path.join(workdir, "bbm.db"),
+        UPLOAD_DIR=os.path.join(workdir, "uploads"),
+        STATIC_DIR=os.path.join(workdir, "static"),
+        THUMBNAIL_DIR=os.path.join(workdir, "thumbnails"),
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        TRANSFER_DIR=os.path.join(workdir, "transfer"),
+        DEFAULT_PRINTER_IP="",
+        PRINTER_MQTT_PORT=str(args.mqtt_port),
+        PRINTER_FTP_PORT=str(args.ftp_port),
+        SWAP_COOLDOWN="1",
+        SCHEDULER_INTERVAL="0.5",
+        SHARD_LEASE_TTL=str(args.lease_ttl),
+        SHARD_RENEW_INTERVAL=str(args.lease_ttl / 3),
+        SHARD_CLOCK_MARGIN=str(args.lease_ttl / 6), # 同一台机器，时钟一致
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=os.getcwd(),
+    )
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    fleet_proc = multiprocessing.Process(
+        target=_fleet_process,
+        args=(child_conn, args.printers, args.mqtt_port, args.ftp_port, args.print_duration,
+              args.swap_duration, 0.0, 0),
+        daemon=True,
+    )
+    fleet_proc.start()
+    sim_printers = parent_conn.recv()
+
+    # 依次启动 (建表不能并发)，c 最后启动，两个分片都已被 a/b 持有，c 只作为备份
+    nodes = {}
+    for node_id, sites in NODES:
+        nodes[node_id] = _start_node(node_id, sites, env)
+    base_a, base_b, base_c = (nodes[n][1] for n in ("a", "b", "c"))
+
+    for i, p in enumerate(sim_printers):
+        requests.post(f"{base_a}/printers", json=dict(p, site="east" if i % 2 == 0 else "west")).raise_for_status()
+
+    def owned(base):
+        return requests.get(f"{base}/shards").json()["owned_sites"]
+
+    ok = _wait(lambda: owned(base_a) == ["east"] and owned(base_b) == ["west"], 10 * args.lease_ttl)
+    print(f"leases: a={owned(base_a)} b={owned(base_b)} c={owned(base_c)}")
+    if not ok:
+        print("❌ initial lease assignment failed")
+
+    # 任务指定到打印机：east 的任务只能由负责 east 的节点派发，接管后一定还有 east 任务可检查
+    total = args.printers * args.jobs
+    path = os.path.join(workdir, "job.gcode.3mf")
+    make_fake_3mf(path, 0.5, int(args.print_duration))
+    printers = sorted(requests.get(f"{base_b}/printers").json(), key=lambda p: p["id"])
+    east_ids = {p["id"] for p in printers if p["site"] == "east"}
+    t0 = time.time()
+    for p in printers:
+        with open(path, "rb") as f:
+            requests.post(f"{base_b}/upload", files={"file": ("job.gcode.3mf", f)},
+                          data={"repeat_count": args.jobs, "printer_id": p["id"]}).raise_for_status()
+
+    def count(base, status):
+        return sum(1 for t in requests.get(f"{base}/tasks").json() if t["status"] == status)
+
+    def east_tasks(status):
+        return sum(1 for t in requests.get(f"{base_b}/tasks").json()
+                   if t["status"] == status and t["assigned_printer_id"] in east_ids)
+
+    # east 的打印机都开始第一个任务后杀掉节点 a (不给它释放租约的机会)，剩下的 east 任务必须由 c 派发
+    _wait(lambda: east_tasks("printing") + east_tasks("completed") >= len(east_ids), args.timeout, 0.1)
+    nodes["a"][0].send_signal(signal.SIGKILL)
+    killed_at = time.time()
+    east_pending = east_tasks("pending")
+    print(f"killed node a at {killed_at - t0:.1f}s ({count(base_b, 'completed')}/{total} completed, "
+          f"{east_pending} east tasks pending)")
+
+    took_over = _wait(lambda: "east" in owned(base_c), 10 * args.lease_ttl, 0.2)
+    print(f"failover: c={owned(base_c)} after {time.time() - killed_at:.1f}s")
+
+    finished = _wait(lambda: count(base_b, "completed") == total, args.timeout)
+    elapsed = time.time() - t0
+
+    parent_conn.send("stats")
+    stats = parent_conn.recv()
+    for _, (proc, _) in nodes.items():
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait(10)
+    fleet_proc.join(timeout=5)
+
+    started = sum(s["prints_started"] for s in stats)
+    east_after = sum(1 for i, s in enumerate(stats) if i % 2 == 0 for t in s["start_times"] if t > killed_at)
+    print(f"completed {count_done(workdir)}/{total} in {elapsed:.1f}s, prints started {started}, "
+          f"east prints after failover {east_after}/{east_pending}")
+    passed = ok and took_over and finished and started == total and east_pending > 0 and east_after >= east_pending
+    print("✅ PASS" if passed else "❌ FAIL")
+    os._exit(0 if passed else 1)
+
+def count_done(workdir: str) -> int:
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, "bbm.db")) as conn:
+        return conn.execute("SELECT COUNT(*) FROM task WHERE status = 'completed'").fetchone()[0]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+import ssl
+import subprocess
+import tempfile
+
+def make_server_context(cert_dir: str = None) -> ssl.SSLContext:
+    """生成自签名证书并返回服务端 SSL 上下文 (打印机本身也是自签名证书，客户端不校验)"""
+    cert_dir = cert_dir or tempfile.mkdtemp(prefix="bambu_sim_")
+    cert = os.path.join(cert_dir, "cert.pem")
+    key = os.path.join(cert_dir, "key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+             "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=bambu-sim"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx